@@ -0,0 +1,93 @@
+"""
+凭证轮换基准测试：对比旧的每次全量扫描写法与就绪环 + 过期堆
+
+用法:
+    python benchmarks/bench_credential_rotation.py [--sizes 10,100,1000,10000] [--calls 20000]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.codebuddy_token_manager import CodeBuddyTokenManager  # noqa: E402
+
+
+def build_manager(size: int, creds_dir: str) -> CodeBuddyTokenManager:
+    """在内存中构造 size 个凭证，其中约 10% 已过期"""
+    manager = CodeBuddyTokenManager(creds_dir=creds_dir)
+    now = int(time.time())
+    manager.credentials = []
+    for i in range(size):
+        expired = i % 10 == 9
+        manager.credentials.append({
+            "file_path": os.path.join(creds_dir, f"cred_{i}.json"),
+            "data": {
+                "bearer_token": f"token-{i}",
+                "user_id": f"user-{i}",
+                "created_at": now - (7200 if expired else 0),
+                "expires_in": 3600,
+            },
+        })
+    manager._rebuild_indexes()
+    return manager
+
+
+def legacy_next_credential(manager: CodeBuddyTokenManager, state: dict, rotation_count: int = 1):
+    """旧实现：每次请求扫描全部凭证、检查过期，并用 list.index 定位当前位置"""
+    valid_credentials = []
+    for i, cred in enumerate(manager.credentials):
+        if not manager.is_token_expired(cred["data"]):
+            valid_credentials.append((i, cred))
+    if not valid_credentials:
+        return None
+
+    current_valid_indices = [i for i, _ in valid_credentials]
+    if state["current_index"] not in current_valid_indices:
+        state["current_index"] = current_valid_indices[0]
+        state["usage_count"] = 0
+    current_valid_position = current_valid_indices.index(state["current_index"])
+
+    if state["usage_count"] >= rotation_count:
+        next_valid_position = (current_valid_position + 1) % len(valid_credentials)
+        state["current_index"] = current_valid_indices[next_valid_position]
+        state["usage_count"] = 0
+
+    state["usage_count"] += 1
+    return manager.credentials[state["current_index"]]["data"]
+
+
+def bench(func, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="凭证数量列表，逗号分隔")
+    parser.add_argument("--calls", type=int, default=20000, help="每种规模的调用次数上限")
+    args = parser.parse_args()
+
+    # 旧实现每个过期凭证都会打一条 warning，基准中关闭日志以只比较算法本身
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'credentials':>12} {'legacy us/call':>16} {'ring us/call':>14} {'speedup':>9}")
+    with tempfile.TemporaryDirectory() as creds_dir:
+        for size in (int(s) for s in args.sizes.split(",")):
+            manager = build_manager(size, creds_dir)
+            # 旧实现为 O(n)，大规模时减少调用次数以控制耗时
+            calls = max(200, min(args.calls, args.calls * 100 // size))
+
+            state = {"current_index": -1, "usage_count": 0}
+            legacy = bench(lambda: legacy_next_credential(manager, state), calls)
+            ring = bench(manager.get_next_credential, calls)
+            print(f"{size:>12} {legacy:>16.2f} {ring:>14.2f} {legacy / ring:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+凭证存储基准测试：对比目录后端（每个凭证一个 JSON 文件）与 SQLite 后端的启动加载、选择与查询耗时
+
+用法:
+    python benchmarks/bench_credential_store.py [--size 5000] [--calls 20000]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.codebuddy_token_manager import CodeBuddyTokenManager  # noqa: E402
+from src.credential_store import DirectoryCredentialStore, SQLiteCredentialStore  # noqa: E402
+
+
+def build_directory(size: int, creds_dir: str):
+    """写入 size 个凭证文件，带有与真实凭证相近的 full_response 数据，其中约 10% 已过期"""
+    now = int(time.time())
+    for i in range(size):
+        expired = i % 10 == 9
+        data = {
+            "bearer_token": f"token-{i}-" + "x" * 800,
+            "refresh_token": f"refresh-{i}-" + "y" * 800,
+            "user_id": f"user-{i}@example.com",
+            "created_at": now - (7200 if expired else 0),
+            "expires_in": 3600,
+            "token_type": "Bearer",
+            "full_response": {"code": 0, "data": {"accessToken": "x" * 800, "refreshToken": "y" * 800}},
+        }
+        with open(os.path.join(creds_dir, f"codebuddy_{i}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench_selection(manager: CodeBuddyTokenManager, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        manager.get_next_credential()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=5000, help="凭证数量")
+    parser.add_argument("--calls", type=int, default=20000, help="选择凭证的调用次数")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as root:
+        creds_dir = os.path.join(root, "creds")
+        os.makedirs(creds_dir)
+        build_directory(args.size, creds_dir)
+
+        sqlite_store = SQLiteCredentialStore(creds_dir, os.path.join(root, "credentials.db"))
+        migrated, migrate_time = timed(sqlite_store.migrate_from_directory)
+        print(f"credentials: {args.size}, migrated {migrated} into SQLite in {migrate_time * 1000:.1f} ms\n")
+
+        print(f"{'backend':>10} {'startup ms':>12} {'select us/call':>16} {'expiring query ms':>19} {'user lookup ms':>16}")
+        for store in (DirectoryCredentialStore(creds_dir), sqlite_store):
+            # 丢弃第一次加载，避免只测到冷缓存
+            store.load_all()
+            manager, startup = timed(lambda: CodeBuddyTokenManager(creds_dir=creds_dir, store=store))
+            select = bench_selection(manager, args.calls)
+
+            deadline = int(time.time()) + 600
+            target_user = f"user-{args.size // 2}@example.com"
+            if isinstance(store, SQLiteCredentialStore):
+                _, expiring = timed(lambda: store.keys_expiring_before(deadline))
+                _, lookup = timed(lambda: store.keys_for_user(target_user))
+            else:
+                # 目录后端只能加载全部凭证后在内存中过滤
+                def scan_expiring():
+                    return [k for k, d in store.load_all() if d["created_at"] + d["expires_in"] <= deadline]
+
+                def scan_user():
+                    return [k for k, d in store.load_all() if d.get("user_id") == target_user]
+
+                _, expiring = timed(scan_expiring)
+                _, lookup = timed(scan_user)
+
+            print(f"{store.name:>10} {startup * 1000:>12.1f} {select:>16.2f} {expiring * 1000:>19.2f} {lookup * 1000:>16.2f}")
+
+        sqlite_store.close()
+
+
+if __name__ == "__main__":
+    main()
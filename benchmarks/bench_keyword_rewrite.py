@@ -0,0 +1,103 @@
+"""
+关键词替换基准测试：对比旧的逐条 str.replace 链与编译后的单遍替换（CompiledRules）
+
+分别在默认的 5 条规则和追加了若干规则的情况下，对 30–100KB 的 agent 风格系统提示词计时，
+并检查两种实现在默认规则下输出一致。最后一列是同一内容再次到达时（新的请求解析出的新字符串对象）
+经 TransformCache 命中的耗时。
+
+用法:
+    python benchmarks/bench_keyword_rewrite.py [--kb 30,100] [--extra-rules 0,20,50] [--rounds 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from config import get_keyword_replacements  # noqa: E402
+from src.keyword_rewriter import CompiledRules, parse_rules  # noqa: E402
+from src.transform_cache import TransformCache, text_size  # noqa: E402
+
+WORDS = (
+    "the tool file path function returns error when user request code review test "
+    "should must never always output format markdown example command shell git commit"
+).split()
+
+
+def build_prompt(target_kb: int, seed: int = 42) -> str:
+    """构造一个约 target_kb KB 的系统提示词，其中散布着需要替换的关键词"""
+    rng = random.Random(seed)
+    header = (
+        "You are Claude Code, Anthropic's official CLI for Claude.\n"
+        "If the user asks for help, report issues at https://github.com/anthropics/claude-code/issues\n"
+    )
+    parts = [header]
+    size = len(header)
+    while size < target_kb * 1024:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20)))
+        if rng.random() < 0.05:
+            sentence += " Claude" if rng.random() < 0.7 else " Anthropic"
+        sentence += ".\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)
+
+
+def legacy_chain(rules: dict):
+    """旧实现：按顺序对整段文本逐条调用 str.replace"""
+    items = list(rules.items())
+
+    def rewrite(text: str) -> str:
+        for source, target in items:
+            text = text.replace(source, target)
+        return text
+    return rewrite
+
+
+def timed(func, text: str, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(text)
+    return (time.perf_counter() - start) / rounds
+
+
+def timed_cached(compiled: CompiledRules, text: str, rounds: int) -> float:
+    """缓存命中：每轮使用内容相同的新字符串对象，包含哈希与逐字节比较的开销"""
+    cache = TransformCache()
+    cache.get_or_compute("bench", text, lambda: compiled.rewrite(text), lambda v: text_size(text, v))
+    copies = ["".join(text) for _ in range(rounds)]
+    start = time.perf_counter()
+    for copy in copies:
+        cache.get_or_compute("bench", copy, lambda: compiled.rewrite(copy), lambda v: text_size(copy, v))
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", default="30,100", help="提示词大小列表（KB），逗号分隔")
+    parser.add_argument("--extra-rules", default="0,20,50", help="在默认规则之外追加的规则数列表")
+    parser.add_argument("--rounds", type=int, default=200, help="每项计时的重复次数")
+    args = parser.parse_args()
+
+    default_rules = parse_rules(get_keyword_replacements())
+    print(f"{'prompt':>8} {'rules':>6} {'str.replace chain':>18} {'compiled':>10} {'speedup':>8} {'cache hit':>10}")
+    for kb in (int(k) for k in args.kb.split(",")):
+        text = build_prompt(kb)
+        for extra in (int(n) for n in args.extra_rules.split(",")):
+            rules = dict(default_rules)
+            rules.update({f"ExtraKeyword{i}": f"Replacement{i}" for i in range(extra)})
+            chain = legacy_chain(rules)
+            compiled = CompiledRules(rules)
+            if extra == 0 and chain(text) != compiled.rewrite(text):
+                raise SystemExit("outputs differ for the default rules")
+            legacy = timed(chain, text, args.rounds)
+            single = timed(compiled.rewrite, text, args.rounds)
+            cached = timed_cached(compiled, text, args.rounds)
+            print(f"{kb:>6}KB {len(rules):>6} {legacy * 1e3:>16.3f}ms {single * 1e3:>8.3f}ms "
+                  f"{legacy / single:>7.2f}x {cached * 1e3:>8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+SSE 解析基准测试：对比旧的逐分块 split('\\n') + 字符串累加写法与 SSEDecoder
+
+用法:
+    python benchmarks/bench_sse_parser.py [--mb 8] [--chunk 1024]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.sse_parser import SSEDecoder  # noqa: E402
+
+
+def build_stream(target_bytes: int) -> bytes:
+    """构造一个约 target_bytes 大小的 OpenAI 风格 SSE 流"""
+    parts = []
+    size = 0
+    i = 0
+    while size < target_bytes:
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "model": "claude-4.0",
+            "choices": [{"index": 0, "delta": {"content": f"token-{i} 你好 "}}],
+        }
+        line = b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n"
+        parts.append(line)
+        size += len(line)
+        i += 1
+    parts.append(b"data: [DONE]\n\n")
+    return b"".join(parts)
+
+
+def split_chunks(data: bytes, avg_chunk: int, seed: int = 42):
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        n = rng.randint(1, avg_chunk * 2)
+        chunks.append(data[pos:pos + n])
+        pos += n
+    return chunks
+
+
+def legacy_parse(chunks):
+    """旧实现：每个分块独立按行切分，并把全部文本累加到 response_text"""
+    response_text = ""
+    parsed = 0
+    for chunk in chunks:
+        chunk_str = chunk.decode("utf-8", errors="replace")
+        response_text += chunk_str
+        for line in chunk_str.split("\n"):
+            if line.startswith("data: "):
+                data_str = line[6:]
+                if data_str.strip() == "[DONE]":
+                    return parsed
+                try:
+                    json.loads(data_str)
+                    parsed += 1
+                except json.JSONDecodeError:
+                    continue
+    return parsed
+
+
+def decoder_parse(chunks):
+    decoder = SSEDecoder()
+    parsed = 0
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            if event.is_done:
+                return parsed
+            parsed += len(event.json_payloads())
+    return parsed
+
+
+def bench(name, fn, chunks, expected):
+    start = time.perf_counter()
+    parsed = fn(chunks)
+    elapsed = time.perf_counter() - start
+    lost = expected - parsed
+    print(f"  {name:<10} {elapsed * 1000:9.1f} ms   parsed={parsed:<8} lost={lost}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--chunk", type=int, default=1024, help="average chunk size in bytes")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    for mb in args.mb:
+        data = build_stream(int(mb * 1024 * 1024))
+        expected = data.count(b"\n\n") - 1
+        chunks = split_chunks(data, args.chunk)
+        print(f"{mb} MB stream, {len(chunks)} chunks (avg {args.chunk} B), {expected} events")
+        bench("legacy", legacy_parse, chunks, expected)
+        bench("decoder", decoder_parse, chunks, expected)
+
+
+if __name__ == "__main__":
+    main()
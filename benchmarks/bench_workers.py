@@ -0,0 +1,205 @@
+"""
+多 worker 吞吐基准测试：在本机模拟上游，分别以不同 worker 数启动 web.py，测量聊天请求吞吐与轮换公平性
+
+每轮会启动一个模拟上游（返回固定的 SSE 流）和一个 CODEBUDDY_WORKERS=N 的服务，
+用多个客户端进程并发发送流式请求，最后从 /api/stats 读取合并后的凭证使用次数，检查轮换是否均匀。
+
+用法:
+    python benchmarks/bench_workers.py [--workers 1,2,4] [--duration 10] [--concurrency 64] [--clients 4]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PASSWORD = "bench"
+CREDENTIALS = 8
+
+
+def _sse_body() -> bytes:
+    chunks = [
+        {"id": "bench", "object": "chat.completion.chunk", "model": "m",
+         "choices": [{"index": 0, "delta": {"content": f"token {i} "}}]}
+        for i in range(20)
+    ]
+    chunks.append({"id": "bench", "object": "chat.completion.chunk", "model": "m",
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    return b"".join(b"data: " + json.dumps(c).encode() + b"\n\n" for c in chunks) + b"data: [DONE]\n\n"
+
+
+SSE_BODY = _sse_body()
+
+
+async def mock_upstream(scope, receive, send):
+    """模拟上游：读完请求体后以几个分块返回 SSE 流"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    while (await receive()).get("more_body"):
+        pass
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream")]})
+    step = len(SSE_BODY) // 4 + 1
+    for i in range(0, len(SSE_BODY), step):
+        await send({"type": "http.response.body", "body": SSE_BODY[i:i + step], "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 60.0):
+    import httpx
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def write_credentials(creds_dir: str):
+    now = int(time.time())
+    for i in range(CREDENTIALS):
+        with open(os.path.join(creds_dir, f"bench_{i}.json"), "w", encoding="utf-8") as f:
+            json.dump({"bearer_token": f"bench-token-{i}", "user_id": f"bench-{i}",
+                       "created_at": now, "expires_in": 86400}, f)
+
+
+def client_process(url: str, concurrency: int, duration: float, result_queue):
+    """一个客户端进程：concurrency 个协程循环发送流式请求，返回完成数与错误数"""
+    import asyncio
+    import httpx
+
+    async def run():
+        done = errors = 0
+        deadline = time.monotonic() + duration
+        headers = {"Authorization": f"Bearer {PASSWORD}"}
+        body = {"model": "claude-4.0", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+            async def worker():
+                nonlocal done, errors
+                while time.monotonic() < deadline:
+                    try:
+                        async with client.stream("POST", url, json=body, headers=headers) as response:
+                            async for _ in response.aiter_bytes():
+                                pass
+                        if response.status_code == 200:
+                            done += 1
+                        else:
+                            errors += 1
+                    except httpx.HTTPError:
+                        errors += 1
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return done, errors
+
+    result_queue.put(asyncio.run(run()))
+
+
+def run_round(workers: int, args, upstream_port: int) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as root:
+        creds_dir = os.path.join(root, "creds")
+        os.makedirs(creds_dir)
+        write_credentials(creds_dir)
+        env = dict(
+            os.environ,
+            CODEBUDDY_HOST="127.0.0.1",
+            CODEBUDDY_PORT=str(port),
+            CODEBUDDY_PASSWORD=PASSWORD,
+            CODEBUDDY_API_ENDPOINT=f"http://127.0.0.1:{upstream_port}",
+            CODEBUDDY_CREDS_DIR=creds_dir,
+            CODEBUDDY_WORKERS=str(workers),
+            CODEBUDDY_LOG_LEVEL="WARNING",
+            CODEBUDDY_RATE_LIMIT_ENABLED="false",
+            CODEBUDDY_MAX_IN_FLIGHT="0",
+        )
+        # web.py 从工作目录读取 config/config.json，在临时目录中运行以免读到本地配置
+        env["PYTHONPATH"] = ROOT
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, "web.py")], cwd=root, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f"{base}/api/ready")
+            queue = multiprocessing.Queue()
+            per_client = max(1, args.concurrency // args.clients)
+            clients = [
+                multiprocessing.Process(target=client_process,
+                                        args=(f"{base}/codebuddy/v1/chat/completions", per_client, args.duration, queue))
+                for _ in range(args.clients)
+            ]
+            start = time.perf_counter()
+            for c in clients:
+                c.start()
+            results = [queue.get() for _ in clients]
+            elapsed = time.perf_counter() - start
+            for c in clients:
+                c.join()
+
+            # 等待各 worker 发布最新统计
+            time.sleep(2.5)
+            import httpx
+            stats = httpx.get(f"{base}/api/stats", headers={"Authorization": f"Bearer {PASSWORD}"}).json()
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    done = sum(r[0] for r in results)
+    usage = stats.get("credential_usage", {})
+    counts = [usage.get(f"bench_{i}.json", 0) for i in range(CREDENTIALS)]
+    return {
+        "workers": workers,
+        "rps": done / elapsed,
+        "errors": sum(r[1] for r in results),
+        "spread": (max(counts) - min(counts)) if counts else 0,
+        "total": sum(counts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="worker 数列表，逗号分隔")
+    parser.add_argument("--duration", type=float, default=10.0, help="每轮压测时长（秒）")
+    parser.add_argument("--concurrency", type=int, default=64, help="总并发请求数")
+    parser.add_argument("--clients", type=int, default=4, help="客户端进程数")
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, "-m", "hypercorn", "benchmarks.bench_workers:mock_upstream",
+         "--bind", f"127.0.0.1:{upstream_port}", "--workers", str(max(2, (os.cpu_count() or 2) // 2))],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{upstream_port}/")
+        print(f"cpus: {os.cpu_count()}, credentials: {CREDENTIALS}, concurrency: {args.concurrency}")
+        print(f"{'workers':>8} {'req/s':>10} {'errors':>8} {'requests':>10} {'usage spread':>14}")
+        for workers in (int(w) for w in args.workers.split(",")):
+            r = run_round(workers, args, upstream_port)
+            print(f"{r['workers']:>8} {r['rps']:>10.1f} {r['errors']:>8} {r['total']:>10} {r['spread']:>14}")
+    finally:
+        upstream.terminate()
+        upstream.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,7 +27,57 @@ _DEFAULT_CONFIG = {
     "CODEBUDDY_CREDS_DIR": ".codebuddy_creds",
     "CODEBUDDY_LOG_LEVEL": "INFO",
     "CODEBUDDY_MODELS": "claude-4.0,claude-3.7,gpt-5,gpt-5-mini,gpt-5-nano,o4-mini,gemini-2.5-flash,gemini-2.5-pro,auto-chat",
-    "CODEBUDDY_ROTATION_COUNT": 1
+    "CODEBUDDY_ROTATION_COUNT": 1,
+    "CODEBUDDY_HTTP2": False,
+    "CODEBUDDY_POOL_MAX_CONNECTIONS": 100,
+    "CODEBUDDY_POOL_MAX_KEEPALIVE": 20,
+    "CODEBUDDY_POOL_KEEPALIVE_EXPIRY": 30.0,
+    "CODEBUDDY_WARMUP_CONNECTIONS": 0,
+    "CODEBUDDY_WARMUP_INTERVAL": 0.0,
+    "CODEBUDDY_HEDGE_ENABLED": False,
+    "CODEBUDDY_HEDGE_DELAY": 0.0,
+    "CODEBUDDY_HEDGE_MAX_PER_MINUTE": 10,
+    "CODEBUDDY_RETRY_ATTEMPTS": 3,
+    "CODEBUDDY_RETRY_BACKOFF": 0.5,
+    "CODEBUDDY_RETRY_STATUS_CODES": "401,403,429,500,502,503,504",
+    "CODEBUDDY_SELECTION_STRATEGY": "round_robin",
+    "CODEBUDDY_BREAKER_FAILURE_THRESHOLD": 5,
+    "CODEBUDDY_BREAKER_ERROR_RATE": 0.5,
+    "CODEBUDDY_BREAKER_WINDOW": 20,
+    "CODEBUDDY_BREAKER_COOLDOWN": 30.0,
+    "CODEBUDDY_RATE_LIMIT_ENABLED": True,
+    "CODEBUDDY_RATE_LIMIT_BURST": 5.0,
+    "CODEBUDDY_RATE_LIMIT_MIN": 0.1,
+    "CODEBUDDY_RATE_LIMIT_MAX": 20.0,
+    "CODEBUDDY_RATE_LIMIT_MAX_WAIT": 10.0,
+    "CODEBUDDY_MAX_IN_FLIGHT": 100,
+    "CODEBUDDY_MAX_QUEUE": 200,
+    "CODEBUDDY_QUEUE_TIMEOUT": 30.0,
+    "CODEBUDDY_CREDS_WATCH_INTERVAL": 5.0,
+    "CODEBUDDY_CREDS_BACKEND": "directory",
+    "CODEBUDDY_CREDS_DB": "",
+    "CODEBUDDY_WORKERS": 1,
+    "CODEBUDDY_SHARED_STATE_DB": "",
+    "CODEBUDDY_STATS_RETENTION_MINUTES": 60,
+    "CODEBUDDY_STATS_MAX_KEYS": 1000,
+    "CODEBUDDY_STATS_PERSIST_ENABLED": True,
+    "CODEBUDDY_STATS_DB": "",
+    "CODEBUDDY_STATS_FLUSH_INTERVAL": 30.0,
+    "CODEBUDDY_STATS_HOURLY_RETENTION_DAYS": 7,
+    "CODEBUDDY_STATS_DAILY_RETENTION_DAYS": 365,
+    "CODEBUDDY_KEYWORD_REPLACEMENTS": json.dumps({
+        "Claude Code": "CodeBuddy Code",
+        "Anthropic's official CLI for Claude": "Tencent's official CLI for CodeBuddy",
+        "Claude": "CodeBuddy",
+        "Anthropic": "Tencent",
+        "https://github.com/anthropics/claude-code/issues": "https://cnb.cool/codebuddy/codebuddy-code/-/issues"
+    }, ensure_ascii=False),
+    "CODEBUDDY_RESPONSE_REWRITE_ENABLED": False,
+    "CODEBUDDY_RESPONSE_REPLACEMENTS": "",
+    "CODEBUDDY_TRANSFORM_CACHE_MB": 64,
+    "CODEBUDDY_RESPONSE_CACHE_ENABLED": False,
+    "CODEBUDDY_RESPONSE_CACHE_MB": 64,
+    "CODEBUDDY_RESPONSE_CACHE_TTL": 3600.0
 }
 
 # --- Core Functions ---
@@ -83,19 +133,17 @@ def save_config_to_json():
     Saves the entire current in-memory configuration to config.json.
     This is simpler and more robust, ensuring a complete snapshot is always saved.
     This will create the file if it doesn't exist.
+    The file is written to a temp file, fsynced and atomically renamed, so a crash
+    never leaves a truncated config.json. Blocking; call it via asyncio.to_thread
+    from async code.
     """
+    from src.persistence import write_json_atomic
+
     try:
-        # Ensure the directory exists before writing the file
-        config_dir = os.path.dirname(_CONFIG_JSON_PATH)
-        if not os.path.exists(config_dir):
-            os.makedirs(config_dir)
-            logger.info(f"Created config directory at {config_dir}")
-
-        with open(_CONFIG_JSON_PATH, 'w', encoding='utf-8') as f:
-            # Only save keys that are part of the original default config
-            # to avoid saving runtime-only variables.
-            config_to_save = {key: _config_cache.get(key) for key in _DEFAULT_CONFIG}
-            json.dump(config_to_save, f, indent=4)
+        # Only save keys that are part of the original default config
+        # to avoid saving runtime-only variables.
+        config_to_save = {key: _config_cache.get(key) for key in _DEFAULT_CONFIG}
+        write_json_atomic(_CONFIG_JSON_PATH, config_to_save, indent=4, ensure_ascii=True)
         logger.info(f"Settings successfully persisted to {_CONFIG_JSON_PATH}.")
     except Exception as e:
         logger.error(f"Failed to save config to {_CONFIG_JSON_PATH}: {e}")
@@ -131,10 +179,183 @@ def get_available_models() -> list:
 def get_rotation_count() -> int:
     return int(_get_config_value("CODEBUDDY_ROTATION_COUNT"))
 
+def get_selection_strategy() -> str:
+    """凭证选择策略: round_robin / least_in_flight / ewma_latency"""
+    return str(_get_config_value("CODEBUDDY_SELECTION_STRATEGY")).strip().lower()
+
+def _get_bool_value(key: str) -> bool:
+    value = _get_config_value(key)
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('true', '1', 't', 'y', 'yes')
+
+def get_http2_enabled() -> bool:
+    return _get_bool_value("CODEBUDDY_HTTP2")
+
+def get_pool_max_connections() -> int:
+    return int(_get_config_value("CODEBUDDY_POOL_MAX_CONNECTIONS"))
+
+def get_pool_max_keepalive() -> int:
+    return int(_get_config_value("CODEBUDDY_POOL_MAX_KEEPALIVE"))
+
+def get_pool_keepalive_expiry() -> float:
+    return float(_get_config_value("CODEBUDDY_POOL_KEEPALIVE_EXPIRY"))
+
+def get_warmup_connections() -> int:
+    return int(_get_config_value("CODEBUDDY_WARMUP_CONNECTIONS"))
+
+def get_warmup_interval() -> float:
+    """重新预热的间隔（秒）；0 表示自动取连接池空闲超时的 80%"""
+    interval = float(_get_config_value("CODEBUDDY_WARMUP_INTERVAL"))
+    if interval <= 0:
+        interval = get_pool_keepalive_expiry() * 0.8
+    return interval
+
+def get_hedge_enabled() -> bool:
+    return _get_bool_value("CODEBUDDY_HEDGE_ENABLED")
+
+def get_hedge_delay() -> float:
+    """首字节对冲阈值（秒）；0 表示使用学习到的 TTFB p95"""
+    return float(_get_config_value("CODEBUDDY_HEDGE_DELAY"))
+
+def get_hedge_max_per_minute() -> int:
+    return int(_get_config_value("CODEBUDDY_HEDGE_MAX_PER_MINUTE"))
+
+def get_retry_attempts() -> int:
+    """上游请求的最大尝试次数（含首次），至少为1"""
+    return max(1, int(_get_config_value("CODEBUDDY_RETRY_ATTEMPTS")))
+
+def get_retry_backoff() -> float:
+    return float(_get_config_value("CODEBUDDY_RETRY_BACKOFF"))
+
+def get_retry_status_codes() -> set:
+    codes_str = str(_get_config_value("CODEBUDDY_RETRY_STATUS_CODES"))
+    return {int(code.strip()) for code in codes_str.split(",") if code.strip().isdigit()}
+
+def get_breaker_failure_threshold() -> int:
+    """连续失败多少次后熔断凭证"""
+    return max(1, int(_get_config_value("CODEBUDDY_BREAKER_FAILURE_THRESHOLD")))
+
+def get_breaker_error_rate() -> float:
+    """滑动窗口内错误率达到该值时熔断凭证"""
+    return float(_get_config_value("CODEBUDDY_BREAKER_ERROR_RATE"))
+
+def get_breaker_window_size() -> int:
+    return max(1, int(_get_config_value("CODEBUDDY_BREAKER_WINDOW")))
+
+def get_breaker_cooldown() -> float:
+    """熔断后多久进入半开状态放行一个试探请求（秒）"""
+    return float(_get_config_value("CODEBUDDY_BREAKER_COOLDOWN"))
+
+def get_rate_limit_enabled() -> bool:
+    return _get_bool_value("CODEBUDDY_RATE_LIMIT_ENABLED")
+
+def get_rate_limit_burst() -> float:
+    return max(1.0, float(_get_config_value("CODEBUDDY_RATE_LIMIT_BURST")))
+
+def get_rate_limit_min() -> float:
+    return max(0.01, float(_get_config_value("CODEBUDDY_RATE_LIMIT_MIN")))
+
+def get_rate_limit_max() -> float:
+    return max(get_rate_limit_min(), float(_get_config_value("CODEBUDDY_RATE_LIMIT_MAX")))
+
+def get_rate_limit_max_wait() -> float:
+    """令牌桶为空时最多等待的秒数，超过则换用其他凭证"""
+    return float(_get_config_value("CODEBUDDY_RATE_LIMIT_MAX_WAIT"))
+
+def get_max_in_flight() -> int:
+    """同时处理的聊天请求上限；0 表示不限制"""
+    return int(_get_config_value("CODEBUDDY_MAX_IN_FLIGHT"))
+
+def get_max_queue() -> int:
+    return max(0, int(_get_config_value("CODEBUDDY_MAX_QUEUE")))
+
+def get_queue_timeout() -> float:
+    """请求在准入队列中最多等待的秒数"""
+    return float(_get_config_value("CODEBUDDY_QUEUE_TIMEOUT"))
+
+def get_creds_watch_interval() -> float:
+    """扫描凭证目录变化的间隔（秒）；0 表示关闭目录监视"""
+    return float(_get_config_value("CODEBUDDY_CREDS_WATCH_INTERVAL"))
+
+def get_creds_backend() -> str:
+    """凭证存储后端：directory（每个凭证一个 JSON 文件）或 sqlite"""
+    return str(_get_config_value("CODEBUDDY_CREDS_BACKEND")).strip().lower()
+
+def get_creds_db_path() -> str:
+    """SQLite 凭证库路径，为空时使用凭证目录下的 credentials.db"""
+    return str(_get_config_value("CODEBUDDY_CREDS_DB") or "")
+
+def get_workers() -> int:
+    """hypercorn worker 进程数；大于 1 时轮换游标、在途请求数和统计通过共享状态库在进程间共享"""
+    return max(1, int(_get_config_value("CODEBUDDY_WORKERS")))
+
+def get_shared_state_db_path() -> str:
+    """多 worker 共享状态库路径，为空时使用凭证目录下的 shared_state.db"""
+    return str(_get_config_value("CODEBUDDY_SHARED_STATE_DB") or "")
+
+def get_stats_retention_minutes() -> int:
+    """按分钟统计序列保留的分钟数"""
+    return max(1, int(_get_config_value("CODEBUDDY_STATS_RETENTION_MINUTES")))
+
+def get_stats_max_keys() -> int:
+    """统计中不同模型/凭证 key 的上限，超出的计入 __other__"""
+    return max(1, int(_get_config_value("CODEBUDDY_STATS_MAX_KEYS")))
+
+def get_stats_persist_enabled() -> bool:
+    return _get_bool_value("CODEBUDDY_STATS_PERSIST_ENABLED")
+
+def get_stats_db_path() -> str:
+    """统计持久化库路径，为空时使用凭证目录下的 stats.db"""
+    return str(_get_config_value("CODEBUDDY_STATS_DB") or "")
+
+def get_stats_flush_interval() -> float:
+    """统计快照写入间隔（秒）"""
+    return max(1.0, float(_get_config_value("CODEBUDDY_STATS_FLUSH_INTERVAL")))
+
+def get_stats_hourly_retention_days() -> int:
+    """按小时汇总保留的天数，更早的合并为按天汇总"""
+    return max(1, int(_get_config_value("CODEBUDDY_STATS_HOURLY_RETENTION_DAYS")))
+
+def get_stats_daily_retention_days() -> int:
+    """按天汇总保留的天数"""
+    return max(1, int(_get_config_value("CODEBUDDY_STATS_DAILY_RETENTION_DAYS")))
+
+def get_keyword_replacements() -> str:
+    """请求消息关键词替换规则，JSON 对象 {原文: 替换}；空字符串或 {} 表示不替换"""
+    return _get_config_value("CODEBUDDY_KEYWORD_REPLACEMENTS")
+
+def get_response_rewrite_enabled() -> bool:
+    """是否对上游响应内容做反向关键词替换"""
+    return _get_bool_value("CODEBUDDY_RESPONSE_REWRITE_ENABLED")
+
+def get_response_replacements() -> str:
+    """响应内容替换规则，JSON 对象；为空时使用请求替换规则的反向规则"""
+    return _get_config_value("CODEBUDDY_RESPONSE_REPLACEMENTS")
+
+def get_transform_cache_mb() -> float:
+    """请求变换缓存的容量上限 (MB)，0 表示关闭"""
+    return max(0.0, float(_get_config_value("CODEBUDDY_TRANSFORM_CACHE_MB")))
+
+def get_response_cache_enabled() -> bool:
+    """是否缓存确定性请求（temperature=0 或请求头 X-Response-Cache: force）的响应"""
+    return _get_bool_value("CODEBUDDY_RESPONSE_CACHE_ENABLED")
+
+def get_response_cache_mb() -> float:
+    """响应缓存的容量上限 (MB)"""
+    return max(0.0, float(_get_config_value("CODEBUDDY_RESPONSE_CACHE_MB")))
+
+def get_response_cache_ttl() -> float:
+    """响应缓存条目的有效期 (秒)"""
+    return max(1.0, float(_get_config_value("CODEBUDDY_RESPONSE_CACHE_TTL")))
+
 # --- Public Setter for Hot-Reload ---
 
-def update_settings(new_settings: Dict[str, Any]):
-    """Updates the live config and persists it to config.json."""
+def update_settings(new_settings: Dict[str, Any], persist: bool = True):
+    """
+    Updates the live config and persists it to config.json.
+    Pass persist=False to only hot-reload, and persist separately off the event loop.
+    """
     for key, value in new_settings.items():
         if key in _config_cache:
             original_type = type(_DEFAULT_CONFIG.get(key, value))
@@ -148,7 +369,8 @@ def update_settings(new_settings: Dict[str, Any]):
                 logger.warning(f"Could not cast new value for '{key}' to {original_type}. Using as string.")
                 _update_config_value(key, value)
     
-    save_config_to_json()
+    if persist:
+        save_config_to_json()
 
 # --- Initial Load ---
 load_config()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+migrate_creds_to_sqlite.py
+- One-shot import of the JSON files in the credentials directory into the SQLite credential store
+- Existing rows with the same filename are overwritten; the JSON files are left untouched
+- Afterwards set CODEBUDDY_CREDS_BACKEND=sqlite
+
+Usage:
+    python migrate_creds_to_sqlite.py [--creds-dir DIR] [--db PATH]
+"""
+import argparse
+import os
+import sys
+
+from config import get_codebuddy_creds_dir, get_creds_db_path
+from src.credential_store import SQLiteCredentialStore
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import credential JSON files into SQLite")
+    parser.add_argument("--creds-dir", default=get_codebuddy_creds_dir(), help="credentials directory")
+    parser.add_argument("--db", default=get_creds_db_path(), help="SQLite database path (default: <creds-dir>/credentials.db)")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    creds_dir = os.path.join(root, args.creds_dir)
+    db_path = os.path.join(root, args.db or os.path.join(args.creds_dir, "credentials.db"))
+
+    if not os.path.isdir(creds_dir):
+        print(f"[FAIL] Credentials directory not found: {creds_dir}")
+        return 1
+
+    store = SQLiteCredentialStore(creds_dir, db_path)
+    try:
+        migrated = store.migrate_from_directory()
+        print(f"[OK] Imported {migrated} credentials into {db_path} ({store.count()} total)")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Admission Control - 聊天接口的全局并发准入控制
+
+同时处理的请求数超过 CODEBUDDY_MAX_IN_FLIGHT 时，新请求按先进先出排队；
+队列已满或排队超过 CODEBUDDY_QUEUE_TIMEOUT 秒时立即拒绝，由路由返回 503 和 Retry-After，
+避免在凭证池处理不过来时仍把所有请求压到上游并长时间占用内存。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+class AdmissionRejected(Exception):
+    """队列已满或排队超时"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """已获准入的请求持有的名额，请求（含流式响应）结束时释放，重复释放无副作用"""
+
+    __slots__ = ("_controller", "_admitted_at", "_released", "waited")
+
+    def __init__(self, controller: "AdmissionController", waited: float = 0.0):
+        self._controller = controller
+        self._admitted_at = time.monotonic()
+        self._released = False
+        self.waited = waited  # 排队等待的秒数
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(time.monotonic() - self._admitted_at)
+
+
+class AdmissionController:
+    """并发上限 + 有界等待队列"""
+
+    def __init__(self, sample_size: int = 500):
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._wait_samples: Deque[float] = deque(maxlen=sample_size)
+        self._hold_samples: Deque[float] = deque(maxlen=sample_size)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> AdmissionTicket:
+        """获取一个处理名额，必要时排队；无法获得时抛出 AdmissionRejected"""
+        from config import get_max_in_flight, get_max_queue, get_queue_timeout
+
+        max_in_flight = get_max_in_flight()
+        if max_in_flight <= 0 or (self.in_flight < max_in_flight and not self._waiters):
+            return self._admit(0.0)
+
+        if len(self._waiters) >= get_max_queue():
+            self.rejected += 1
+            raise AdmissionRejected("queue full", self._retry_after(max_in_flight))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout=get_queue_timeout())
+        except asyncio.TimeoutError:
+            self._give_up(waiter)
+            self.timed_out += 1
+            raise AdmissionRejected("queue timeout", self._retry_after(max_in_flight))
+        except asyncio.CancelledError:
+            # 客户端断开
+            self._give_up(waiter)
+            raise
+
+        # 名额由释放方直接转交，in_flight 已计入
+        self.in_flight -= 1
+        return self._admit(time.monotonic() - started)
+
+    def _admit(self, waited: float) -> AdmissionTicket:
+        self.in_flight += 1
+        self.admitted += 1
+        self._wait_samples.append(waited)
+        return AdmissionTicket(self, waited)
+
+    def _give_up(self, waiter: asyncio.Future):
+        """放弃排队：若名额恰好已经转交给本请求（超时或取消前一刻），则继续转交给下一个，避免 in_flight 泄漏"""
+        if waiter.done() and not waiter.cancelled():
+            self._release(None)
+        else:
+            self._discard_waiter(waiter)
+
+    def _discard_waiter(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, held: Optional[float]):
+        if held is not None:
+            self._hold_samples.append(held)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # 直接把名额交给队首请求，避免新到的请求插队
+                waiter.set_result(None)
+                return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def _retry_after(self, max_in_flight: int) -> int:
+        """按最近请求的平均占用时长估算排到名额所需的时间"""
+        if self._hold_samples:
+            average_hold = sum(self._hold_samples) / len(self._hold_samples)
+        else:
+            average_hold = 1.0
+        estimate = average_hold * (len(self._waiters) + 1) / max(1, max_in_flight)
+        return max(1, math.ceil(estimate))
+
+    def get_stats(self) -> Dict[str, Any]:
+        from config import get_max_in_flight, get_max_queue
+
+        waits = sorted(self._wait_samples)
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": get_max_in_flight(),
+            "queue_depth": len(self._waiters),
+            "max_queue": get_max_queue(),
+            "max_queue_depth_seen": self.max_queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "wait_max": round(waits[-1], 3) if waits else 0.0
+        }
+
+
+# 全局准入控制器实例
+admission_controller = AdmissionController()
@@ -0,0 +1,135 @@
+"""
+Circuit Breaker - 每个凭证一个的熔断器（closed / open / half_open）
+
+连续失败次数或滑动窗口内错误率超过阈值时熔断（open），熔断期间该凭证被跳过；
+冷却时间过后进入半开（half_open），只放行一个试探请求，成功则恢复，失败则重新熔断。
+所有判断都是 O(1)。
+"""
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个凭证的熔断器"""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        cooldown: float = 30.0
+    ):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.window_size = window_size
+        self.cooldown = cooldown
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+        self._trial_started = 0.0
+        self._consecutive_failures = 0
+        self._window = deque(maxlen=window_size)  # True 表示失败
+        self._window_failures = 0
+        self.trip_count = 0
+
+    @property
+    def state(self) -> str:
+        """当前状态；冷却结束的 open 状态视为 half_open"""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            return HALF_OPEN
+        return self._state
+
+    def _trial_pending(self) -> bool:
+        # 试探请求被取消或选中后未发出时不会回报结果，超过冷却时间即视为放弃
+        return self._trial_in_progress and time.monotonic() - self._trial_started < self.cooldown
+
+    def is_available(self) -> bool:
+        """是否可以被选择（不改变状态）"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN:
+            return not self._trial_pending()
+        return False
+
+    def allow_request(self) -> bool:
+        """申请发出一个请求；半开状态下只放行一个试探请求"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_pending():
+            self._state = HALF_OPEN
+            self._trial_in_progress = True
+            self._trial_started = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        if self._state == HALF_OPEN:
+            self._reset()
+            return
+        if self._state == OPEN:
+            # 熔断前发出的请求迟到的结果，不影响状态
+            return
+        self._consecutive_failures = 0
+        self._push(False)
+
+    def record_failure(self):
+        if self._state == HALF_OPEN:
+            # 试探失败，重新熔断
+            self._trip()
+            return
+        if self._state == OPEN:
+            return
+
+        self._consecutive_failures += 1
+        self._push(True)
+        if self._consecutive_failures >= self.failure_threshold:
+            self._trip()
+        elif (
+            len(self._window) >= self.window_size
+            and self._window_failures / len(self._window) >= self.error_rate_threshold
+        ):
+            self._trip()
+
+    def _push(self, failed: bool):
+        if len(self._window) == self._window.maxlen and self._window[0]:
+            self._window_failures -= 1
+        self._window.append(failed)
+        if failed:
+            self._window_failures += 1
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_progress = False
+        self.trip_count += 1
+
+    def _reset(self):
+        self._state = CLOSED
+        self._trial_in_progress = False
+        self._consecutive_failures = 0
+        self._window.clear()
+        self._window_failures = 0
+
+    def retry_in(self) -> Optional[float]:
+        """open 状态下距离可试探的剩余秒数"""
+        if self._state != OPEN:
+            return None
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def to_dict(self) -> Dict[str, Any]:
+        retry_in = self.retry_in()
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "error_rate": round(self._window_failures / len(self._window), 3) if self._window else 0.0,
+            "trip_count": self.trip_count,
+            "retry_in": round(retry_in, 1) if retry_in is not None else None
+        }
@@ -3,15 +3,43 @@ CodeBuddy API Client - 直接调用CodeBuddy API
 """
 import json
 import time
+import hashlib
 import uuid
 import secrets
 import httpx
 import logging
 from typing import Dict, Any, Optional, AsyncGenerator, List
 
+from .http_pool import upstream_http_pool
+from .keyword_rewriter import keyword_rewriter
+from .rate_limiter import credential_rate_limiter, parse_retry_after
+from .sse_parser import SSEDecoder
+from .transform_cache import transform_cache, text_size, MIN_CACHEABLE_LENGTH
+
 logger = logging.getLogger(__name__)
 
 
+def _stream_error(data: Any) -> Optional[Dict[str, Any]]:
+    """流式响应中的错误事件转换为错误结果，非错误事件返回 None"""
+    if isinstance(data, dict) and "error" in data:
+        logger.error(f"[STREAMING ERROR] CodeBuddy returned error: {data}")
+        return {
+            "error": f"API error: {data.get('error', 'Unknown error')}",
+            "details": str(data)
+        }
+    return None
+
+
+def _converted_size(content: str, converted: Dict) -> Optional[int]:
+    """
+    缓存的转换结果大小；结构化内容（字符串化 JSON 解析出的工具调用）返回 None 不缓存，
+    其中生成的 toolUseId 不能在不同请求之间复用
+    """
+    if isinstance(converted.get("content"), str):
+        return text_size(content, converted["content"])
+    return None
+
+
 class CodeBuddyAPIClient:
     """CodeBuddy API客户端"""
     
@@ -43,140 +71,157 @@ class CodeBuddyAPIClient:
             }
             codebuddy_messages.append(system_msg)
         
+        # 缓存 key 包含当前生效的替换规则，规则热更新后不会命中按旧规则转换的结果
+        rules = keyword_rewriter.compiled()
         for msg in filtered_messages:
             role = msg.get("role", "user")
             content = msg.get("content", "")
             
-            logger.debug(f"[DEBUG] Processing message - role: {role}, content type: {type(content)}")
-            
-            # 处理特殊的tool角色，转换为user角色
-            if role == "tool":
-                role = "user"
-                logger.info(f"[ROLE_CONVERSION] Converting 'tool' role to 'user'")
-            
-            # 检查是否包含工具调用相关内容
-            has_tool_content = False
-            
-            # 检查字符串化的JSON内容
-            if isinstance(content, str) and content.startswith('[{') and content.endswith('}]'):
-                try:
-                    parsed_content = json.loads(content)
-                    if isinstance(parsed_content, list):
-                        content = parsed_content
-                        logger.info(f"[JSON_PARSE] Parsed stringified JSON content")
-                except json.JSONDecodeError:
-                    pass
+            # 多轮对话中重复发送的系统提示词、历史消息按内容缓存转换结果。
+            # 列表内容（多模态、工具结果）不缓存：列表不可哈希，序列化出 key 的开销与转换本身相当；
+            # 其中的文本块在 keyword_rewriter.rewrite_messages 中已按文本缓存
+            if isinstance(content, str) and len(content) >= MIN_CACHEABLE_LENGTH:
+                codebuddy_msg = dict(transform_cache.get_or_compute(
+                    "messages", (rules, role, content),
+                    lambda: self._convert_message(role, content),
+                    lambda converted: _converted_size(content, converted)
+                ))
+            else:
+                codebuddy_msg = self._convert_message(role, content)
             
-            if isinstance(content, list):
-                for item in content:
-                    if isinstance(item, dict) and item.get("type") in ["tool_result", "tool_use"]:
-                        has_tool_content = True
-                        break
+            codebuddy_messages.append(codebuddy_msg)
+        
+        return codebuddy_messages
+
+    def _convert_message(self, role: str, content: Any) -> Dict:
+        """
+        转换单条消息，纯文本结果只取决于 role、content 和替换规则，长文本消息的结果会被缓存；
+        包含工具调用的结构化结果每次重新生成（其中的 toolUseId 可能是随机生成的）。
+        """
+        logger.debug(f"[DEBUG] Processing message - role: {role}, content type: {type(content)}")
+        
+        # 处理特殊的tool角色，转换为user角色
+        if role == "tool":
+            role = "user"
+            logger.info(f"[ROLE_CONVERSION] Converting 'tool' role to 'user'")
+        
+        # 检查是否包含工具调用相关内容
+        has_tool_content = False
+        
+        # 检查字符串化的JSON内容
+        if isinstance(content, str) and content.startswith('[{') and content.endswith('}]'):
+            try:
+                parsed_content = json.loads(content)
+                if isinstance(parsed_content, list):
+                    content = parsed_content
+                    logger.info(f"[JSON_PARSE] Parsed stringified JSON content")
+            except json.JSONDecodeError:
+                pass
+        
+        if isinstance(content, list):
+            for item in content:
+                if isinstance(item, dict) and item.get("type") in ["tool_result", "tool_use"]:
+                    has_tool_content = True
+                    break
+        
+        if has_tool_content:
+            # 包含工具调用内容，保持结构化格式
+            logger.info(f"[TOOL_CONTENT] Preserving structured content for role: {role}")
             
-            if has_tool_content:
-                # 包含工具调用内容，保持结构化格式
-                logger.info(f"[TOOL_CONTENT] Preserving structured content for role: {role}")
-                
-                # 确保工具结果有正确的toolUseId
-                processed_content = []
-                for item in content:
-                    if isinstance(item, dict):
-                        if item.get("type") == "tool_result":
-                            # 确保toolUseId存在且有效
-                            tool_use_id = item.get("toolUseId") or item.get("tool_use_id") or item.get("id")
-                            if not tool_use_id:
-                                # 生成一个有效的toolUseId
-                                tool_use_id = f"tool_{uuid.uuid4().hex[:8]}"
-                                logger.warning(f"[TOOL_RESULT] Missing toolUseId, generated: {tool_use_id}")
-                            
-                            # 确保toolUseId符合正则表达式要求 [a-zA-Z0-9_-]+
-                            if not tool_use_id or not all(c.isalnum() or c in '_-' for c in tool_use_id):
-                                tool_use_id = f"tool_{uuid.uuid4().hex[:8]}"
-                                logger.warning(f"[TOOL_RESULT] Invalid toolUseId format, regenerated: {tool_use_id}")
-                            
-                            # 标准化工具结果格式
+            # 确保工具结果有正确的toolUseId
+            processed_content = []
+            for item in content:
+                if isinstance(item, dict):
+                    if item.get("type") == "tool_result":
+                        # 确保toolUseId存在且有效
+                        tool_use_id = item.get("toolUseId") or item.get("tool_use_id") or item.get("id")
+                        if not tool_use_id:
+                            # 生成一个有效的toolUseId
+                            tool_use_id = f"tool_{uuid.uuid4().hex[:8]}"
+                            logger.warning(f"[TOOL_RESULT] Missing toolUseId, generated: {tool_use_id}")
+                        
+                        # 确保toolUseId符合正则表达式要求 [a-zA-Z0-9_-]+
+                        if not tool_use_id or not all(c.isalnum() or c in '_-' for c in tool_use_id):
+                            tool_use_id = f"tool_{uuid.uuid4().hex[:8]}"
+                            logger.warning(f"[TOOL_RESULT] Invalid toolUseId format, regenerated: {tool_use_id}")
+                        
+                        # 标准化工具结果格式
+                        tool_result = {
+                            "type": "tool_result",
+                            "toolUseId": tool_use_id,
+                            "content": item.get("content", item.get("text", ""))
+                        }
+                        processed_content.append(tool_result)
+                        logger.info(f"[TOOL_RESULT] Processed tool result with toolUseId: {tool_use_id}")
+                    elif item.get("type") == "tool_use":
+                        # 确保工具使用有正确的id
+                        tool_id = item.get("id") or f"tool_{uuid.uuid4().hex[:8]}"
+                        tool_use = {
+                            "type": "tool_use",
+                            "id": tool_id,
+                            "name": item.get("name", ""),
+                            "input": item.get("input", {})
+                        }
+                        processed_content.append(tool_use)
+                        logger.info(f"[TOOL_USE] Processed tool use with id: {tool_id}")
+                    elif item.get("type") == "text":
+                        # 处理纯文本内容
+                        processed_content.append(item)
+                    else:
+                        # 其他类型，可能是工具结果的简化格式
+                        if "text" in item and not item.get("type"):
+                            # 可能是工具结果，转换为标准格式
+                            tool_use_id = f"tool_{uuid.uuid4().hex[:8]}"
                             tool_result = {
                                 "type": "tool_result",
                                 "toolUseId": tool_use_id,
-                                "content": item.get("content", item.get("text", ""))
+                                "content": item.get("text", "")
                             }
                             processed_content.append(tool_result)
-                            logger.info(f"[TOOL_RESULT] Processed tool result with toolUseId: {tool_use_id}")
-                        elif item.get("type") == "tool_use":
-                            # 确保工具使用有正确的id
-                            tool_id = item.get("id") or f"tool_{uuid.uuid4().hex[:8]}"
-                            tool_use = {
-                                "type": "tool_use",
-                                "id": tool_id,
-                                "name": item.get("name", ""),
-                                "input": item.get("input", {})
-                            }
-                            processed_content.append(tool_use)
-                            logger.info(f"[TOOL_USE] Processed tool use with id: {tool_id}")
-                        elif item.get("type") == "text":
-                            # 处理纯文本内容
+                            logger.info(f"[TOOL_RESULT] Converted text item to tool result with toolUseId: {tool_use_id}")
+                        else:
                             processed_content.append(item)
+                else:
+                    processed_content.append(item)
+            
+            codebuddy_msg = {
+                "role": role,
+                "content": processed_content
+            }
+        else:
+            # 普通文本内容，转换为字符串
+            if isinstance(content, str):
+                text_content = content
+            elif isinstance(content, list):
+                text_parts = []
+                for item in content:
+                    if isinstance(item, dict):
+                        if item.get("type") == "text":
+                            text_parts.append(item.get("text", ""))
                         else:
-                            # 其他类型，可能是工具结果的简化格式
-                            if "text" in item and not item.get("type"):
-                                # 可能是工具结果，转换为标准格式
-                                tool_use_id = f"tool_{uuid.uuid4().hex[:8]}"
-                                tool_result = {
-                                    "type": "tool_result",
-                                    "toolUseId": tool_use_id,
-                                    "content": item.get("text", "")
-                                }
-                                processed_content.append(tool_result)
-                                logger.info(f"[TOOL_RESULT] Converted text item to tool result with toolUseId: {tool_use_id}")
-                            else:
-                                processed_content.append(item)
+                            text_parts.append(json.dumps(item, ensure_ascii=False))
+                    elif isinstance(item, str):
+                        text_parts.append(item)
                     else:
-                        processed_content.append(item)
-                
-                codebuddy_msg = {
-                    "role": role,
-                    "content": processed_content
-                }
+                        text_parts.append(str(item))
+                text_content = "".join(text_parts)
             else:
-                # 普通文本内容，转换为字符串
-                if isinstance(content, str):
-                    text_content = content
-                elif isinstance(content, list):
-                    text_parts = []
-                    for item in content:
-                        if isinstance(item, dict):
-                            if item.get("type") == "text":
-                                text_parts.append(item.get("text", ""))
-                            else:
-                                text_parts.append(json.dumps(item, ensure_ascii=False))
-                        elif isinstance(item, str):
-                            text_parts.append(item)
-                        else:
-                            text_parts.append(str(item))
-                    text_content = "".join(text_parts)
-                else:
-                    text_content = str(content) if content is not None else ""
-                
-                # 关键词替换 - 防止CodeBuddy检测到竞争对手关键词
-                if role == "system" and text_content:
-                    original_length = len(text_content)
-                    text_content = text_content.replace("Claude Code", "CodeBuddy Code")
-                    text_content = text_content.replace("Anthropic's official CLI for Claude", "Tencent's official CLI for CodeBuddy")
-                    text_content = text_content.replace("Claude", "CodeBuddy")
-                    text_content = text_content.replace("Anthropic", "Tencent")
-                    text_content = text_content.replace("https://github.com/anthropics/claude-code/issues", "https://cnb.cool/codebuddy/codebuddy-code/-/issues")
-                    
-                    if len(text_content) != original_length:
-                        logger.info(f"[KEYWORD_REPLACE] Applied keyword replacements to system message")
+                text_content = str(content) if content is not None else ""
+            
+            # 关键词替换 - 防止CodeBuddy检测到竞争对手关键词
+            if role == "system" and text_content:
+                original_content = text_content
+                text_content = keyword_rewriter.rewrite(text_content)
                 
-                codebuddy_msg = {
-                    "role": role,
-                    "content": text_content
-                }
+                if text_content is not original_content:
+                    logger.info(f"[KEYWORD_REPLACE] Applied keyword replacements to system message")
             
-            codebuddy_messages.append(codebuddy_msg)
+            codebuddy_msg = {
+                "role": role,
+                "content": text_content
+            }
         
-        return codebuddy_messages
+        return codebuddy_msg
 
     def generate_codebuddy_headers(
         self,
@@ -219,6 +264,15 @@ class CodeBuddyAPIClient:
         }
         return headers
 
+    def _record_rate_limit_result(self, rate_key: str, response: httpx.Response):
+        """根据上游响应调整该凭证的令牌桶速率"""
+        if response.status_code == 429:
+            credential_rate_limiter.record_rate_limited(
+                rate_key, parse_retry_after(response.headers.get("retry-after"))
+            )
+        elif response.status_code == 200:
+            credential_rate_limiter.record_success(rate_key)
+    
     async def chat_completions(
         self,
         messages: list,
@@ -226,6 +280,7 @@ class CodeBuddyAPIClient:
         stream: bool = False,
         bearer_token: str = None,
         user_id: str = None,
+        credential_key: str = None,
         **kwargs
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
@@ -237,6 +292,7 @@ class CodeBuddyAPIClient:
             stream: 是否流式输出
             bearer_token: 认证token
             user_id: 用户ID
+            credential_key: 凭证标识（凭证文件名），用于按凭证限速；未提供时按token区分
             **kwargs: 其他参数
         """
         if not bearer_token:
@@ -293,107 +349,121 @@ class CodeBuddyAPIClient:
         
         api_url = f"{self.api_endpoint}/v2/chat/completions"
         
-        # 添加轻微延迟避免频率过高
-        import asyncio
-        await asyncio.sleep(0.5)
+        # 按凭证限速：只有令牌桶为空时才等待
+        rate_key = credential_key or hashlib.sha256(bearer_token.encode()).hexdigest()[:16]
+        if not await credential_rate_limiter.acquire(rate_key):
+            yield {
+                "error": "API error: 429",
+                "details": "Credential rate limit reached"
+            }
+            return
         
         try:
-            async with httpx.AsyncClient(timeout=120.0, verify=False) as client:
-                if stream:
-                    # 流式请求
-                    async with client.stream(
-                        "POST", 
-                        api_url,
-                        json=payload, 
-                        headers=headers
-                    ) as response:
-                        if response.status_code != 200:
-                            error_text = await response.aread()
-                            error_message = error_text.decode()
-                            logger.error(f"[STREAMING ERROR] CodeBuddy API error: {response.status_code}")
-                            logger.error(f"[STREAMING ERROR] Response headers: {dict(response.headers)}")
-                            logger.error(f"[STREAMING ERROR] Error details: {error_message}")
-                            logger.error(f"[STREAMING ERROR] Request URL: {api_url}")
-                            logger.error(f"[STREAMING ERROR] Request payload size: {len(str(payload))}")
-                            
-                            # 尝试解析JSON错误
-                            try:
-                                error_json = json.loads(error_message)
-                                logger.error(f"[STREAMING ERROR] Parsed error JSON: {error_json}")
-                            except:
-                                logger.error(f"[STREAMING ERROR] Raw error text: {error_message}")
+            client = upstream_http_pool.client
+            if stream:
+                # 流式请求
+                async with client.stream(
+                    "POST", 
+                    api_url,
+                    json=payload, 
+                    headers=headers,
+                    timeout=120.0
+                ) as response:
+                    self._record_rate_limit_result(rate_key, response)
+                    if response.status_code != 200:
+                        error_text = await response.aread()
+                        error_message = error_text.decode()
+                        logger.error(f"[STREAMING ERROR] CodeBuddy API error: {response.status_code}")
+                        logger.error(f"[STREAMING ERROR] Response headers: {dict(response.headers)}")
+                        logger.error(f"[STREAMING ERROR] Error details: {error_message}")
+                        logger.error(f"[STREAMING ERROR] Request URL: {api_url}")
+                        logger.error(f"[STREAMING ERROR] Request payload size: {len(str(payload))}")
                             
-                            yield {
-                                "error": f"API error: {response.status_code}",
-                                "details": error_message
-                            }
-                            return
-                        
-                        # 处理CodeBuddy的流式响应
-                        response_text = ""
-                        async for chunk in response.aiter_bytes():
-                            if chunk:
-                                chunk_str = chunk.decode('utf-8')
-                                response_text += chunk_str
-                                for line in chunk_str.split('\n'):
-                                    if line.startswith('data: '):
-                                        data_str = line[6:]
-                                        if data_str.strip() == '[DONE]':
-                                            return
-                                        try:
-                                            data = json.loads(data_str)
-                                            # 检查是否是错误响应
-                                            if isinstance(data, dict) and "error" in data:
-                                                logger.error(f"[STREAMING ERROR] CodeBuddy returned error: {data}")
-                                                yield {
-                                                    "error": f"API error: {data.get('error', 'Unknown error')}",
-                                                    "details": str(data)
-                                                }
-                                                return
-                                            
-                                            # 直接返回原始数据
-                                            yield data
-                                        except json.JSONDecodeError as e:
-                                            logger.warning(f"[STREAMING WARNING] JSON decode error, skipping line: {e}, data: {data_str}")
-                                            continue
-                        
-                        # 如果没有得到任何有效数据，记录完整响应
-                        if not response_text.strip():
-                            logger.error(f"[STREAMING ERROR] Empty response from CodeBuddy")
-                        elif "error" in response_text.lower() or "400" in response_text:
-                            logger.error(f"[STREAMING ERROR] Error detected in response: {response_text[:1000]}...")
-                else:
-                    # 非流式请求
-                    response = await client.post(
-                        api_url,  # 使用正确的API URL
-                        json=payload,
-                        headers=headers
-                    )
-                    
-                    if response.status_code == 200:
-                        # 非流式请求实际上不应该发生，因为我们总是以流式请求
-                        # 但为了健壮性，这里保留一个基础处理
-                        result = response.json()
-                        yield result
-                    else:
-                        error_text = response.text
-                        logger.error(f"[NON-STREAMING ERROR] CodeBuddy API error: {response.status_code}")
-                        logger.error(f"[NON-STREAMING ERROR] Response headers: {dict(response.headers)}")
-                        logger.error(f"[NON-STREAMING ERROR] Error details: {error_text}")
-                        logger.error(f"[NON-STREAMING ERROR] Request URL: {api_url}")
-                        logger.error(f"[NON-STREAMING ERROR] Request payload size: {len(str(payload))}")
-                        
                         # 尝试解析JSON错误
                         try:
-                            error_json = json.loads(error_text)
-                            logger.error(f"[NON-STREAMING ERROR] Parsed error JSON: {error_json}")
+                            error_json = json.loads(error_message)
+                            logger.error(f"[STREAMING ERROR] Parsed error JSON: {error_json}")
                         except:
-                            logger.error(f"[NON-STREAMING ERROR] Raw error text: {error_text}")
-                        
+                            logger.error(f"[STREAMING ERROR] Raw error text: {error_message}")
+                            
                         yield {
                             "error": f"API error: {response.status_code}",
-                            "details": error_text
+                            "details": error_message
                         }
+                        return
+                        
+                    # 处理CodeBuddy的流式响应（增量解析，只保留开头少量字节用于诊断）
+                    decoder = SSEDecoder()
+                    head_sample = b""
+                    async for chunk in response.aiter_bytes():
+                        if not chunk:
+                            continue
+                        if len(head_sample) < 1000:
+                            head_sample += chunk[:1000 - len(head_sample)]
+                        for event in decoder.feed(chunk):
+                            if event.is_done:
+                                return
+                            for data in event.json_payloads():
+                                # 检查是否是错误响应
+                                error = _stream_error(data)
+                                if error:
+                                    yield error
+                                    return
+                                
+                                # 直接返回原始数据
+                                yield data
+                    
+                    # 流结束时缓冲区中剩余的事件走同样的错误检查
+                    for event in decoder.flush():
+                        if event.is_done:
+                            return
+                        for data in event.json_payloads():
+                            error = _stream_error(data)
+                            if error:
+                                yield error
+                                return
+                            yield data
+                        
+                    # 如果没有得到任何有效数据，记录响应开头
+                    response_head = head_sample.decode('utf-8', errors='replace')
+                    if not response_head.strip():
+                        logger.error(f"[STREAMING ERROR] Empty response from CodeBuddy")
+                    elif "error" in response_head.lower() or "400" in response_head:
+                        logger.error(f"[STREAMING ERROR] Error detected in response: {response_head}...")
+            else:
+                # 非流式请求
+                response = await client.post(
+                    api_url,  # 使用正确的API URL
+                    json=payload,
+                    headers=headers,
+                    timeout=120.0
+                )
+                self._record_rate_limit_result(rate_key, response)
+                    
+                if response.status_code == 200:
+                    # 非流式请求实际上不应该发生，因为我们总是以流式请求
+                    # 但为了健壮性，这里保留一个基础处理
+                    result = response.json()
+                    yield result
+                else:
+                    error_text = response.text
+                    logger.error(f"[NON-STREAMING ERROR] CodeBuddy API error: {response.status_code}")
+                    logger.error(f"[NON-STREAMING ERROR] Response headers: {dict(response.headers)}")
+                    logger.error(f"[NON-STREAMING ERROR] Error details: {error_text}")
+                    logger.error(f"[NON-STREAMING ERROR] Request URL: {api_url}")
+                    logger.error(f"[NON-STREAMING ERROR] Request payload size: {len(str(payload))}")
+                        
+                    # 尝试解析JSON错误
+                    try:
+                        error_json = json.loads(error_text)
+                        logger.error(f"[NON-STREAMING ERROR] Parsed error JSON: {error_json}")
+                    except:
+                        logger.error(f"[NON-STREAMING ERROR] Raw error text: {error_text}")
+                        
+                    yield {
+                        "error": f"API error: {response.status_code}",
+                        "details": error_text
+                    }
                         
         except httpx.RequestError as e:
             logger.error(f"[REQUEST_ERROR] {e}")
@@ -413,12 +483,12 @@ class CodeBuddyAPIClient:
         headers = self.generate_codebuddy_headers(bearer_token, user_id)
         
         try:
-            async with httpx.AsyncClient(timeout=30.0, verify=False) as client:
-                response = await client.get(f"{self.api_endpoint}/v2/models", headers=headers)
-                return response.json() if response.status_code == 200 else {
-                    "error": f"API error: {response.status_code}",
-                    "details": response.text
-                }
+            client = upstream_http_pool.client
+            response = await client.get(f"{self.api_endpoint}/v2/models", headers=headers, timeout=30.0)
+            return response.json() if response.status_code == 200 else {
+                "error": f"API error: {response.status_code}",
+                "details": response.text
+            }
         except Exception as e:
             return {"error": "Request failed", "details": str(e)}
 
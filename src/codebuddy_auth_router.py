@@ -4,7 +4,6 @@ CodeBuddy Authentication Router
 """
 import hashlib
 import secrets
-import httpx
 import base64
 import json
 import uuid
@@ -15,6 +14,7 @@ from fastapi import APIRouter, HTTPException, Depends, Body
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from config import get_server_password
+from .http_pool import upstream_http_pool
 import logging
 
 logger = logging.getLogger(__name__)
@@ -69,7 +69,6 @@ def get_auth_start_headers() -> Dict[str, str]:
         'Content-Type': 'application/json',
         'Cache-Control': 'no-cache',
         'Pragma': 'no-cache',
-        'Connection': 'close',
         'X-Requested-With': 'XMLHttpRequest',
         'X-Domain': 'www.codebuddy.ai',
         'X-No-Authorization': 'true',
@@ -90,7 +89,6 @@ def get_auth_poll_headers() -> Dict[str, str]:
         'Accept': 'application/json, text/plain, */*',
         'Cache-Control': 'no-cache',
         'Pragma': 'no-cache',
-        'Connection': 'close',
         'X-Requested-With': 'XMLHttpRequest',
         'X-Request-ID': request_id,
         'b3': f'{request_id}-{span_id}-1-',
@@ -115,59 +113,58 @@ async def start_codebuddy_auth() -> Dict[str, Any]:
         headers = get_auth_start_headers()
         
         # 调用 /v2/plugin/auth/state 获取认证状态和URL
-        async with httpx.AsyncClient(verify=False) as client:
-            # 为避免上游/中间层缓存，添加随机nonce参数，确保每次请求唯一
-            nonce = secrets.token_hex(8)
-            state_url = f"{CODEBUDDY_AUTH_STATE_ENDPOINT}?platform=CLI&nonce={nonce}"
-            payload = {"nonce": nonce}
+        client = upstream_http_pool.client
+        # 为避免上游/中间层缓存，添加随机nonce参数，确保每次请求唯一
+        nonce = secrets.token_hex(8)
+        state_url = f"{CODEBUDDY_AUTH_STATE_ENDPOINT}?platform=CLI&nonce={nonce}"
+        payload = {"nonce": nonce}
             
-            response = await client.post(state_url, json=payload, headers=headers, timeout=30)
+        response = await client.post(state_url, json=payload, headers=headers, timeout=30)
             
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('code') == 0 and result.get('data'):
-                    data = result['data']
-                    auth_state = data.get('state')
-                    auth_url = data.get('authUrl')
+        if response.status_code == 200:
+            result = response.json()
+            if result.get('code') == 0 and result.get('data'):
+                data = result['data']
+                auth_state = data.get('state')
+                auth_url = data.get('authUrl')
                     
-                    if auth_state and auth_url:
-                        global _last_auth_state
-                        if _last_auth_state and auth_state == _last_auth_state:
-                            logger.warning("上游返回的state与上一次相同，尝试重新获取新的state...")
-                            try:
-                                nonce2 = secrets.token_hex(8)
-                                state_url2 = f"{CODEBUDDY_AUTH_STATE_ENDPOINT}?platform=CLI&nonce={nonce2}"
-                                payload2 = {"nonce": nonce2}
-                                async with httpx.AsyncClient(verify=False) as client2:
-                                    response2 = await client2.post(state_url2, json=payload2, headers=headers, timeout=30)
-                                if response2.status_code == 200:
-                                    result2 = response2.json()
-                                    if result2.get('code') == 0 and result2.get('data'):
-                                        data2 = result2['data']
-                                        ns = data2.get('state')
-                                        nu = data2.get('authUrl')
-                                        if ns and nu and ns != auth_state:
-                                            auth_state = ns
-                                            auth_url = nu
-                            except Exception:
-                                pass
-                        token_endpoint = f"{CODEBUDDY_AUTH_TOKEN_ENDPOINT}?state={auth_state}"
-                        _last_auth_state = auth_state
+                if auth_state and auth_url:
+                    global _last_auth_state
+                    if _last_auth_state and auth_state == _last_auth_state:
+                        logger.warning("上游返回的state与上一次相同，尝试重新获取新的state...")
+                        try:
+                            nonce2 = secrets.token_hex(8)
+                            state_url2 = f"{CODEBUDDY_AUTH_STATE_ENDPOINT}?platform=CLI&nonce={nonce2}"
+                            payload2 = {"nonce": nonce2}
+                            response2 = await client.post(state_url2, json=payload2, headers=headers, timeout=30)
+                            if response2.status_code == 200:
+                                result2 = response2.json()
+                                if result2.get('code') == 0 and result2.get('data'):
+                                    data2 = result2['data']
+                                    ns = data2.get('state')
+                                    nu = data2.get('authUrl')
+                                    if ns and nu and ns != auth_state:
+                                        auth_state = ns
+                                        auth_url = nu
+                        except Exception:
+                            pass
+                    token_endpoint = f"{CODEBUDDY_AUTH_TOKEN_ENDPOINT}?state={auth_state}"
+                    _last_auth_state = auth_state
                         
-                        return {
-                            "success": True,
-                            "method": "codebuddy_real_auth",
-                            "auth_state": auth_state,
-                            "verification_uri_complete": auth_url,
-                            "verification_uri": CODEBUDDY_BASE_URL,
-                            "token_endpoint": token_endpoint,
-                            "expires_in": 1800,
-                            "interval": 5,
-                            "status": "awaiting_login",
-                            "instructions": "请点击链接完成CodeBuddy登录",
-                            "message": "请使用提供的链接登录CodeBuddy",
-                            "platform": "CLI"
-                        }
+                    return {
+                        "success": True,
+                        "method": "codebuddy_real_auth",
+                        "auth_state": auth_state,
+                        "verification_uri_complete": auth_url,
+                        "verification_uri": CODEBUDDY_BASE_URL,
+                        "token_endpoint": token_endpoint,
+                        "expires_in": 1800,
+                        "interval": 5,
+                        "status": "awaiting_login",
+                        "instructions": "请点击链接完成CodeBuddy登录",
+                        "message": "请使用提供的链接登录CodeBuddy",
+                        "platform": "CLI"
+                    }
                         
         return {
             "success": False,
@@ -189,51 +186,51 @@ async def poll_codebuddy_auth_status(auth_state: str) -> Dict[str, Any]:
         headers = get_auth_poll_headers()
         url = f"{CODEBUDDY_AUTH_TOKEN_ENDPOINT}?state={auth_state}"
         
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(url, headers=headers, timeout=30)
+        client = upstream_http_pool.client
+        response = await client.get(url, headers=headers, timeout=30)
             
-            if response.status_code == 200:
-                result = response.json()
+        if response.status_code == 200:
+            result = response.json()
                 
-                if result.get('code') == 11217:
-                    # 仍在等待登录
-                    return {
-                        "status": "pending",
-                        "message": result.get('msg', 'login ing...'),
-                        "code": result.get('code')
-                    }
-                elif result.get('code') == 0 and result.get('data') and result.get('data', {}).get('accessToken'):
-                    # 认证成功，获得token
-                    data = result.get('data', {})
-                    return {
-                        "status": "success",
-                        "message": "认证成功！",
-                        "token_data": {
-                            "access_token": data.get('accessToken'),
-                            "bearer_token": data.get('accessToken'),
-                            "token_type": data.get('tokenType', 'Bearer'),
-                            "expires_in": data.get('expiresIn'),
-                            "refresh_token": data.get('refreshToken'),
-                            "session_state": data.get('sessionState'),
-                            "scope": data.get('scope'),
-                            "domain": data.get('domain'),
-                            "full_response": result
-                        }
-                    }
-                else:
-                    # 其他状态码
-                    return {
-                        "status": "unknown",
-                        "message": result.get('msg', 'Unknown status'),
-                        "code": result.get('code'),
-                        "response": result
+            if result.get('code') == 11217:
+                # 仍在等待登录
+                return {
+                    "status": "pending",
+                    "message": result.get('msg', 'login ing...'),
+                    "code": result.get('code')
+                }
+            elif result.get('code') == 0 and result.get('data') and result.get('data', {}).get('accessToken'):
+                # 认证成功，获得token
+                data = result.get('data', {})
+                return {
+                    "status": "success",
+                    "message": "认证成功！",
+                    "token_data": {
+                        "access_token": data.get('accessToken'),
+                        "bearer_token": data.get('accessToken'),
+                        "token_type": data.get('tokenType', 'Bearer'),
+                        "expires_in": data.get('expiresIn'),
+                        "refresh_token": data.get('refreshToken'),
+                        "session_state": data.get('sessionState'),
+                        "scope": data.get('scope'),
+                        "domain": data.get('domain'),
+                        "full_response": result
                     }
+                }
             else:
+                # 其他状态码
                 return {
-                    "status": "error",
-                    "message": f"API请求失败，状态码: {response.status_code}",
-                    "response_text": response.text
+                    "status": "unknown",
+                    "message": result.get('msg', 'Unknown status'),
+                    "code": result.get('code'),
+                    "response": result
                 }
+        else:
+            return {
+                "status": "error",
+                "message": f"API请求失败，状态码: {response.status_code}",
+                "response_text": response.text
+            }
                 
     except Exception as e:
         logger.error(f"轮询认证状态失败: {e}")
@@ -336,7 +333,7 @@ async def save_codebuddy_token(token_data: Dict[str, Any]) -> bool:
         filename = f"codebuddy_{safe_user_id}_{timestamp}.json"
         
         # 使用token管理器保存
-        success = codebuddy_token_manager.add_credential_with_data(
+        success = await codebuddy_token_manager.add_credential_with_data(
             credential_data=credential_data,
             filename=filename
         )
@@ -1,20 +1,34 @@
 """
 CodeBuddy API Router - 兼容CodeBuddy官方API格式
 """
+import asyncio
 import json
+import math
+import random
 import time
 import uuid
 import secrets
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Set
 from fastapi import APIRouter, HTTPException, Depends, Request, Header
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
+from .admission import admission_controller, AdmissionRejected
 from .auth import authenticate
 from .codebuddy_api_client import codebuddy_api_client
 from .codebuddy_token_manager import codebuddy_token_manager
+from .hedging import hedge_policy
+from .http_pool import upstream_http_pool
+from .keyword_rewriter import keyword_rewriter, response_keyword_rewriter
+from .rate_limiter import credential_rate_limiter, parse_retry_after
+from .response_cache import BYPASS, CACHE_HEADER, cache_key, cache_mode, replay_chunks, response_cache
+from .response_rewriter import SSEContentRewriter, rewrite_completion
+from .sse_parser import SSEDecoder
+from .stream_aggregator import ChatCompletionAggregator
+from .token_usage import StreamUsageTap, client_id, normalize_usage
 from .usage_stats_manager import usage_stats_manager
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +41,337 @@ class CodeBuddyMessage(BaseModel):
     content: Any  # 可以是字符串或复杂对象
 
 
+# --- Helpers ---
+
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _spawn_background(coro):
+    """启动后台任务并持有引用，防止任务在完成前被回收"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _drain_and_close(upstream, byte_iterator, timeout: float = 30.0):
+    """在后台读完剩余的上游响应体再关闭，使连接能回到连接池复用"""
+    try:
+        async def _drain():
+            async for _ in byte_iterator:
+                pass
+        await asyncio.wait_for(_drain(), timeout=timeout)
+    except Exception:
+        pass
+    finally:
+        await upstream.aclose()
+
+
+def _aggregate_events(aggregator: ChatCompletionAggregator, events):
+    """把解码出的 SSE 事件折叠进合并器"""
+    for event in events:
+        if event.is_done:
+            aggregator.mark_done()
+        else:
+            for chunk_data in event.json_payloads():
+                aggregator.add_chunk(chunk_data)
+
+
+def _cache_completion(key: str, aggregator: ChatCompletionAggregator, result: Optional[Dict[str, Any]] = None):
+    """只缓存完整且没有错误的响应（result 为反向替换之前的合并结果）"""
+    if aggregator.error is not None or not aggregator.is_complete:
+        return
+    if result is None:
+        result = aggregator.build()
+    if result is not None:
+        response_cache.put(key, result)
+
+
+def _cached_response(result: Dict[str, Any], stream: bool, include_usage: bool,
+                     response_rules, model_name: str, request_started: float):
+    """用缓存的完整响应应答，不经过上游；记为没有凭证和首字节时间的成功请求"""
+    if response_rules is not None:
+        rewrite_completion(result, response_rules)
+    duration = time.monotonic() - request_started
+    usage_stats_manager.record_request(model_name, None, False, duration=duration)
+    metrics.observe_chat_request(usage_stats_manager.model_key(model_name), 200, stream, None, duration)
+    if stream:
+        return StreamingResponse(
+            replay_chunks(result, include_usage),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+                "Access-Control-Allow-Origin": "*",
+                CACHE_HEADER: "hit"
+            }
+        )
+    return JSONResponse(content=result, headers={CACHE_HEADER: "hit"})
+
+
+class _GuardedStreamingResponse(StreamingResponse):
+    """
+    响应结束后（包括客户端在开始迭代之前就断开、发送被取消）一定调用 on_close。
+    生成器从未开始迭代时其 finally 不会执行，上游连接和准入名额只能在这里释放；on_close 需要幂等。
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._on_close()
+
+
+class _UpstreamStream:
+    """已建立的上游SSE流：响应对象、已预读的首个分块和剩余的字节迭代器"""
+
+    def __init__(self, response, byte_iterator, first_chunk: bytes, credential_key: Optional[str], ttfb: float):
+        self.response = response
+        self.first_chunk = first_chunk
+        self.credential_key = credential_key
+        self.ttfb = ttfb
+        self._byte_iterator = byte_iterator
+        self._closed = False
+
+    async def iter_bytes(self):
+        """按到达顺序产出上游原始字节（包含预读的首块）"""
+        if self.first_chunk:
+            yield self.first_chunk
+        async for chunk in self._byte_iterator:
+            if chunk:
+                yield chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.response.aclose()
+        finally:
+            if self.credential_key:
+                codebuddy_token_manager.mark_request_end(self.credential_key)
+
+
+def _record_upstream_failure(credential_key: Optional[str], status_code: int):
+    """鉴权、限流、上游5xx和网络错误计入凭证熔断器；其他4xx通常是请求本身的问题，不计入"""
+    if credential_key and (status_code in (401, 403, 429) or status_code >= 500):
+        codebuddy_token_manager.record_request_result(credential_key, False)
+
+
+async def _open_upstream_stream(
+    credential: Dict[str, Any],
+    payload: Dict[str, Any],
+    header_kwargs: Dict[str, Any]
+) -> _UpstreamStream:
+    """用指定凭证发起上游流式请求，并等待首个分块到达"""
+    import httpx
+
+    credential_key = codebuddy_token_manager.get_credential_key(credential)
+    headers = codebuddy_api_client.generate_codebuddy_headers(
+        bearer_token=credential.get('bearer_token'),
+        user_id=credential.get('user_id'),
+        **header_kwargs
+    )
+    # 令牌桶为空时等待；等待过久则按 429 交由重试逻辑换用其他凭证
+    if credential_key and not await credential_rate_limiter.acquire(credential_key):
+        logger.warning(f"凭证 {credential_key} 已达到限速，跳过")
+        raise HTTPException(status_code=429, detail="Credential rate limit reached")
+
+    if credential_key:
+        codebuddy_token_manager.mark_request_start(credential_key)
+    started = time.monotonic()
+    opened = False
+    try:
+        # 以流式方式发送上游请求（共享连接池），响应体按到达顺序逐块读取
+        client = upstream_http_pool.client
+        upstream_request = client.build_request(
+            "POST",
+            f"{codebuddy_api_client.api_endpoint}/v2/chat/completions",
+            json=payload,
+            headers=headers,
+            timeout=300  # 增加超时时间
+        )
+        response = await client.send(upstream_request, stream=True)
+        
+        if response.status_code != 200:
+            try:
+                error_text = (await response.aread()).decode('utf-8', errors='replace')
+            finally:
+                await response.aclose()
+            logger.error(f"CodeBuddy API错误: {response.status_code} - {error_text}")
+            if response.status_code == 429 and credential_key:
+                credential_rate_limiter.record_rate_limited(
+                    credential_key, parse_retry_after(response.headers.get("retry-after"))
+                )
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"CodeBuddy API error: {error_text}"
+            )
+
+        # 预读首个非空分块，用于测量首字节延迟和对冲判定
+        byte_iterator = response.aiter_bytes()
+        first_chunk = b""
+        try:
+            async for chunk in byte_iterator:
+                if chunk:
+                    first_chunk = chunk
+                    break
+        except BaseException:
+            await response.aclose()
+            raise
+        opened = True
+    except HTTPException as e:
+        _record_upstream_failure(credential_key, e.status_code)
+        raise
+    except httpx.TimeoutException:
+        logger.error("CodeBuddy API 超时")
+        _record_upstream_failure(credential_key, 504)
+        raise HTTPException(status_code=504, detail="CodeBuddy API timeout")
+    except httpx.NetworkError as e:
+        logger.error(f"网络错误: {e}")
+        _record_upstream_failure(credential_key, 502)
+        raise HTTPException(status_code=502, detail=f"Network error: {str(e)}")
+    except Exception as e:
+        logger.error(f"请求异常: {e}")
+        _record_upstream_failure(credential_key, 500)
+        raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+    finally:
+        # 失败或被取消（对冲落败）时释放在途计数；成功时由 _UpstreamStream.aclose 释放
+        if not opened and credential_key:
+            codebuddy_token_manager.mark_request_end(credential_key)
+
+    ttfb = time.monotonic() - started
+    hedge_policy.record_ttfb(ttfb)
+    if credential_key:
+        codebuddy_token_manager.record_ttfb(credential_key, ttfb)
+        codebuddy_token_manager.record_request_result(credential_key, True)
+        credential_rate_limiter.record_success(credential_key)
+    return _UpstreamStream(response, byte_iterator, first_chunk, credential_key, ttfb)
+
+
+def _discard_upstream_task(task: asyncio.Task):
+    """取消落败的上游请求；若它恰好已经建立成功，则关闭其连接"""
+    def _close_if_opened(t: asyncio.Task):
+        if t.cancelled():
+            return
+        if t.exception() is None:
+            _spawn_background(t.result().aclose())
+
+    task.cancel()
+    task.add_done_callback(_close_if_opened)
+
+
+async def _open_upstream(
+    credential: Dict[str, Any],
+    payload: Dict[str, Any],
+    header_kwargs: Dict[str, Any]
+) -> _UpstreamStream:
+    """
+    发起上游请求。启用对冲时，若首字节在阈值内未到达，则用另一个凭证发出相同请求，
+    采用先返回首字节的一方并取消另一方。
+    """
+    hedge_delay = hedge_policy.hedge_delay()
+    if hedge_delay is None:
+        return await _open_upstream_stream(credential, payload, header_kwargs)
+
+    primary = asyncio.create_task(_open_upstream_stream(credential, payload, header_kwargs))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    # 先申请对冲配额，再选择备用凭证：配额用完时不应计入备用凭证的使用次数或占用熔断器的半开试探
+    hedge_token = hedge_policy.try_acquire()
+    if hedge_token is None:
+        return await primary
+    primary_key = codebuddy_token_manager.get_credential_key(credential)
+    alternate = codebuddy_token_manager.get_next_credential(exclude={primary_key} if primary_key else None)
+    if not alternate or alternate is credential:
+        hedge_policy.cancel_acquire(hedge_token)
+        return await primary
+
+    logger.info(f"No first byte after {hedge_delay:.2f}s, hedging request on another credential")
+    # 对冲请求使用新的 X-Request-ID，避免上游按请求ID去重
+    hedge = asyncio.create_task(
+        _open_upstream_stream(alternate, payload, dict(header_kwargs, request_id=None))
+    )
+
+    pending = {primary, hedge}
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    if task is hedge:
+                        hedge_policy.record_hedge_win()
+                        logger.info("Hedged request won the race")
+                    for other in done - {task}:
+                        _discard_upstream_task(other)
+                    return task.result()
+                if first_error is None:
+                    first_error = error
+        raise first_error
+    finally:
+        for task in pending:
+            _discard_upstream_task(task)
+
+
+async def _open_upstream_with_retry(
+    credential: Dict[str, Any],
+    payload: Dict[str, Any],
+    header_kwargs: Dict[str, Any]
+) -> _UpstreamStream:
+    """
+    在还没有任何字节发给客户端之前，对可重试的失败（401/429/5xx等）换用下一个凭证重新发起请求。
+    每次尝试都会记录到统计中。
+    """
+    from config import get_retry_attempts, get_retry_backoff, get_retry_status_codes
+
+    max_attempts = get_retry_attempts()
+    retry_status_codes = get_retry_status_codes()
+    tried_keys: Set[str] = set()
+
+    for attempt in range(1, max_attempts + 1):
+        credential_key = codebuddy_token_manager.get_credential_key(credential) or "unknown"
+        try:
+            upstream = await _open_upstream(credential, payload, header_kwargs)
+        except HTTPException as e:
+            usage_stats_manager.record_upstream_attempt(credential_key, e.status_code, is_retry=attempt > 1)
+            metrics.upstream_requests.inc(credential_key, str(e.status_code))
+            if attempt >= max_attempts or e.status_code not in retry_status_codes:
+                raise
+
+            tried_keys.add(credential_key)
+            next_credential = codebuddy_token_manager.get_next_credential(exclude=tried_keys)
+            if next_credential is None:
+                if e.status_code < 500:
+                    raise
+                # 没有其他可用凭证时，服务端错误仍可用同一凭证重试
+                next_credential = credential
+
+            delay = get_retry_backoff() * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            logger.warning(
+                f"上游请求失败 (attempt {attempt}/{max_attempts}, status {e.status_code}, "
+                f"credential {credential_key})，{delay:.2f}s 后换用凭证重试"
+            )
+            await asyncio.sleep(delay)
+            credential = next_credential
+            # 重试使用新的 X-Request-ID
+            header_kwargs = dict(header_kwargs, request_id=None)
+            continue
+
+        usage_stats_manager.record_upstream_attempt(
+            upstream.credential_key or credential_key, 200, is_retry=attempt > 1
+        )
+        metrics.upstream_requests.inc(upstream.credential_key or credential_key, "200")
+        return upstream
+
+
 # --- API Endpoints ---
 
 @router.post("/v1/chat/completions")
@@ -36,11 +381,31 @@ async def chat_completions(
     x_conversation_request_id: Optional[str] = Header(None, alias="X-Conversation-Request-ID"),
     x_conversation_message_id: Optional[str] = Header(None, alias="X-Conversation-Message-ID"),
     x_request_id: Optional[str] = Header(None, alias="X-Request-ID"),
+    x_response_cache: Optional[str] = Header(None, alias="X-Response-Cache"),
+    x_client_id: Optional[str] = Header(None, alias="X-Client-Id"),
     _token: str = Depends(authenticate)
 ):
     """
     CodeBuddy V1 聊天完成API - 完全透传模式
     """
+    # 准入控制：并发已满时排队，队列满或排队超时立即返回503
+    request_started = time.monotonic()
+    try:
+        admission_ticket = await admission_controller.acquire()
+    except AdmissionRejected as e:
+        logger.warning(f"请求被准入控制拒绝: {e.reason}")
+        metrics.observe_chat_request("unknown", 503, False, None, time.monotonic() - request_started)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service overloaded ({e.reason}), please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    # 流式响应把名额交给响应生成器，在流结束时释放
+    release_on_return = True
+    metrics.queue_wait.observe(admission_ticket.waited)
+    model_name = "unknown"
+    client_wants_stream = False
+
     try:
         # 获取原始请求体
         try:
@@ -49,32 +414,11 @@ async def chat_completions(
             logger.error(f"解析请求体失败: {e}")
             raise HTTPException(status_code=400, detail=f"Invalid JSON request body: {str(e)}")
         
-        # 获取CodeBuddy凭证
-        credential = codebuddy_token_manager.get_next_credential()
-        if not credential:
-            raise HTTPException(status_code=401, detail="没有可用的CodeBuddy凭证")
-        
-        bearer_token = credential.get('bearer_token')
-        user_id = credential.get('user_id')
-        
-        if not bearer_token:
-            raise HTTPException(status_code=401, detail="无效的CodeBuddy凭证")
-        
-        # 生成请求头
-        headers = codebuddy_api_client.generate_codebuddy_headers(
-            bearer_token=bearer_token,
-            user_id=user_id,
-            conversation_id=x_conversation_id,
-            conversation_request_id=x_conversation_request_id,
-            conversation_message_id=x_conversation_message_id,
-            request_id=x_request_id
-        )
-        
         # 完全透传请求体，但需要处理一些 CodeBuddy 的特殊要求
         payload = request_body.copy()
         
         # Record model usage stats
-        model_name = payload.get("model", "unknown")
+        model_name = str(payload.get("model", "unknown"))
         usage_stats_manager.record_model_usage(model_name)
         
         payload["stream"] = True  # CodeBuddy 只支持流式请求
@@ -89,74 +433,135 @@ async def chat_completions(
             }
             payload["messages"] = [system_msg] + messages
         
-        # 应用关键词替换 - 防止CodeBuddy检测到竞争对手关键词
-        def apply_keyword_replacement(text):
-            if isinstance(text, str):
-                text = text.replace("Claude Code", "CodeBuddy Code")
-                text = text.replace("Anthropic's official CLI for Claude", "Tencent's official CLI for CodeBuddy")
-                text = text.replace("Claude", "CodeBuddy")
-                text = text.replace("Anthropic", "Tencent")
-                text = text.replace("https://github.com/anthropics/claude-code/issues", "https://cnb.cool/codebuddy/codebuddy-code/-/issues")
-                return text
-            return text
+        # 应用关键词替换 - 防止CodeBuddy检测到竞争对手关键词（规则见 CODEBUDDY_KEYWORD_REPLACEMENTS）
+        keyword_rewriter.rewrite_messages(payload.get("messages"))
         
-        # 对所有消息应用关键词替换
-        for msg in payload.get("messages", []):
-            if msg.get("role") == "system" and isinstance(msg.get("content"), str):
-                msg["content"] = apply_keyword_replacement(msg["content"])
-            elif isinstance(msg.get("content"), str):
-                msg["content"] = apply_keyword_replacement(msg["content"])
-            elif isinstance(msg.get("content"), list):
-                for item in msg["content"]:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        item["text"] = apply_keyword_replacement(item.get("text", ""))
+        # 检查客户端是否期望流式响应
+        client_wants_stream = request_body.get("stream", False)
+        # 总是向上游请求 usage 用于 token 统计；非流式结果中会带上 usage，
+        # 流式客户端自己没有请求时，转发时去掉只含 usage 的块
+        client_options = request_body.get("stream_options")
+        client_wants_usage = isinstance(client_options, dict) and bool(client_options.get("include_usage"))
+        payload["stream_options"] = {**(client_options if isinstance(client_options, dict) else {}), "include_usage": True}
+        client = client_id(x_client_id, request_body.get("user"))
+        # 可选：把响应内容中替换后的关键词换回来（规则在请求开始时固定）
+        from config import get_response_rewrite_enabled
+        response_rules = response_keyword_rewriter.compiled() if get_response_rewrite_enabled() else None
+        if response_rules is not None and response_rules.empty:
+            response_rules = None
         
+        # 可选：确定性请求的响应缓存（temperature=0，请求头 X-Response-Cache 可跳过或强制）
+        response_cache_key = None
+        cache_header_mode = cache_mode(x_response_cache)
+        if response_cache.should_cache(request_body, cache_header_mode):
+            response_cache_key = cache_key(payload)
+            cached = response_cache.get(response_cache_key)
+            metrics.response_cache.inc("hit" if cached is not None else "miss")
+            if cached is not None:
+                return _cached_response(
+                    cached, client_wants_stream, client_wants_usage, response_rules, model_name, request_started
+                )
+        elif cache_header_mode == BYPASS and response_cache.enabled:
+            metrics.response_cache.inc("bypass")
         
-        # 发送请求到CodeBuddy
-        import httpx
-        try:
-            async with httpx.AsyncClient(verify=False, timeout=300) as client:  # 增加超时时间
-                response = await client.post(
-                    "https://www.codebuddy.ai/v2/chat/completions",
-                    json=payload,
-                    headers=headers
+        # 获取CodeBuddy凭证
+        credential = codebuddy_token_manager.get_next_credential()
+        if not credential:
+            retry_in = codebuddy_token_manager.breaker_retry_in()
+            if retry_in is not None:
+                # 凭证都已熔断：告知客户端最早何时可以重试
+                raise HTTPException(
+                    status_code=503,
+                    detail="所有CodeBuddy凭证均已熔断，请稍后重试",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_in)))}
                 )
-                
-                if response.status_code != 200:
-                    error_text = response.text
-                    logger.error(f"CodeBuddy API错误: {response.status_code} - {error_text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"CodeBuddy API error: {error_text}"
-                    )
-        except httpx.TimeoutException:
-            logger.error("CodeBuddy API 超时")
-            raise HTTPException(status_code=504, detail="CodeBuddy API timeout")
-        except httpx.NetworkError as e:
-            logger.error(f"网络错误: {e}")
-            raise HTTPException(status_code=502, detail=f"Network error: {str(e)}")
-        except Exception as e:
-            logger.error(f"请求异常: {e}")
-            raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+            raise HTTPException(status_code=401, detail="没有可用的CodeBuddy凭证")
         
-        # 检查客户端是否期望流式响应
-        client_wants_stream = request_body.get("stream", False)
+        if not credential.get('bearer_token'):
+            raise HTTPException(status_code=401, detail="无效的CodeBuddy凭证")
+        
+        # 发送请求到CodeBuddy（首字节过慢时可能在另一凭证上对冲，失败时换凭证重试）
+        header_kwargs = {
+            "conversation_id": x_conversation_id,
+            "conversation_request_id": x_conversation_request_id,
+            "conversation_message_id": x_conversation_message_id,
+            "request_id": x_request_id
+        }
+        upstream = await _open_upstream_with_retry(credential, payload, header_kwargs)
         
         if client_wants_stream:
-            # 客户端要求流式，直接透传
+            # 客户端要求流式，上游字节到达即原样转发，不做解码/重编码
+            usage_tap = StreamUsageTap(strip_usage_chunks=not client_wants_usage)
+            content_rewriter = SSEContentRewriter(response_rules) if response_rules is not None else None
+            # 需要写入响应缓存时，同时把原始上游字节合并成完整响应
+            cache_decoder = SSEDecoder() if response_cache_key is not None else None
+            cache_aggregator = ChatCompletionAggregator(expect_usage=True) if response_cache_key is not None else None
+
+            streamed_bytes = 0
+            stream_started = False
+            stream_error = False
+            stream_finished = False
+            metrics.active_streams.inc()
+
+            async def finish_stream():
+                """记录统计并释放上游连接与准入名额；流结束、中断或从未开始迭代时都只执行一次"""
+                nonlocal stream_finished
+                if stream_finished:
+                    return
+                stream_finished = True
+                metrics.active_streams.dec()
+                interrupted = stream_error or not stream_started
+                duration = time.monotonic() - request_started
+                tokens = normalize_usage(usage_tap.usage)
+                usage_stats_manager.record_request(
+                    model_name, upstream.credential_key, interrupted, ttfb=upstream.ttfb,
+                    duration=duration, streamed_bytes=streamed_bytes, tokens=tokens, client=client
+                )
+                metric_model = usage_stats_manager.model_key(model_name)
+                metrics.observe_chat_request(
+                    metric_model, "interrupted" if interrupted else 200, True, upstream.ttfb, duration
+                )
+                if tokens:
+                    metrics.observe_tokens(metric_model, upstream.credential_key, client, tokens)
+                try:
+                    await upstream.aclose()
+                finally:
+                    admission_ticket.release()
+
             async def stream_response():
+                nonlocal streamed_bytes, stream_started, stream_error
+                stream_started = True
                 try:
-                    async for chunk in response.aiter_bytes():
-                        if chunk:
-                            yield chunk
+                    async for chunk in upstream.iter_bytes():
+                        streamed_bytes += len(chunk)
+                        if cache_aggregator is not None:
+                            _aggregate_events(cache_aggregator, cache_decoder.feed(chunk))
+                        forwarded = usage_tap.feed(chunk)
+                        if content_rewriter is not None:
+                            forwarded = content_rewriter.feed(forwarded)
+                        if forwarded:
+                            yield forwarded
+                    remainder = usage_tap.flush()
+                    if content_rewriter is not None:
+                        remainder = content_rewriter.feed(remainder) + content_rewriter.flush()
+                    if remainder:
+                        yield remainder
+                    if cache_aggregator is not None:
+                        _aggregate_events(cache_aggregator, cache_decoder.flush())
+                        _cache_completion(response_cache_key, cache_aggregator)
                 except Exception as e:
+                    stream_error = True
                     logger.error(f"流式响应错误: {e}")
                     error_chunk = f'data: {{"error": "Stream interrupted: {str(e)}"}}\n\n'
                     yield error_chunk.encode('utf-8')
+                finally:
+                    await finish_stream()
             
-            return StreamingResponse(
+            release_on_return = False
+            return _GuardedStreamingResponse(
                 stream_response(),
-                media_type="text/plain",
+                on_close=finish_stream,
+                media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
@@ -167,107 +572,79 @@ async def chat_completions(
                 }
             )
         else:
-            # 客户端要求非流式，收集并合并所有流式响应块（真正透传）
-            all_chunks = []
-            
-            # 收集所有流式响应块
-            async for chunk in response.aiter_bytes():
-                if chunk:
-                    chunk_str = chunk.decode('utf-8')
-                    for line in chunk_str.split('\n'):
-                        if line.startswith('data: ') and not line.endswith('[DONE]'):
-                            try:
-                                data_str = line[6:]  # 移除 'data: ' 前缀
-                                chunk_data = json.loads(data_str)
-                                
-                                # 收集所有有效的响应块
-                                if "choices" in chunk_data:
-                                    all_chunks.append(chunk_data)
-                                    
-                            except json.JSONDecodeError:
-                                continue
-            
-            # 如果有响应块，合并为非流式格式
-            if all_chunks:
-                # 使用第一个块作为基础
-                base_response = all_chunks[0].copy()
-                base_response["object"] = "chat.completion"
-                base_response["created"] = int(time.time())
-                
-                # 合并所有块的内容
-                if "choices" in base_response and base_response["choices"]:
-                    choice = base_response["choices"][0]
-                    
-                    # 如果第一个块就有完整的delta，直接转换
-                    if "delta" in choice:
-                        # 合并所有块的delta内容
-                        merged_delta = choice["delta"].copy()
-                        
-                        
-                        # 合并所有块的内容（包括第一个块）
-                        merged_content = merged_delta.get("content", "") or ""
-                        merged_tool_calls = {}  # 使用字典按index组织
-                        
-                        # 处理所有块（包括第一个）
-                        for chunk in all_chunks:
-                            if "choices" in chunk and chunk["choices"]:
-                                delta = chunk["choices"][0].get("delta", {})
-                                if "content" in delta and delta["content"]:
-                                    merged_content += delta["content"]
-                                if "tool_calls" in delta:
-                                    # 合并工具调用参数
-                                    for new_tool_call in delta["tool_calls"]:
-                                        if new_tool_call.get("index") is not None:
-                                            index = new_tool_call["index"]
-                                            
-                                            # 初始化工具调用槽位
-                                            if index not in merged_tool_calls:
-                                                merged_tool_calls[index] = {
-                                                    "index": index,
-                                                    "function": {"name": "", "arguments": ""}
-                                                }
-                                            
-                                            # 合并工具调用信息
-                                            if "function" in new_tool_call:
-                                                # 合并参数字符串
-                                                if "arguments" in new_tool_call["function"]:
-                                                    merged_tool_calls[index]["function"]["arguments"] += new_tool_call["function"]["arguments"]
-                                                
-                                                # 设置工具名称（保留非空值）
-                                                if "name" in new_tool_call["function"] and new_tool_call["function"]["name"]:
-                                                    merged_tool_calls[index]["function"]["name"] = new_tool_call["function"]["name"]
-                                            
-                                            # 更新其他字段（id, type等）
-                                            for key, value in new_tool_call.items():
-                                                if key not in ["function", "index"]:
-                                                    merged_tool_calls[index][key] = value
-                        
-                        # 转换为数组格式
-                        merged_delta["content"] = merged_content
-                        if merged_tool_calls:
-                            merged_delta["tool_calls"] = list(merged_tool_calls.values())
-                        
-                        # 转换delta为message
-                        choice["message"] = merged_delta
-                        choice["message"]["role"] = choice["message"].get("role", "assistant")
-                        choice["finish_reason"] = "stop"
-                        if 'delta' in choice:
-                            del choice["delta"]
-                        
-                
-                return base_response
+            # 客户端要求非流式，边接收边合并增量块，看到终止块立即返回
+            aggregator = ChatCompletionAggregator(expect_usage=True)
+            decoder = SSEDecoder()
+            drain_in_background = False
+            streamed_bytes = 0
+            byte_iterator = upstream.iter_bytes()
+            try:
+                async for chunk in byte_iterator:
+                    streamed_bytes += len(chunk)
+                    for event in decoder.feed(chunk):
+                        if event.is_done:
+                            aggregator.mark_done()
+                            break
+                        for chunk_data in event.json_payloads():
+                            aggregator.add_chunk(chunk_data)
+                    if aggregator.is_complete:
+                        drain_in_background = not aggregator.done
+                        break
+                else:
+                    for event in decoder.flush():
+                        if not event.is_done:
+                            for chunk_data in event.json_payloads():
+                                aggregator.add_chunk(chunk_data)
+            finally:
+                if drain_in_background:
+                    _spawn_background(_drain_and_close(upstream, byte_iterator))
+                else:
+                    await upstream.aclose()
+
+            result = aggregator.build()
+            duration = time.monotonic() - request_started
+            tokens = normalize_usage(aggregator.usage)
+            usage_stats_manager.record_request(
+                model_name, upstream.credential_key, result is None, ttfb=upstream.ttfb,
+                duration=duration, streamed_bytes=streamed_bytes, tokens=tokens, client=client
+            )
+            metric_model = usage_stats_manager.model_key(model_name)
+            metrics.observe_chat_request(
+                metric_model, 200 if result is not None else "incomplete", False, upstream.ttfb, duration
+            )
+            if tokens:
+                metrics.observe_tokens(metric_model, upstream.credential_key, client, tokens)
+            if result is not None:
+                if response_cache_key is not None:
+                    _cache_completion(response_cache_key, aggregator, result)
+                if response_rules is not None:
+                    rewrite_completion(result, response_rules)
+                return result
             else:
                 # 如果没有收到有效响应，返回错误
                 return {
                     "error": "No valid response received from CodeBuddy",
-                    "details": "Stream ended without complete response"
+                    "details": str(aggregator.error) if aggregator.error else "Stream ended without complete response"
                 }
                 
-    except HTTPException:
+    except HTTPException as e:
+        duration = time.monotonic() - request_started
+        usage_stats_manager.record_request(model_name, None, True, duration=duration)
+        metrics.observe_chat_request(
+            usage_stats_manager.model_key(model_name), e.status_code, client_wants_stream, None, duration
+        )
         raise
     except Exception as e:
         logger.error(f"CodeBuddy V1 API错误: {e}")
+        duration = time.monotonic() - request_started
+        usage_stats_manager.record_request(model_name, None, True, duration=duration)
+        metrics.observe_chat_request(
+            usage_stats_manager.model_key(model_name), 500, client_wants_stream, None, duration
+        )
         raise HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
+    finally:
+        if release_on_return:
+            admission_ticket.release()
 
 @router.get("/v1/models")
 async def list_v1_models(_token: str = Depends(authenticate)):
@@ -352,6 +729,10 @@ async def list_credentials(_token: str = Depends(authenticate)):
                 "domain": info['domain'],
                 "has_refresh_token": info['has_refresh_token'],
                 "session_state": info['session_state'],
+                "in_flight": info['in_flight'],
+                "ewma_ttfb": info['ewma_ttfb'],
+                "breaker_state": info['breaker_state'],
+                "breaker": info['breaker'],
                 "has_token": bool(bearer_token),
                 "token_preview": f"{bearer_token[:10]}...{bearer_token[-4:]}" if bearer_token and len(bearer_token) > 14 else "Invalid Token"
             }
@@ -379,7 +760,7 @@ async def add_credential(
         if not bearer_token:
             raise HTTPException(status_code=422, detail="bearer_token is required")
 
-        success = codebuddy_token_manager.add_credential(bearer_token, user_id, filename)
+        success = await codebuddy_token_manager.add_credential(bearer_token, user_id, filename)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to save credential file")
         
@@ -451,7 +832,7 @@ async def delete_credential(request: Request, _token: str = Depends(authenticate
         if not isinstance(index, int):
             raise HTTPException(status_code=422, detail="index must be an integer")
 
-        success = codebuddy_token_manager.delete_credential_by_index(index)
+        success = await codebuddy_token_manager.delete_credential_by_index(index)
         if not success:
             raise HTTPException(status_code=400, detail="Invalid index or failed to delete credential")
 
@@ -2,60 +2,191 @@
 CodeBuddy Token Manager - 管理CodeBuddy认证token
 """
 import os
-import glob
-import json
 import time
+import bisect
+import heapq
 import logging
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Set
 from .usage_stats_manager import usage_stats_manager
+from .credential_selection import CredentialRuntimeState, get_selection_strategy
+from .circuit_breaker import CircuitBreaker
+from .rate_limiter import credential_rate_limiter
+from .credential_store import CredentialStore, create_credential_store
+from .shared_state import shared_state, RotationSnapshot
 
 logger = logging.getLogger(__name__)
 
+# 所有凭证都在限速中时的告警最多每隔多少秒记录一次
+LIMITED_WARNING_INTERVAL = 30.0
+
+# 提前5分钟认为过期，留出刷新时间
+EXPIRY_BUFFER = 300
+
 
 class CodeBuddyTokenManager:
     """CodeBuddy Token管理器"""
     
-    def __init__(self, creds_dir=None):
+    def __init__(self, creds_dir=None, store: Optional[CredentialStore] = None):
         if creds_dir is None:
             from config import get_codebuddy_creds_dir, get_rotation_count
             creds_dir = get_codebuddy_creds_dir()
         
         self.creds_dir = os.path.join(os.path.dirname(__file__), '..', creds_dir)
+        # 凭证存储后端（目录或 SQLite），凭证文件名作为 key
+        self.store = store if store is not None else create_credential_store(self.creds_dir)
         self.credentials = []
         self.current_index = 0  # Start from the first credential
         self.usage_count = 0    # Counter for the current credential usage
         self.manual_selected_index = None  # 手动选择的凭证索引
+        # 多 worker 时自上次心跳同步以来的轮换变化：当前凭证上新增的使用次数、是否切换过凭证
+        self._rotation_uses = 0
+        self._rotation_moved = False
+        self._last_limited_warning = 0.0
+        self.runtime_state: Dict[str, CredentialRuntimeState] = {}  # 按凭证文件名记录在途数与延迟
+        self.breakers: Dict[str, CircuitBreaker] = {}  # 按凭证文件名的熔断器
+        # 由 _rebuild_indexes 维护的索引：凭证文件名、就绪环（未过期凭证的索引）与过期堆
+        self._keys: List[str] = []
+        self._key_index: Dict[str, int] = {}
+        self._data_index: Dict[int, tuple] = {}
+        self._ready: List[int] = []
+        self._ready_pos: Dict[int, int] = {}
+        self._expiry_heap: List[tuple] = []
+        self._expiry_deadlines: Dict[int, int] = {}
+        # 凭证文件名 -> (mtime_ns, size)，用于增量检测目录变化
+        self._file_signatures: Dict[str, tuple] = {}
         self.load_all_tokens()
     
     def load_all_tokens(self):
         """加载所有token文件"""
         self.credentials = []
         self.current_index = -1
+        self._file_signatures = {}
         
-        logger.info(f"Loading CodeBuddy credentials from: {self.creds_dir}")
-        
-        if not os.path.exists(self.creds_dir):
-            os.makedirs(self.creds_dir)
-            logger.warning(f"Credentials directory created at {self.creds_dir}. No credentials found.")
-            return
+        logger.info(f"Loading CodeBuddy credentials from: {self.creds_dir} (backend: {self.store.name})")
         
-        token_files = glob.glob(os.path.join(self.creds_dir, '*.json'))
-        for file_path in token_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if 'bearer_token' in data:
-                        self.credentials.append({
-                            'file_path': file_path,
-                            'data': data
-                        })
-                        logger.info(f"Successfully loaded credential: {os.path.basename(file_path)}")
-                    else:
-                        logger.warning(f"Skipping invalid credential file (missing bearer_token): {os.path.basename(file_path)}")
-            except Exception as e:
-                logger.error(f"Failed to load credential file {os.path.basename(file_path)}: {e}")
+        for key, data in self.store.load_all():
+            signature = self.store.signature(key)
+            if signature is not None:
+                self._file_signatures[key] = signature
+            if isinstance(data, dict) and 'bearer_token' in data:
+                self.credentials.append({
+                    'file_path': self.store.path_for(key),
+                    'data': data
+                })
+                logger.debug(f"Successfully loaded credential: {key}")
+            else:
+                logger.warning(f"Skipping invalid credential file (missing bearer_token): {key}")
         
         logger.info(f"Loaded a total of {len(self.credentials)} CodeBuddy credentials.")
+        self._rebuild_indexes()
+    
+    # --- 增量目录同步 ---
+
+    def scan_credentials_dir(self) -> Dict[str, tuple]:
+        """只 stat 不解析，返回目录中每个凭证文件的 (mtime_ns, size)；可在线程中调用（仅目录后端）"""
+        return self.store.scan()
+
+    def diff_credentials_dir(self, signatures: Dict[str, tuple]) -> tuple:
+        """对比扫描结果与已知状态，返回 (新增或修改的文件名列表, 已删除的文件名列表)"""
+        changed = [name for name, sig in signatures.items() if self._file_signatures.get(name) != sig]
+        deleted = [name for name in self._file_signatures if name not in signatures]
+        return changed, deleted
+
+    def read_credential_file(self, filename: str) -> tuple:
+        """读取单个凭证文件，返回 (file_path, data, signature)；文件不完整或无法解析时 data 为 None"""
+        data, signature = self.store.read(filename)
+        return self.store.path_for(filename), data, signature
+
+    def apply_credential_changes(self, loaded: Dict[str, tuple], deleted: List[str]):
+        """
+        增量应用目录变化：新增的凭证追加到列表末尾，修改的凭证就地更新，删除的凭证移出列表。
+        未变化凭证的轮换位置、熔断器和运行时状态保持不变。
+        """
+        removed = list(deleted)
+        for key, (file_path, data, signature) in loaded.items():
+            # 无法解析的文件也记录签名：半个文件写完后 mtime/大小会变化，届时重新读取
+            self._file_signatures[key] = signature
+            if data is None:
+                continue
+            if 'bearer_token' not in data:
+                logger.warning(f"Skipping invalid credential file (missing bearer_token): {key}")
+                if key in self._key_index:
+                    removed.append(key)
+                continue
+
+            index = self._key_index.get(key)
+            if index is None:
+                self._append_credential(file_path, data)
+                logger.info(f"Detected new credential: {key}")
+            else:
+                existing = self.credentials[index]['data']
+                if existing != data:
+                    # 就地替换内容，保持数据对象不变
+                    existing.clear()
+                    existing.update(data)
+                    self._reschedule_expiry(index)
+                    logger.info(f"Reloaded modified credential: {key}")
+
+        for key in deleted:
+            self._file_signatures.pop(key, None)
+        if removed:
+            self._remove_credentials(removed)
+
+    def _append_credential(self, file_path: str, data: Dict[str, Any]):
+        """追加一个凭证并增量更新索引（新索引最大，直接加到就绪环末尾）"""
+        index = len(self.credentials)
+        key = os.path.basename(file_path)
+        self.credentials.append({'file_path': file_path, 'data': data})
+        self._keys.append(key)
+        self._key_index[key] = index
+        self._data_index[id(data)] = (data, key)
+        deadline = self._expiry_deadline(data)
+        if deadline is not None:
+            self._expiry_deadlines[index] = deadline
+            heapq.heappush(self._expiry_heap, (deadline, index))
+        if deadline is None or deadline > time.time():
+            self._ready_pos[index] = len(self._ready)
+            self._ready.append(index)
+
+    def _remove_credentials(self, keys: List[str]):
+        """移出凭证并重建索引，把当前轮换位置与手动选择映射到新的索引"""
+        keys = {key for key in keys if key in self._key_index}
+        if not keys:
+            return
+
+        current_key = self._keys[self.current_index] if 0 <= self.current_index < len(self._keys) else None
+        manual_key = None
+        if self.manual_selected_index is not None and 0 <= self.manual_selected_index < len(self._keys):
+            manual_key = self._keys[self.manual_selected_index]
+        # 当前凭证被删除时，轮换从它原来位置之后的凭证继续
+        survivors_before_current = sum(
+            1 for key in self._keys[:max(self.current_index, 0)] if key not in keys
+        )
+
+        self.credentials = [
+            cred for cred in self.credentials
+            if os.path.basename(cred['file_path']) not in keys
+        ]
+        self._rebuild_indexes()
+        for key in keys:
+            self.breakers.pop(key, None)
+            self.runtime_state.pop(key, None)
+            logger.info(f"Removed credential: {key}")
+
+        if current_key in self._key_index:
+            self.current_index = self._key_index[current_key]
+        else:
+            self.current_index = survivors_before_current if survivors_before_current < len(self.credentials) else -1
+            self.usage_count = 0
+
+        if manual_key is not None:
+            if manual_key in self._key_index:
+                self.manual_selected_index = self._key_index[manual_key]
+            else:
+                self.manual_selected_index = None
+                if shared_state.enabled:
+                    shared_state.set_manual_key(None)
+                logger.info("Cleared manual selection because deleted credential was selected")
     
     def is_token_expired(self, credential_data: Dict) -> bool:
         """检查token是否过期"""
@@ -70,9 +201,7 @@ class CodeBuddyTokenManager:
             current_time = int(time.time())
             expiry_time = created_at + expires_in
             
-            # 提前5分钟认为过期，留出刷新时间
-            buffer_time = 300  # 5分钟
-            is_expired = current_time >= (expiry_time - buffer_time)
+            is_expired = current_time >= (expiry_time - EXPIRY_BUFFER)
             
             if is_expired:
                 user_id = credential_data.get('user_id', 'unknown')
@@ -83,68 +212,334 @@ class CodeBuddyTokenManager:
             logger.error(f"Error checking token expiry: {e}")
             return False
     
-    def get_next_credential(self) -> Optional[Dict]:
-        """获取下一个可用的凭证，根据轮换策略，并检查过期状态"""
-        from config import get_rotation_count
+    def get_token_expiry(self, credential_data: Dict) -> Optional[int]:
+        """返回token的过期时间戳，没有过期信息时返回 None"""
+        created_at = credential_data.get('created_at')
+        expires_in = credential_data.get('expires_in')
+        if not created_at or not expires_in:
+            return None
+        return int(created_at) + int(expires_in)
 
-        if not self.credentials:
+    def get_credential_key(self, credential_data: Dict) -> Optional[str]:
+        """返回凭证的唯一标识（凭证文件名）"""
+        entry = self._data_index.get(id(credential_data))
+        if entry is not None and entry[0] is credential_data:
+            return entry[1]
+        return None
+
+    def _get_runtime_state(self, credential_key: str) -> CredentialRuntimeState:
+        state = self.runtime_state.get(credential_key)
+        if state is None:
+            state = CredentialRuntimeState()
+            self.runtime_state[credential_key] = state
+        return state
+
+    def mark_request_start(self, credential_key: str):
+        """路由在向上游发起请求时调用"""
+        state = self._get_runtime_state(credential_key)
+        state.in_flight += 1
+        state.last_used = time.monotonic()
+        if shared_state.enabled:
+            shared_state.add_in_flight(credential_key, 1)
+
+    def record_ttfb(self, credential_key: str, seconds: float):
+        """路由在收到上游首字节时调用"""
+        self._get_runtime_state(credential_key).record_ttfb(seconds)
+
+    def mark_request_end(self, credential_key: str):
+        """路由在上游请求结束（成功、失败或取消）时调用"""
+        state = self._get_runtime_state(credential_key)
+        state.in_flight = max(0, state.in_flight - 1)
+        if shared_state.enabled:
+            shared_state.add_in_flight(credential_key, -1)
+
+    def _get_breaker(self, credential_key: str) -> CircuitBreaker:
+        breaker = self.breakers.get(credential_key)
+        if breaker is None:
+            from config import (
+                get_breaker_failure_threshold, get_breaker_error_rate,
+                get_breaker_window_size, get_breaker_cooldown
+            )
+            breaker = CircuitBreaker(
+                failure_threshold=get_breaker_failure_threshold(),
+                error_rate_threshold=get_breaker_error_rate(),
+                window_size=get_breaker_window_size(),
+                cooldown=get_breaker_cooldown()
+            )
+            self.breakers[credential_key] = breaker
+        return breaker
+
+    def record_request_result(self, credential_key: str, success: bool):
+        """路由在上游请求成功（收到首字节）或因凭证相关原因失败时调用，驱动熔断器"""
+        breaker = self._get_breaker(credential_key)
+        previous = breaker.state
+        if success:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        if breaker.state != previous:
+            logger.warning(f"Circuit breaker for {credential_key}: {previous} -> {breaker.state}")
+
+    def _use_credential(self, credential: Dict) -> str:
+        """记录使用统计并占用熔断器（半开状态下的试探名额），返回凭证文件名"""
+        credential_filename = os.path.basename(credential['file_path'])
+        self._get_breaker(credential_filename).allow_request()
+        usage_stats_manager.record_credential_usage(credential_filename)
+        return credential_filename
+
+    # --- 就绪环与过期堆 ---
+
+    def _expiry_deadline(self, credential_data: Dict) -> Optional[int]:
+        """凭证被视为过期的时间点（过期前5分钟），没有过期信息时返回 None"""
+        expiry = self.get_token_expiry(credential_data)
+        if expiry is None:
             return None
-        
-        # 过滤掉过期的凭证
-        valid_credentials = []
+        return expiry - EXPIRY_BUFFER
+
+    def _rebuild_indexes(self):
+        """凭证列表变化后重建文件名/数据对象索引、就绪环和过期堆"""
+        self._keys = []
+        self._key_index = {}
+        self._data_index = {}
+        self._expiry_heap = []
+        self._expiry_deadlines = {}
+        now = time.time()
+        ready = []
         for i, cred in enumerate(self.credentials):
-            if not self.is_token_expired(cred['data']):
-                valid_credentials.append((i, cred))
+            key = os.path.basename(cred['file_path'])
+            self._keys.append(key)
+            self._key_index[key] = i
+            self._data_index[id(cred['data'])] = (cred['data'], key)
+            deadline = self._expiry_deadline(cred['data'])
+            if deadline is not None:
+                self._expiry_deadlines[i] = deadline
+                self._expiry_heap.append((deadline, i))
+            if deadline is None or deadline > now:
+                ready.append(i)
+        heapq.heapify(self._expiry_heap)
+        self._set_ready(ready)
+
+    def _set_ready(self, ready: List[int]):
+        self._ready = ready
+        self._ready_pos = {index: pos for pos, index in enumerate(ready)}
+
+    def _evict_expired(self):
+        """弹出所有已到期的堆顶条目，把对应凭证移出就绪环（每个凭证到期时只处理一次）"""
+        if not self._expiry_heap or self._expiry_heap[0][0] > time.time():
+            return
+        now = time.time()
+        evicted = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            deadline, index = heapq.heappop(self._expiry_heap)
+            if self._expiry_deadlines.get(index) != deadline:
+                continue  # token已刷新，旧条目作废
+            if index in self._ready_pos:
+                evicted.append(index)
+        if not evicted:
+            return
+
+        evicted_set = set(evicted)
+        self._set_ready([i for i in self._ready if i not in evicted_set])
+        for index in evicted:
+            logger.warning(f"Credential expired, removed from rotation: {self._keys[index]}")
+
+    def _reschedule_expiry(self, index: int):
+        """token 更新后重新登记过期时间，必要时放回就绪环"""
+        deadline = self._expiry_deadline(self.credentials[index]['data'])
+        if deadline is None:
+            self._expiry_deadlines.pop(index, None)
+        else:
+            self._expiry_deadlines[index] = deadline
+            heapq.heappush(self._expiry_heap, (deadline, index))
+        if (deadline is None or deadline > time.time()) and index not in self._ready_pos:
+            bisect.insort(self._ready, index)
+            self._set_ready(self._ready)
+
+    def _is_available(self, index: int) -> bool:
+        """凭证是否未熔断且令牌桶非空"""
+        key = self._keys[index]
+        return self._get_breaker(key).is_available() and credential_rate_limiter.is_available(key)
+
+    def _next_ready(self, start_index: int, exclude: Optional[Set[str]] = None) -> Optional[int]:
+        """
+        沿就绪环找到 start_index 之后第一个可用且未被排除的凭证；
+        start_index 不在环中（如已过期）时从其后第一个就绪凭证开始。通常为 O(1)。
+        """
+        if not self._ready:
+            return None
+        pos = self._ready_pos.get(start_index)
+        if pos is None:
+            pos, first_step = bisect.bisect_left(self._ready, start_index), 0
+        else:
+            first_step = 1
+        count = len(self._ready)
+        for step in range(first_step, first_step + count):
+            index = self._ready[(pos + step) % count]
+            if exclude and self._keys[index] in exclude:
+                continue
+            if self._is_available(index):
+                return index
+        return None
+
+    def _least_limited(self, exclude: Optional[Set[str]] = None) -> Optional[int]:
+        """
+        所有就绪凭证都处于熔断或限速中时的兜底：只在熔断器允许请求的凭证中选择令牌最早可用的，
+        由发送前的令牌等待处理限速。全部熔断时返回 None，不把请求交给已熔断的凭证。
+        """
+        candidates = [
+            i for i in self._ready
+            if not (exclude and self._keys[i] in exclude) and self._get_breaker(self._keys[i]).is_available()
+        ]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        if now - self._last_limited_warning >= LIMITED_WARNING_INTERVAL:
+            self._last_limited_warning = now
+            logger.warning("All valid credentials are rate-limited, using the one whose token is available first")
+        return min(candidates, key=lambda i: credential_rate_limiter.get_bucket(self._keys[i]).wait_time())
+
+    def _advance(self, start_index: int) -> Optional[int]:
+        index = self._next_ready(start_index)
+        return index if index is not None else self._least_limited()
+
+    def breaker_retry_in(self) -> Optional[float]:
+        """距离最早一个熔断凭证可以试探的秒数；没有处于熔断中的就绪凭证时返回 None"""
+        waits = [self._get_breaker(self._keys[i]).retry_in() for i in self._ready]
+        waits = [wait for wait in waits if wait is not None]
+        return min(waits) if waits else None
+
+    def _select_with_strategy(self, strategy, exclude: Optional[Set[str]] = None) -> Optional[int]:
+        """用负载策略在就绪凭证中选择（需要比较所有候选，为 O(n)）"""
+        candidates = [
+            i for i in self._ready
+            if not (exclude and self._keys[i] in exclude) and self._is_available(i)
+        ]
+        if not candidates:
+            return self._least_limited(exclude)
+        scored = [(self._keys[i], self._get_runtime_state(self._keys[i])) for i in candidates]
+        if shared_state.enabled:
+            # 多 worker 时按所有 worker 的在途请求总数选择
+            totals = shared_state.in_flight_totals()
+            scored = [(key, state.with_in_flight(totals.get(key, 0))) for key, state in scored]
+        return candidates[strategy.select(scored)]
+
+    def _current_key(self) -> Optional[str]:
+        return self._keys[self.current_index] if 0 <= self.current_index < len(self._keys) else None
+
+    def rotation_snapshot(self) -> RotationSnapshot:
+        """取出自上次同步以来的轮换变化，交给心跳合并进共享游标"""
+        snapshot = RotationSnapshot(self._current_key(), self.usage_count, self._rotation_uses, self._rotation_moved)
+        self._rotation_uses = 0
+        self._rotation_moved = False
+        return snapshot
+
+    def apply_shared_rotation(self, cursor):
+        """
+        采用心跳合并后的共享游标。快照之后本进程又切换过凭证时保留本地位置（下次心跳再发布），
+        否则把快照之后新增的使用次数加在共享计数上。
+        """
+        if not self._rotation_moved and cursor.credential_key in self._key_index:
+            self.current_index = self._key_index[cursor.credential_key]
+            self.usage_count = cursor.usage_count + self._rotation_uses
+        if not shared_state.has_pending_manual:
+            self.manual_selected_index = self._key_index.get(cursor.manual_key) if cursor.manual_key else None
+
+    def get_next_credential(self, exclude: Optional[Set[str]] = None) -> Optional[Dict]:
+        """
+        获取下一个可用的凭证，根据轮换策略，并检查过期状态。
+        exclude 为需要跳过的凭证文件名集合（对冲/重试时换用其他账号），此时不推进正常轮换状态。
+
+        有效凭证保存在按索引排序的就绪环中，过期凭证由过期堆在到期时一次性移出，
+        轮换只需沿环前进，不再每次扫描全部凭证。
+        多 worker 部署时轮换只在内存中推进，由共享状态的心跳与其他 worker 的游标合并，选择时不访问数据库。
+        """
+        if exclude:
+            return self._select_next_credential(exclude)
+        key, usage_count = self._current_key(), self.usage_count
+        credential = self._select_next_credential()
+        if shared_state.enabled:
+            if self._current_key() != key:
+                self._rotation_moved = True
+                self._rotation_uses = self.usage_count
             else:
-                filename = os.path.basename(cred['file_path'])
-                logger.warning(f"Skipping expired credential: {filename}")
+                self._rotation_uses += max(0, self.usage_count - usage_count)
+        return credential
+
+    def _select_next_credential(self, exclude: Optional[Set[str]] = None) -> Optional[Dict]:
+        from config import get_rotation_count, get_selection_strategy as get_strategy_name
+
+        if not self.credentials:
+            return None
         
-        if not valid_credentials:
+        self._evict_expired()
+        if not self._ready:
             logger.error("No valid (non-expired) credentials available")
             return None
         
-        # 如果当前索引无效或指向过期凭证，重置到第一个有效凭证
-        current_valid_indices = [i for i, _ in valid_credentials]
-        if self.current_index not in current_valid_indices:
-            self.current_index = current_valid_indices[0]
-            self.usage_count = 0
-            logger.info(f"Reset to first valid credential index: {self.current_index}")
+        strategy = get_selection_strategy(get_strategy_name())
+        
+        if exclude:
+            if strategy is not None:
+                index = self._select_with_strategy(strategy, exclude)
+            else:
+                # 从当前轮换位置之后选取第一个未被排除的凭证
+                index = self._next_ready(self.current_index, exclude)
+                if index is None:
+                    index = self._least_limited(exclude)
+            if index is None:
+                return None
+            credential = self.credentials[index]
+            credential_filename = self._use_credential(credential)
+            logger.info(f"Using alternate credential: {credential_filename}")
+            return credential['data']
 
         rotation_count = get_rotation_count()
         
         # 如果有手动选择的凭证，优先使用（如果未过期）
         if self.manual_selected_index is not None and 0 <= self.manual_selected_index < len(self.credentials):
-            manual_cred = self.credentials[self.manual_selected_index]
-            if not self.is_token_expired(manual_cred['data']):
-                credential_filename = os.path.basename(manual_cred['file_path'])
-                usage_stats_manager.record_credential_usage(credential_filename)
+            if self.manual_selected_index in self._ready_pos:
+                manual_cred = self.credentials[self.manual_selected_index]
+                credential_filename = self._use_credential(manual_cred)
                 logger.info(f"Using manually selected credential: {credential_filename}")
                 return manual_cred['data']
             else:
                 logger.warning("Manually selected credential is expired, falling back to automatic rotation")
                 self.manual_selected_index = None
+                if shared_state.enabled:
+                    shared_state.set_manual_key(None)
         
-        # 找到当前索引在有效凭证中的位置
-        try:
-            current_valid_position = current_valid_indices.index(self.current_index)
-        except ValueError:
-            current_valid_position = 0
-            self.current_index = current_valid_indices[0]
+        # 当前凭证已过期、熔断或限速时，沿就绪环换到下一个
+        if self.current_index not in self._ready_pos or not self._is_available(self.current_index):
+            index = self._advance(self.current_index)
+            if index is None:
+                logger.error("All valid credentials are circuit-open")
+                return None
+            self.current_index = index
             self.usage_count = 0
         
         # 如果轮换次数设置为0，关闭轮换，只使用当前凭证
         if rotation_count == 0:
             credential = self.credentials[self.current_index]
-            credential_filename = os.path.basename(credential['file_path'])
-            usage_stats_manager.record_credential_usage(credential_filename)
+            credential_filename = self._use_credential(credential)
             logger.info(f"Using fixed credential (rotation disabled): {credential_filename}")
             return credential['data']
 
+        # 基于负载的选择策略（在途请求数 / EWMA延迟）
+        if strategy is not None:
+            index = self._select_with_strategy(strategy)
+            if index is None:
+                logger.error("All valid credentials are circuit-open")
+                return None
+            self.current_index = index
+            credential = self.credentials[self.current_index]
+            credential_filename = self._use_credential(credential)
+            logger.info(f"Using credential: {credential_filename} (strategy: {strategy.name})")
+            return credential['data']
+
         # 正常轮换逻辑
         if self.usage_count >= rotation_count:
-            # 轮换到下一个有效凭证
-            next_valid_position = (current_valid_position + 1) % len(valid_credentials)
-            self.current_index = current_valid_indices[next_valid_position]
+            # 轮换到下一个有效凭证（当前凭证可用，_advance 至少会回到它自己）
+            self.current_index = self._advance(self.current_index)
             self.usage_count = 0  # 重置计数器
             logger.info("Credential rotation triggered.")
 
@@ -152,8 +547,7 @@ class CodeBuddyTokenManager:
         self.usage_count += 1
         
         # Record usage stats
-        credential_filename = os.path.basename(credential['file_path'])
-        usage_stats_manager.record_credential_usage(credential_filename)
+        credential_filename = self._use_credential(credential)
         
         logger.info(
             f"Using credential: {credential_filename} "
@@ -168,6 +562,7 @@ class CodeBuddyTokenManager:
     def get_credentials_info(self) -> List[Dict]:
         """获取所有凭证的详细信息，包括过期状态"""
         credentials_info = []
+        in_flight_totals = shared_state.in_flight_totals() if shared_state.enabled else None
         for i, cred in enumerate(self.credentials):
             data = cred['data']
             filename = os.path.basename(cred['file_path'])
@@ -184,6 +579,12 @@ class CodeBuddyTokenManager:
             # 提取用户信息
             user_info = data.get('user_info', {})
             
+            runtime = self._get_runtime_state(filename).to_dict()
+            if in_flight_totals is not None:
+                runtime['in_flight'] = in_flight_totals.get(filename, 0)
+            breaker = self._get_breaker(filename).to_dict()
+            rate_limit = credential_rate_limiter.get_bucket(filename).to_dict()
+            
             info = {
                 'index': i,
                 'filename': filename,
@@ -200,14 +601,19 @@ class CodeBuddyTokenManager:
                 'domain': data.get('domain'),
                 'has_refresh_token': bool(data.get('refresh_token')),
                 'session_state': data.get('session_state'),
-                'file_path': cred['file_path']
+                'file_path': cred['file_path'],
+                'in_flight': runtime['in_flight'],
+                'ewma_ttfb': runtime['ewma_ttfb'],
+                'breaker_state': breaker['state'],
+                'breaker': breaker,
+                'rate_limit': rate_limit
             }
             
             credentials_info.append(info)
         
         return credentials_info
     
-    def add_credential(self, bearer_token: str, user_id: str = None, filename: str = None) -> bool:
+    async def add_credential(self, bearer_token: str, user_id: str = None, filename: str = None) -> bool:
         """添加新的凭证（简化版本，向后兼容）"""
         if not filename:
             filename = f"codebuddy_token_{len(self.credentials) + 1}.json"
@@ -221,9 +627,9 @@ class CodeBuddyTokenManager:
             "created_at": int(time.time())
         }
         
-        return self.add_credential_with_data(credential_data, filename)
+        return await self.add_credential_with_data(credential_data, filename)
     
-    def add_credential_with_data(self, credential_data: Dict[str, Any], filename: str = None) -> bool:
+    async def add_credential_with_data(self, credential_data: Dict[str, Any], filename: str = None) -> bool:
         """添加新的凭证（完整数据版本）"""
         if not filename:
             user_id = credential_data.get('user_id', 'unknown')
@@ -234,49 +640,43 @@ class CodeBuddyTokenManager:
         if not filename.endswith('.json'):
             filename += '.json'
         
-        file_path = os.path.join(self.creds_dir, filename)
+        file_path = self.store.path_for(filename)
         
         # 确保必要字段存在
         if 'created_at' not in credential_data:
             credential_data['created_at'] = int(time.time())
         
         try:
-            # 确保目录存在
-            if not os.path.exists(self.creds_dir):
-                os.makedirs(self.creds_dir)
-            
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(credential_data, f, indent=4, ensure_ascii=False)
+            # 在线程中原子写入（目录后端为临时文件 + fsync + rename），不阻塞进行中的流式响应
+            await self.store.save(filename, credential_data)
             
             logger.info(f"Added new credential: {filename}")
-            self.load_all_tokens()  # 重新加载
+            # 增量加入凭证列表，不重新加载整个目录
+            self.apply_credential_changes(
+                {filename: (file_path, credential_data, self.store.signature(filename))}, []
+            )
             return True
         except Exception as e:
             logger.error(f"Failed to save credential: {e}")
             return False
 
-    def delete_credential_by_index(self, index: int) -> bool:
-        """删除指定索引的凭证文件，并重新加载列表"""
+    async def delete_credential_by_index(self, index: int) -> bool:
+        """删除指定索引的凭证文件，并从列表中移除（保留其他凭证的轮换与健康状态）"""
         try:
             if not (0 <= index < len(self.credentials)):
                 logger.error(f"Invalid credential index for deletion: {index}")
                 return False
 
-            file_path = self.credentials[index]['file_path']
-            filename = os.path.basename(file_path)
+            filename = os.path.basename(self.credentials[index]['file_path'])
 
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if await self.store.delete(filename):
                 logger.info(f"Deleted credential file: {filename}")
             else:
                 logger.warning(f"Credential file already missing: {filename}")
 
-            # 重新加载凭证列表，重置索引等状态
-            self.load_all_tokens()
-            # 清理手动选择（若已删除的索引影响手动选择状态）
-            if self.manual_selected_index is not None and self.manual_selected_index == index:
-                self.manual_selected_index = None
-                logger.info("Cleared manual selection because deleted credential was selected")
+            # 增量移除，手动选择与轮换位置会映射到新的索引
+            self._file_signatures.pop(filename, None)
+            self._remove_credentials([filename])
             return True
         except Exception as e:
             logger.error(f"Failed to delete credential at index {index}: {e}")
@@ -287,6 +687,8 @@ class CodeBuddyTokenManager:
         if 0 <= index < len(self.credentials):
             self.manual_selected_index = index
             credential_filename = os.path.basename(self.credentials[index]['file_path'])
+            if shared_state.enabled:
+                shared_state.set_manual_key(credential_filename)
             logger.info(f"Manually selected credential: {credential_filename} (index: {index})")
             return True
         else:
@@ -296,6 +698,8 @@ class CodeBuddyTokenManager:
     def clear_manual_selection(self):
         """清除手动选择，恢复自动轮换"""
         self.manual_selected_index = None
+        if shared_state.enabled:
+            shared_state.set_manual_key(None)
         logger.info("Cleared manual credential selection, resumed automatic rotation")
     
     def get_current_credential_info(self) -> Dict:
@@ -0,0 +1,94 @@
+"""
+Credential Selection - 可插拔的凭证选择策略
+
+默认的 round_robin 由 CodeBuddyTokenManager 自身按 CODEBUDDY_ROTATION_COUNT 轮换实现；
+这里提供基于运行时负载的策略，依据路由在请求开始/结束时更新的
+每凭证在途请求数与首字节延迟（EWMA）进行选择。
+"""
+from typing import Dict, List, Optional, Tuple
+
+EWMA_ALPHA = 0.3
+
+
+class CredentialRuntimeState:
+    """单个凭证的运行时负载状态（不持久化）"""
+
+    __slots__ = ("in_flight", "ewma_ttfb", "ttfb_samples", "last_used")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.ewma_ttfb: Optional[float] = None
+        self.ttfb_samples = 0
+        self.last_used = 0.0
+
+    def record_ttfb(self, seconds: float, alpha: float = EWMA_ALPHA):
+        if self.ewma_ttfb is None:
+            self.ewma_ttfb = seconds
+        else:
+            self.ewma_ttfb = alpha * seconds + (1 - alpha) * self.ewma_ttfb
+        self.ttfb_samples += 1
+
+    def with_in_flight(self, in_flight: int) -> "CredentialRuntimeState":
+        """返回替换了在途请求数的副本（多 worker 时使用所有 worker 的总和）"""
+        state = CredentialRuntimeState()
+        state.in_flight = in_flight
+        state.ewma_ttfb = self.ewma_ttfb
+        state.ttfb_samples = self.ttfb_samples
+        state.last_used = self.last_used
+        return state
+
+    def to_dict(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "ewma_ttfb": round(self.ewma_ttfb, 3) if self.ewma_ttfb is not None else None,
+            "ttfb_samples": self.ttfb_samples
+        }
+
+
+class SelectionStrategy:
+    """选择策略基类：从候选 (凭证标识, 运行时状态) 列表中返回被选中的下标"""
+
+    name = ""
+
+    def select(self, candidates: List[Tuple[str, CredentialRuntimeState]]) -> int:
+        raise NotImplementedError
+
+
+class LeastInFlightStrategy(SelectionStrategy):
+    """选择在途请求最少的凭证；并列时选择最久未使用的"""
+
+    name = "least_in_flight"
+
+    def select(self, candidates: List[Tuple[str, CredentialRuntimeState]]) -> int:
+        return min(
+            range(len(candidates)),
+            key=lambda i: (candidates[i][1].in_flight, candidates[i][1].last_used)
+        )
+
+
+class EWMALatencyStrategy(SelectionStrategy):
+    """
+    按 EWMA 首字节延迟 × (在途请求数 + 1) 估算成本，选择成本最低的凭证。
+    尚无延迟样本的凭证成本视为 0，使新凭证能先被探测。
+    """
+
+    name = "ewma_latency"
+
+    def select(self, candidates: List[Tuple[str, CredentialRuntimeState]]) -> int:
+        def cost(i: int):
+            state = candidates[i][1]
+            latency = state.ewma_ttfb or 0.0
+            return (latency * (state.in_flight + 1), state.in_flight, state.last_used)
+
+        return min(range(len(candidates)), key=cost)
+
+
+SELECTION_STRATEGIES: Dict[str, SelectionStrategy] = {
+    LeastInFlightStrategy.name: LeastInFlightStrategy(),
+    EWMALatencyStrategy.name: EWMALatencyStrategy(),
+}
+
+
+def get_selection_strategy(name: str) -> Optional[SelectionStrategy]:
+    """返回对应的策略；round_robin 或未知名称返回 None，由管理器执行默认轮换"""
+    return SELECTION_STRATEGIES.get((name or "").strip().lower())
@@ -0,0 +1,298 @@
+"""
+Credential Store - 可插拔的凭证存储后端
+
+- directory: 默认后端，每个凭证一个 JSON 文件（兼容原有 .codebuddy_creds 布局），支持目录监视
+- sqlite:    所有凭证保存在一个 SQLite 数据库中，按过期时间和账号建立索引，
+             启动时一次查询即可加载，适合大规模账号池；首次启动时自动从凭证目录迁移；
+             按 updated_at 检测其他进程（多 worker）写入的变化
+
+凭证统一以 key（原凭证文件名）标识，CodeBuddyTokenManager 只通过此接口读写。
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .persistence import persistence_writer
+
+logger = logging.getLogger(__name__)
+
+
+def _credential_expiry(data: Dict[str, Any]) -> Optional[int]:
+    created_at = data.get('created_at')
+    expires_in = data.get('expires_in')
+    if not created_at or not expires_in:
+        return None
+    return int(created_at) + int(expires_in)
+
+
+class CredentialStore:
+    """存储后端接口"""
+
+    name = ""
+    supports_watch = False
+
+    def __init__(self, creds_dir: str):
+        self.creds_dir = creds_dir
+
+    def path_for(self, key: str) -> str:
+        """凭证在凭证目录下对应的路径（目录后端为真实文件，其他后端仅用于显示和标识）"""
+        return os.path.join(self.creds_dir, key)
+
+    def load_all(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """启动时加载全部凭证，返回 (key, data) 列表"""
+        raise NotImplementedError
+
+    async def save(self, key: str, data: Dict[str, Any]):
+        """原子地保存一个凭证（新增或覆盖），失败时抛出异常"""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        """删除凭证，返回是否确实存在"""
+        raise NotImplementedError
+
+    def signature(self, key: str) -> Optional[tuple]:
+        """用于变化检测的签名（仅支持监视的后端）"""
+        return None
+
+    def scan(self) -> Dict[str, tuple]:
+        """返回所有凭证的变化检测签名（仅支持监视的后端）"""
+        raise NotImplementedError
+
+    def read(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+        """读取单个凭证，返回 (data, signature)（仅支持监视的后端）"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class DirectoryCredentialStore(CredentialStore):
+    """每个凭证一个 JSON 文件"""
+
+    name = "directory"
+    supports_watch = True
+
+    def load_all(self) -> List[Tuple[str, Dict[str, Any]]]:
+        if not os.path.exists(self.creds_dir):
+            os.makedirs(self.creds_dir)
+            logger.warning(f"Credentials directory created at {self.creds_dir}. No credentials found.")
+            return []
+
+        entries = []
+        for file_path in glob.glob(os.path.join(self.creds_dir, '*.json')):
+            key = os.path.basename(file_path)
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    entries.append((key, json.load(f)))
+            except Exception as e:
+                logger.error(f"Failed to load credential file {key}: {e}")
+        return entries
+
+    async def save(self, key: str, data: Dict[str, Any]):
+        await persistence_writer.write_json(self.path_for(key), data)
+
+    async def delete(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(os.remove, self.path_for(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def signature(self, key: str) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path_for(key))
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def scan(self) -> Dict[str, tuple]:
+        """只 stat 不解析，返回目录中每个凭证文件的 (mtime_ns, size)；可在线程中调用"""
+        signatures = {}
+        try:
+            with os.scandir(self.creds_dir) as entries:
+                for entry in entries:
+                    # 跳过原子写入使用的隐藏临时文件
+                    if entry.name.startswith('.') or not entry.name.endswith('.json'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    signatures[entry.name] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+        return signatures
+
+    def read(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+        """读取单个凭证文件，返回 (data, signature)；文件不完整或无法解析时 data 为 None"""
+        signature = self.signature(key)
+        try:
+            with open(self.path_for(key), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read credential file {key}: {e}")
+            return None, signature
+        return (data if isinstance(data, dict) else {}), signature
+
+
+class SQLiteCredentialStore(CredentialStore):
+    """所有凭证保存在一个 SQLite 数据库中"""
+
+    name = "sqlite"
+    supports_watch = True
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS credentials (
+            key TEXT PRIMARY KEY,
+            user_id TEXT,
+            expires_at INTEGER,
+            has_refresh_token INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_credentials_expires_at ON credentials (expires_at);
+        CREATE INDEX IF NOT EXISTS idx_credentials_user_id ON credentials (user_id);
+    """
+
+    def __init__(self, creds_dir: str, db_path: str):
+        super().__init__(creds_dir)
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 写操作在线程中执行，用锁串行化对同一连接的访问
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    def _row(self, key: str, data: Dict[str, Any]) -> tuple:
+        return (
+            key,
+            data.get('user_id'),
+            _credential_expiry(data),
+            1 if data.get('refresh_token') else 0,
+            json.dumps(data, ensure_ascii=False),
+            time.time_ns()
+        )
+
+    def _upsert_many(self, rows: List[tuple]):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO credentials (key, user_id, expires_at, has_refresh_token, data, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET user_id=excluded.user_id, expires_at=excluded.expires_at, "
+                    "has_refresh_token=excluded.has_refresh_token, data=excluded.data, updated_at=excluded.updated_at",
+                    rows
+                )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM credentials").fetchone()[0]
+
+    def load_all(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, data FROM credentials ORDER BY key").fetchall()
+        entries = []
+        for key, text in rows:
+            try:
+                entries.append((key, json.loads(text)))
+            except ValueError as e:
+                logger.error(f"Failed to decode credential {key} from database: {e}")
+        return entries
+
+    async def save(self, key: str, data: Dict[str, Any]):
+        row = self._row(key, data)
+        await asyncio.to_thread(self._upsert_many, [row])
+
+    async def delete(self, key: str) -> bool:
+        def _delete():
+            with self._lock:
+                cursor = self._conn.execute("DELETE FROM credentials WHERE key = ?", (key,))
+                return cursor.rowcount > 0
+        return await asyncio.to_thread(_delete)
+
+    def signature(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute("SELECT updated_at FROM credentials WHERE key = ?", (key,)).fetchone()
+        return (row[0],) if row else None
+
+    def scan(self) -> Dict[str, tuple]:
+        """返回每个凭证的 (updated_at,)，只读索引列，不解码凭证数据"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, updated_at FROM credentials").fetchall()
+        return {key: (updated_at,) for key, updated_at in rows}
+
+    def read(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data, updated_at FROM credentials WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        try:
+            data = json.loads(row[0])
+        except ValueError as e:
+            logger.warning(f"Failed to decode credential {key} from database: {e}")
+            return None, (row[1],)
+        return (data if isinstance(data, dict) else {}), (row[1],)
+
+    def keys_expiring_before(self, timestamp: int) -> List[str]:
+        """按过期时间索引查询在 timestamp 之前过期的凭证"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM credentials WHERE expires_at IS NOT NULL AND expires_at <= ? ORDER BY expires_at",
+                (timestamp,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def keys_for_user(self, user_id: str) -> List[str]:
+        """按账号索引查询凭证"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM credentials WHERE user_id = ?", (user_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def migrate_from_directory(self, creds_dir: Optional[str] = None) -> int:
+        """一次性把凭证目录中的 JSON 文件导入数据库（已存在的 key 会被覆盖），返回导入数量"""
+        directory = DirectoryCredentialStore(creds_dir or self.creds_dir)
+        if not os.path.isdir(directory.creds_dir):
+            return 0
+        rows = [
+            self._row(key, data) for key, data in directory.load_all()
+            if isinstance(data, dict) and 'bearer_token' in data
+        ]
+        if rows:
+            self._upsert_many(rows)
+        logger.info(f"Migrated {len(rows)} credentials from {directory.creds_dir} into {self.db_path}")
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_credential_store(creds_dir: str) -> CredentialStore:
+    """根据 CODEBUDDY_CREDS_BACKEND 创建存储后端"""
+    from config import get_creds_backend, get_creds_db_path
+
+    backend = get_creds_backend()
+    if backend == SQLiteCredentialStore.name:
+        db_path = get_creds_db_path() or os.path.join(creds_dir, 'credentials.db')
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(os.path.dirname(__file__), '..', db_path)
+        store = SQLiteCredentialStore(creds_dir, db_path)
+        if store.count() == 0:
+            # 首次切换到 SQLite 时自动迁移现有凭证目录
+            store.migrate_from_directory()
+        return store
+
+    if backend != DirectoryCredentialStore.name:
+        logger.warning(f"Unknown CODEBUDDY_CREDS_BACKEND '{backend}', using directory backend")
+    return DirectoryCredentialStore(creds_dir)
@@ -0,0 +1,68 @@
+"""
+Credential Watcher - 基于 mtime 的凭证目录增量监视（SQLite 后端按 updated_at 检测）
+
+定期 stat 凭证目录（不解析文件），只读取 mtime/大小发生变化的文件，
+把新增、修改和删除增量应用到 CodeBuddyTokenManager，外部放入目录的凭证无需重启或界面操作即可生效。
+目录扫描和文件读取在线程中执行，不阻塞事件循环。
+"""
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialWatcher:
+    """凭证目录监视器，由 web.py 的 lifespan 启动和停止"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        from config import get_creds_watch_interval
+        from .codebuddy_token_manager import codebuddy_token_manager
+        interval = get_creds_watch_interval()
+        if interval <= 0 or self._task is not None:
+            return
+        if not codebuddy_token_manager.store.supports_watch:
+            # 存储后端不支持变化检测时不监视
+            return
+        self._task = asyncio.create_task(self._loop(interval))
+        logger.info(f"Watching credentials directory every {interval}s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Credential directory scan failed: {e}")
+
+    async def poll(self) -> bool:
+        """扫描一次目录并应用变化，返回是否有变化"""
+        from .codebuddy_token_manager import codebuddy_token_manager as manager
+
+        signatures = await asyncio.to_thread(manager.scan_credentials_dir)
+        changed, deleted = manager.diff_credentials_dir(signatures)
+        if not changed and not deleted:
+            return False
+
+        def _read_changed():
+            return {name: manager.read_credential_file(name) for name in changed}
+
+        loaded = await asyncio.to_thread(_read_changed)
+        manager.apply_credential_changes(loaded, deleted)
+        return True
+
+
+# 全局监视器实例
+credential_watcher = CredentialWatcher()
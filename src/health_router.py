@@ -2,6 +2,7 @@
 Health check router for CodeBuddy2API
 """
 from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
 from datetime import datetime, timezone
 import time
 from typing import Dict, Any
@@ -13,6 +14,15 @@ from .auth import authenticate
 router = APIRouter()
 START_TIME = time.time()
 
+# 启动流程（含上游连接预热）完成后才置为 True
+_service_ready = False
+
+
+def mark_ready(ready: bool = True):
+    """由 web.py 的 lifespan 在启动完成后调用"""
+    global _service_ready
+    _service_ready = ready
+
 @router.get("/health", response_model=Dict[str, Any])
 async def health_check(_token: str = Depends(authenticate)):
     """健康检查端点"""
@@ -25,4 +35,12 @@ async def health_check(_token: str = Depends(authenticate)):
         "uptime_seconds": round(time.time() - START_TIME, 2),
         "memory_usage_mb": process.memory_info().rss / 1024 / 1024,
         "cpu_percent": process.cpu_percent(interval=0.1),
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/ready", response_model=Dict[str, Any])
+async def readiness_check():
+    """就绪检查端点（供负载均衡/滚动发布探测，不需要认证）"""
+    if not _service_ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
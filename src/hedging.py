@@ -0,0 +1,97 @@
+"""
+Hedging Policy - 首字节过慢时的对冲请求策略
+
+记录最近的上游首字节延迟（TTFB），据此计算对冲阈值，并限制每分钟的对冲次数，
+保证对冲不会让上游负载翻倍。
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# 学习到足够样本之前使用的默认阈值（秒）
+DEFAULT_HEDGE_DELAY = 5.0
+MIN_SAMPLES_FOR_P95 = 20
+MIN_HEDGE_DELAY = 0.5
+
+
+class HedgePolicy:
+    """对冲阈值与频率控制"""
+
+    def __init__(self, sample_size: int = 500):
+        self._lock = threading.Lock()
+        self._ttfb_samples = deque(maxlen=sample_size)
+        self._hedge_times = deque()
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def record_ttfb(self, seconds: float):
+        """记录一次上游首字节延迟"""
+        with self._lock:
+            self._ttfb_samples.append(seconds)
+
+    def learned_p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._ttfb_samples) < MIN_SAMPLES_FOR_P95:
+                return None
+            ordered = sorted(self._ttfb_samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_delay(self) -> Optional[float]:
+        """返回本次请求的对冲阈值；未启用对冲时返回 None"""
+        from config import get_hedge_enabled, get_hedge_delay
+
+        if not get_hedge_enabled():
+            return None
+
+        configured = get_hedge_delay()
+        if configured > 0:
+            return configured
+
+        p95 = self.learned_p95()
+        if p95 is None:
+            return DEFAULT_HEDGE_DELAY
+        return max(p95, MIN_HEDGE_DELAY)
+
+    def try_acquire(self) -> Optional[float]:
+        """在每分钟配额内申请一次对冲；成功时返回用于 cancel_acquire 的令牌（申请时间），配额用完时返回 None"""
+        from config import get_hedge_max_per_minute
+
+        limit = get_hedge_max_per_minute()
+        now = time.monotonic()
+        with self._lock:
+            while self._hedge_times and now - self._hedge_times[0] >= 60:
+                self._hedge_times.popleft()
+            if len(self._hedge_times) >= limit:
+                return None
+            self._hedge_times.append(now)
+            self.hedges_fired += 1
+            return now
+
+    def cancel_acquire(self, token: float):
+        """归还 try_acquire 申请到但最终没有发出的对冲配额：移除该次申请自己的记录，而不是最新的一条"""
+        with self._lock:
+            self.hedges_fired -= 1
+            try:
+                self._hedge_times.remove(token)
+            except ValueError:
+                pass  # 已超过一分钟被移出窗口
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def get_stats(self):
+        p95 = self.learned_p95()
+        with self._lock:
+            return {
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "hedges_last_minute": len(self._hedge_times),
+                "ttfb_samples": len(self._ttfb_samples),
+                "ttfb_p95": round(p95, 3) if p95 is not None else None
+            }
+
+
+# 全局对冲策略实例
+hedge_policy = HedgePolicy()
@@ -0,0 +1,139 @@
+"""
+Upstream HTTP Pool - 所有CodeBuddy上游调用共享的连接池
+"""
+import asyncio
+import logging
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamHTTPPool:
+    """共享的 httpx.AsyncClient，由 web.py 的 lifespan 创建和关闭"""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._http2 = False  # 当前客户端是否实际启用了 HTTP/2
+        self._rewarm_task: Optional[asyncio.Task] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        from config import (
+            get_http2_enabled, get_pool_max_connections,
+            get_pool_max_keepalive, get_pool_keepalive_expiry
+        )
+
+        http2 = get_http2_enabled()
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("CODEBUDDY_HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+                http2 = False
+        self._http2 = http2
+
+        limits = httpx.Limits(
+            max_connections=get_pool_max_connections(),
+            max_keepalive_connections=get_pool_max_keepalive(),
+            keepalive_expiry=get_pool_keepalive_expiry()
+        )
+        logger.info(
+            f"Creating upstream connection pool (http2={http2}, "
+            f"max_connections={limits.max_connections}, "
+            f"max_keepalive={limits.max_keepalive_connections}, "
+            f"keepalive_expiry={limits.keepalive_expiry}s)"
+        )
+        # 单个请求通过 timeout 参数覆盖此默认值。
+        # 所有凭证共用同一个客户端：cookie 策略拒绝所有域名，上游的 Set-Cookie 不会被保存，
+        # 某个凭证会话的 cookie 不会随其他凭证的请求发出
+        return httpx.AsyncClient(
+            verify=False, http2=http2, limits=limits, timeout=120.0,
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+        )
+
+    async def start(self):
+        """创建连接池（应用启动时调用）"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+
+    async def warm_up(self, connections: int, timeout: float = 15.0) -> int:
+        """
+        预先解析上游域名并并发建立 connections 个连接（含TLS握手），放入连接池备用。
+        HTTP/2 下并发请求会复用同一个连接，只预热一个。返回成功预热的连接数。
+        """
+        from config import get_codebuddy_api_endpoint, get_pool_max_keepalive
+
+        # 超过保活上限的连接在请求结束后会被直接关闭，预热没有意义
+        connections = min(connections, get_pool_max_keepalive())
+        if connections <= 0:
+            return 0
+        client = self.client
+        if self._http2:
+            connections = 1
+
+        base_url = get_codebuddy_api_endpoint()
+        parts = urlsplit(base_url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            await asyncio.get_running_loop().getaddrinfo(parts.hostname, port)
+        except OSError as e:
+            logger.warning(f"Warm-up DNS resolution failed for {parts.hostname}: {e}")
+            return 0
+
+        # HTTP/1.1 下并发请求会各自占用一个连接，请求结束后连接保留在池中
+        async def _open_one() -> bool:
+            try:
+                response = await client.head(base_url, timeout=timeout)
+                await response.aclose()
+                return True
+            except httpx.HTTPError as e:
+                logger.debug(f"Warm-up connection failed: {e}")
+                return False
+
+        results = await asyncio.gather(*(_open_one() for _ in range(connections)))
+        warmed = sum(results)
+        logger.info(f"Warmed up {warmed}/{connections} upstream connections to {parts.hostname}")
+        return warmed
+
+    def start_rewarm_loop(self, connections: int, interval: float):
+        """在空闲连接过期前周期性地重新预热"""
+        if connections <= 0 or interval <= 0 or self._rewarm_task is not None:
+            return
+
+        async def _loop():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.warm_up(connections)
+                except Exception as e:
+                    logger.warning(f"Periodic upstream warm-up failed: {e}")
+
+        self._rewarm_task = asyncio.create_task(_loop())
+
+    async def close(self):
+        """关闭连接池并释放所有连接（应用关闭时调用）"""
+        if self._rewarm_task is not None:
+            self._rewarm_task.cancel()
+            try:
+                await self._rewarm_task
+            except asyncio.CancelledError:
+                pass
+            self._rewarm_task = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Upstream connection pool closed")
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """获取共享客户端；若未经 lifespan 启动（如脚本中直接调用）则惰性创建"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+
+# 全局连接池实例
+upstream_http_pool = UpstreamHTTPPool()
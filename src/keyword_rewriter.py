@@ -0,0 +1,271 @@
+"""
+Keyword Rewriter - 请求消息与响应内容中的关键词替换
+
+替换规则来自配置 CODEBUDDY_KEYWORD_REPLACEMENTS（JSON 对象，原文 -> 替换文本），
+对文本只做一遍最左最长匹配：同一位置上较长的规则优先（"Claude Code" 先于 "Claude"），
+替换后的文本不会再被其他规则改写。
+
+- 规则较少（不超过 FIND_SCAN_MAX_RULES 条）时，用 str.find 找每条规则的下一个出现位置，
+  每次取最靠前的一个替换。str.find 在 C 中快速跳跃查找，比正则逐字符扫描快，
+  也免去了逐条 str.replace 时每条规则复制一次整段文本。
+- 规则较多时编译成一个按长度降序排列的交替正则，耗时基本不随规则数增长。
+
+见 benchmarks/bench_keyword_rewrite.py。配置热更新后在下一次调用时重新编译。
+
+响应方向使用 CODEBUDDY_RESPONSE_REPLACEMENTS（未配置时为请求规则的反向规则），
+流式响应由 StreamRewriter 按段替换，只暂存可能跨分块的关键词开头部分。
+"""
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .transform_cache import transform_cache, text_size, MIN_CACHEABLE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+# 不超过该规则数时用 str.find 扫描，否则用交替正则
+FIND_SCAN_MAX_RULES = 8
+
+
+def parse_rules(raw: Any) -> Dict[str, str]:
+    """解析规则：JSON 对象 {原文: 替换}，或 [[原文, 替换], ...]；空字符串表示不替换"""
+    if isinstance(raw, str):
+        raw = json.loads(raw) if raw.strip() else {}
+    if isinstance(raw, list):
+        raw = dict(raw)
+    if not isinstance(raw, dict):
+        raise ValueError("keyword replacements must be a JSON object")
+    return {str(source): str(target) for source, target in raw.items() if source}
+
+
+class CompiledRules:
+    """编译后的一组替换规则"""
+
+    __slots__ = ("rules", "keys", "pattern", "prefixes", "max_prefix")
+
+    def __init__(self, rules: Dict[str, str]):
+        self.rules = rules
+        # 按长度降序：同一位置上先尝试的就是最长的规则
+        self.keys = sorted(rules, key=len, reverse=True)
+        self.pattern = None
+        if len(self.keys) > FIND_SCAN_MAX_RULES:
+            self.pattern = re.compile("|".join(map(re.escape, self.keys)))
+        # 各规则的真前缀，流式替换时用来判断末尾是否可能是被分块截断的关键词
+        self.prefixes = {key[:i] for key in self.keys for i in range(1, len(key))}
+        self.max_prefix = max(map(len, self.prefixes), default=0)
+
+    @property
+    def empty(self) -> bool:
+        return not self.keys
+
+    def _substitute(self, match: "re.Match") -> str:
+        return self.rules[match.group(0)]
+
+    def rewrite(self, text: str) -> str:
+        """没有任何匹配时返回原对象"""
+        if not self.keys or not text:
+            return text
+        if self.pattern is not None:
+            return self.pattern.sub(self._substitute, text)
+        parts = []
+        pos = 0
+        for position, key in self.matches(text):
+            parts.append(text[pos:position])
+            parts.append(self.rules[key])
+            pos = position + len(key)
+        if not parts:
+            return text
+        parts.append(text[pos:])
+        return "".join(parts)
+
+    def matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """按最左最长、互不重叠的规则依次返回 (位置, 原文)"""
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                yield match.start(), match.group(0)
+            return
+        find = text.find
+        # [下一个出现位置, 规则]，顺序与 self.keys 相同（长的在前）
+        pending = []
+        for key in self.keys:
+            position = find(key)
+            if position != -1:
+                pending.append([position, key])
+        pos = 0
+        while pending:
+            best = None
+            for entry in pending:
+                if entry[0] < pos:
+                    # 该出现位置已被前一次替换覆盖，从当前位置重新查找
+                    entry[0] = find(entry[1], pos)
+                # 严格小于：位置相同时保留先出现的（更长的）规则
+                if entry[0] != -1 and (best is None or entry[0] < best[0]):
+                    best = entry
+            if best is None:
+                return
+            position, key = best
+            yield position, key
+            pos = position + len(key)
+            pending = [entry for entry in pending if entry[0] != -1]
+
+    def partial_suffix(self, text: str) -> int:
+        """text 末尾可能是某条规则开头部分的最长长度（0 表示末尾不可能被后续文本补成关键词）"""
+        for length in range(min(self.max_prefix, len(text)), 0, -1):
+            if text[-length:] in self.prefixes:
+                return length
+        return 0
+
+
+class StreamRewriter:
+    """
+    对分段到达的文本（如流式响应的 delta.content）做与整段替换相同结果的替换。
+
+    每次只暂存必要的末尾：可能被下一段补成关键词的最长后缀；已经确定的匹配和其余文本立即输出。
+    """
+
+    __slots__ = ("compiled", "pending")
+
+    def __init__(self, compiled: CompiledRules):
+        self.compiled = compiled
+        self.pending = ""
+
+    def feed(self, text: str) -> str:
+        data = self.pending + text if self.pending else text
+        if not data:
+            return ""
+        # 从 hold 开始的后缀可能随后续文本变成匹配；从 hold 之前开始的匹配不会再变
+        hold = len(data) - self.compiled.partial_suffix(data)
+        parts = []
+        pos = 0
+        for position, key in self.compiled.matches(data):
+            if position >= hold:
+                break
+            parts.append(data[pos:position])
+            parts.append(self.compiled.rules[key])
+            pos = position + len(key)
+        cut = max(hold, pos)
+        parts.append(data[pos:cut])
+        self.pending = data[cut:]
+        return "".join(parts)
+
+    def flush(self) -> str:
+        """文本结束时输出暂存的末尾"""
+        data, self.pending = self.pending, ""
+        return self.compiled.rewrite(data)
+
+
+def invert_rules(rules: Dict[str, str]) -> Dict[str, str]:
+    """反向规则 {替换: 原文}；多条规则替换为同一文本时取原文最长的一条"""
+    inverted: Dict[str, str] = {}
+    for source in sorted(rules, key=len):
+        if rules[source]:
+            inverted[rules[source]] = source
+    return inverted
+
+
+def _request_rules_source() -> Any:
+    from config import get_keyword_replacements
+    return get_keyword_replacements()
+
+
+def _response_rules_source() -> Any:
+    from config import get_response_replacements, get_keyword_replacements
+    raw = get_response_replacements()
+    if isinstance(raw, str) and not raw.strip():
+        # 未单独配置时使用请求替换规则的反向规则
+        return ("inverse", get_keyword_replacements())
+    return ("rules", raw)
+
+
+def _parse_response_source(source: Any) -> Dict[str, str]:
+    kind, raw = source
+    rules = parse_rules(raw)
+    return invert_rules(rules) if kind == "inverse" else rules
+
+
+class KeywordRewriter:
+    """按当前配置替换关键词，配置变化时重新编译"""
+
+    def __init__(self, setting_name: str, source: Callable[[], Any],
+                 parse: Callable[[Any], Dict[str, str]] = parse_rules):
+        self.setting_name = setting_name
+        self._source = source
+        self._parse = parse
+        self._raw: Any = None
+        self._compiled = CompiledRules({})
+
+    def _current(self) -> CompiledRules:
+        raw = self._source()
+        if raw is not self._raw and raw != self._raw:
+            try:
+                self._compiled = CompiledRules(self._parse(raw))
+                # 缓存中的变换结果是按旧规则计算的
+                transform_cache.clear()
+                logger.info(f"Compiled {len(self._compiled.rules)} rules from {self.setting_name}")
+            except (ValueError, TypeError) as e:
+                # 配置无效时保留上一次有效的规则
+                logger.error(f"Invalid {self.setting_name}, keeping previous rules: {e}")
+            self._raw = raw
+        return self._compiled
+
+    def compiled(self) -> CompiledRules:
+        """当前生效的编译规则（流式替换时每个响应固定使用同一份）"""
+        return self._current()
+
+    @property
+    def rules(self) -> Dict[str, str]:
+        return dict(self._current().rules)
+
+    def rewrite(self, text: str) -> str:
+        """替换一段文本；非字符串原样返回；没有任何替换时返回原对象"""
+        if not isinstance(text, str):
+            return text
+        return self._rewrite_text(self._current(), text)
+
+    def _rewrite_text(self, compiled: CompiledRules, text: str) -> str:
+        """较长的文本经过变换缓存（重复发送的系统提示词、历史消息）"""
+        if len(text) < MIN_CACHEABLE_LENGTH:
+            return compiled.rewrite(text)
+
+        def compute():
+            result = compiled.rewrite(text)
+            # 没有替换时只记 None，命中时返回调用方传入的对象，保持“无替换返回原对象”
+            return None if result is text else result
+
+        cached = transform_cache.get_or_compute(
+            self.setting_name, (compiled, text), compute, lambda result: text_size(text, result)
+        )
+        return text if cached is None else cached
+
+    def rewrite_messages(self, messages: Optional[List[Dict[str, Any]]]) -> int:
+        """原地替换 OpenAI 格式消息中的文本（字符串 content 和 type=text 的内容块），返回被修改的文本段数"""
+        compiled = self._current()
+        if compiled.empty or not messages:
+            return 0
+        changed = 0
+        for msg in messages:
+            if not isinstance(msg, dict):
+                continue
+            content = msg.get("content")
+            if isinstance(content, str):
+                rewritten = self._rewrite_text(compiled, content)
+                # 没有匹配时返回原对象，用 is 判断免去整段比较
+                if rewritten is not content:
+                    msg["content"] = rewritten
+                    changed += 1
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict) and item.get("type") == "text" and isinstance(item.get("text"), str):
+                        rewritten = self._rewrite_text(compiled, item["text"])
+                        if rewritten is not item["text"]:
+                            item["text"] = rewritten
+                            changed += 1
+        return changed
+
+
+# 全局关键词替换实例：请求消息，以及（开启 CODEBUDDY_RESPONSE_REWRITE_ENABLED 时）响应内容
+keyword_rewriter = KeywordRewriter("CODEBUDDY_KEYWORD_REPLACEMENTS", _request_rules_source)
+response_keyword_rewriter = KeywordRewriter(
+    "CODEBUDDY_RESPONSE_REPLACEMENTS", _response_rules_source, _parse_response_source
+)
@@ -0,0 +1,319 @@
+"""
+Metrics - Prometheus 文本格式（0.0.4）的指标
+
+不依赖 prometheus_client：计数器和直方图只是字典和列表上的整数加法，热路径中每次记录为
+一次字典查找加一次 bisect，可以默认开启。凭证池状态、准入队列等在抓取时现场计算。
+"""
+import asyncio
+import bisect
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 事件循环延迟采样间隔（秒）
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """带标签的单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Gauge:
+    """抓取时通过回调取值的仪表；回调返回 {标签值元组: 数值}"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.callback = callback
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str):
+        self.values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) - amount
+
+    def render(self) -> Iterable[str]:
+        values = self.values
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.error(f"Failed to collect metric {self.name}: {e}")
+                values = {}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    """固定分桶直方图；各桶分别计数，输出时再累加为 Prometheus 要求的累计值"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # 标签值元组 -> [各桶计数..., +Inf 桶计数, 总和]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(series[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def _credential_pool_states() -> Dict[Tuple[str, ...], float]:
+    from .codebuddy_token_manager import codebuddy_token_manager as manager
+    from .circuit_breaker import OPEN, HALF_OPEN
+    from .rate_limiter import credential_rate_limiter
+
+    manager._evict_expired()
+    ready = set(manager._ready)
+    counts = {"ready": 0, "expired": 0, "circuit_open": 0, "half_open": 0, "rate_limited": 0}
+    for index, key in enumerate(manager._keys):
+        if index not in ready:
+            counts["expired"] += 1
+            continue
+        breaker = manager.breakers.get(key)
+        state = breaker.state if breaker is not None else None
+        if state == OPEN:
+            counts["circuit_open"] += 1
+        elif state == HALF_OPEN:
+            counts["half_open"] += 1
+        elif not credential_rate_limiter.is_available(key):
+            counts["rate_limited"] += 1
+        else:
+            counts["ready"] += 1
+    return {(state,): count for state, count in counts.items()}
+
+
+def _admission_values(attribute: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def collect():
+        from .admission import admission_controller
+        return {(): getattr(admission_controller, attribute)}
+    return collect
+
+
+class Metrics:
+    """服务的全部指标"""
+
+    def __init__(self):
+        self.http_requests = Counter(
+            "codebuddy_http_requests_total", "HTTP requests by route, method and status code.",
+            ("route", "method", "status")
+        )
+        self.chat_requests = Counter(
+            "codebuddy_chat_requests_total", "Chat completion requests by model, status and stream mode.",
+            ("model", "status", "stream")
+        )
+        self.upstream_requests = Counter(
+            "codebuddy_upstream_requests_total", "Upstream attempts by credential and status code.",
+            ("credential", "status")
+        )
+        # token 用量按维度分成三个计数器，避免 模型 × 凭证 × 客户端 的标签组合爆炸
+        self.model_tokens = Counter(
+            "codebuddy_tokens_total", "Tokens reported by the upstream by model and type.",
+            ("model", "type")
+        )
+        self.credential_tokens = Counter(
+            "codebuddy_credential_tokens_total", "Tokens reported by the upstream by credential and type.",
+            ("credential", "type")
+        )
+        self.client_tokens = Counter(
+            "codebuddy_client_tokens_total", "Tokens reported by the upstream by client (X-Client-Id header or request user field) and type.",
+            ("client", "type")
+        )
+        self.response_cache = Counter(
+            "codebuddy_response_cache_total", "Response cache lookups by result (hit, miss, bypass).",
+            ("result",)
+        )
+        self.queue_wait = Histogram(
+            "codebuddy_queue_wait_seconds", "Time chat requests waited for an admission slot."
+        )
+        self.upstream_ttfb = Histogram(
+            "codebuddy_upstream_ttfb_seconds", "Time to the first upstream byte."
+        )
+        self.request_duration = Histogram(
+            "codebuddy_request_duration_seconds", "Total chat request latency including the streamed body.",
+            labels=("stream",)
+        )
+        self.active_streams = Gauge(
+            "codebuddy_active_streams", "Streaming responses currently being sent to clients."
+        )
+        self.active_streams.set(0)
+        self.in_flight = Gauge(
+            "codebuddy_in_flight_requests", "Chat requests holding an admission slot.",
+            callback=_admission_values("in_flight")
+        )
+        self.queue_depth = Gauge(
+            "codebuddy_queue_depth", "Chat requests waiting for an admission slot.",
+            callback=_admission_values("queue_depth")
+        )
+        self.credentials = Gauge(
+            "codebuddy_credentials", "Credentials in the pool by state.", ("state",),
+            callback=_credential_pool_states
+        )
+        self.loop_lag = Gauge(
+            "codebuddy_event_loop_lag_seconds", "Most recent event loop scheduling delay."
+        )
+        self.loop_lag.set(0.0)
+        self.loop_lag_histogram = Histogram(
+            "codebuddy_event_loop_lag_distribution_seconds", "Event loop scheduling delay samples.",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+        )
+        self._all = [
+            self.http_requests, self.chat_requests, self.upstream_requests,
+            self.model_tokens, self.credential_tokens, self.client_tokens, self.response_cache, self.queue_wait, self.upstream_ttfb,
+            self.request_duration, self.active_streams, self.in_flight, self.queue_depth,
+            self.credentials, self.loop_lag, self.loop_lag_histogram
+        ]
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def observe_chat_request(self, model: str, status: int, stream: bool,
+                             ttfb: Optional[float], duration: float):
+        stream_label = "true" if stream else "false"
+        self.chat_requests.inc(model, str(status), stream_label)
+        if ttfb is not None:
+            self.upstream_ttfb.observe(ttfb)
+        self.request_duration.observe(duration, stream_label)
+
+    def observe_tokens(self, model: str, credential: Optional[str], client: str, tokens: Tuple[int, int, int]):
+        """tokens 为 (prompt, completion, total)"""
+        for token_type, amount in zip(("prompt", "completion"), tokens):
+            self.model_tokens.inc(model, token_type, amount=amount)
+            if credential:
+                self.credential_tokens.inc(credential, token_type, amount=amount)
+            self.client_tokens.inc(client, token_type, amount=amount)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._all:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    # --- 事件循环延迟 ---
+
+    def start(self):
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    async def _measure_loop_lag(self):
+        """sleep 实际醒来的时间比预期晚多少，即事件循环被阻塞的时长"""
+        while True:
+            expected = time.monotonic() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, time.monotonic() - expected)
+            self.loop_lag.set(lag)
+            self.loop_lag_histogram.observe(lag)
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：按路由模板、方法和状态码计数，不包装响应体"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Optional[Dict[object, str]] = None
+
+    def _route_template(self, scope) -> str:
+        """使用匹配到的路由模板而不是原始路径，避免路径参数和扫描请求造成标签爆炸"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            routes = getattr(getattr(scope.get("app"), "router", None), "routes", ())
+            self._route_paths = {
+                route.endpoint: route.path for route in routes if hasattr(route, "endpoint") and hasattr(route, "path")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.http_requests.inc(self._route_template(scope), scope["method"], str(status_holder[0]))
+
+
+# 全局指标实例
+metrics = Metrics()
@@ -0,0 +1,18 @@
+"""
+Metrics router for CodeBuddy2API - Prometheus 抓取端点
+"""
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from .auth import authenticate
+from .metrics import metrics
+
+router = APIRouter()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(_token: str = Depends(authenticate)):
+    """Prometheus 文本格式指标（使用与其他管理接口相同的 Bearer 密码）"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,128 @@
+"""
+Persistence - 不阻塞事件循环、崩溃安全的文件持久化
+
+所有写入都采用 临时文件 + fsync + 原子 rename，崩溃时目标文件要么是旧内容要么是新内容，
+不会留下被截断的 JSON。CoalescingWriter 把短时间内的多次写入合并为一批，在线程中执行；
+同一文件在一批内只写最后一次的内容（如批量刷新 token 时）。
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _fsync_directory(directory: str):
+    """rename 之后同步目录项，保证断电后新文件名可见（部分平台不支持，忽略）"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_text_atomic(file_path: str, text: str):
+    """先写入同目录下的隐藏临时文件并 fsync，再原子替换目标文件"""
+    directory = os.path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+def write_json_atomic(file_path: str, data: Any, indent: int = 4, ensure_ascii: bool = False):
+    write_text_atomic(file_path, json.dumps(data, indent=indent, ensure_ascii=ensure_ascii))
+
+
+class CoalescingWriter:
+    """
+    合并写入器。
+
+    write_json() 在调用时立即序列化数据快照，然后等待所在批次落盘后返回；
+    批次在第一个写入到达 delay 秒后开始，期间到达的写入合并到同一批，在线程中依次原子写入。
+    """
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self._pending: Dict[str, str] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.writes_requested = 0
+        self.files_written = 0
+        self.batches = 0
+
+    async def write_json(self, file_path: str, data: Any, indent: int = 4, ensure_ascii: bool = False):
+        """持久化 data 到 file_path，写入失败时抛出异常"""
+        text = json.dumps(data, indent=indent, ensure_ascii=ensure_ascii)
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending[file_path] = text
+        self._waiters.setdefault(file_path, []).append(waiter)
+        self.writes_requested += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        await waiter
+
+    async def _flush_loop(self):
+        await asyncio.sleep(self.delay)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            waiters, self._waiters = self._waiters, {}
+            errors = await asyncio.to_thread(self._write_batch, batch)
+            self.batches += 1
+            self.files_written += len(batch) - len(errors)
+            for file_path, futures in waiters.items():
+                error = errors.get(file_path)
+                for future in futures:
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+
+    @staticmethod
+    def _write_batch(batch: Dict[str, str]) -> Dict[str, Exception]:
+        errors = {}
+        for file_path, text in batch.items():
+            try:
+                write_text_atomic(file_path, text)
+            except Exception as e:
+                logger.error(f"Failed to persist {file_path}: {e}")
+                errors[file_path] = e
+        return errors
+
+    async def flush(self):
+        """等待所有已提交的写入完成（应用关闭时调用）"""
+        while self._flush_task is not None and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "writes_requested": self.writes_requested,
+            "files_written": self.files_written,
+            "batches": self.batches,
+            "pending": len(self._pending)
+        }
+
+
+# 全局写入器实例
+persistence_writer = CoalescingWriter()
@@ -0,0 +1,162 @@
+"""
+Rate Limiter - 每个凭证一个的自适应令牌桶
+
+凭证在收到第一个 429 之前不限速；之后速率从上限开始按 AIMD 自动调整：
+每次成功请求线性提高速率，收到 429 时速率减半并清空令牌；
+若上游返回 Retry-After，则在该时间内不再发放令牌。
+只有桶为空时才会延迟请求，路由和凭证选择据此改用其他凭证。
+"""
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveTokenBucket:
+    """单个凭证的令牌桶"""
+
+    def __init__(
+        self,
+        burst: float = 5.0,
+        min_rate: float = 0.1,
+        max_rate: float = 20.0,
+        increase: float = 0.05
+    ):
+        # 收到第一个 429 之前不限速（limited 为 False），速率保持在上限
+        self.rate = max_rate
+        self.limited = False
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+
+        self.tokens = burst
+        self.blocked_until = 0.0
+        self.rate_limited_count = 0
+        self._last_refill = time.monotonic()
+
+    def _refill(self, now: float):
+        # Retry-After 封锁期间的时间不产生令牌
+        elapsed = now - max(self._last_refill, self.blocked_until)
+        self._last_refill = now
+        if elapsed <= 0:
+            return
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def wait_time(self) -> float:
+        """距离下一个令牌可用的秒数，0 表示立即可用"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now + 1.0 / self.rate
+        if not self.limited or self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        if self.wait_time() > 0:
+            return False
+        self._take()
+        return True
+
+    def _take(self):
+        if self.limited:
+            self.tokens -= 1.0
+
+    async def acquire(self, max_wait: float) -> bool:
+        """获取一个令牌，需要等待时最多等待 max_wait 秒；超时返回 False"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.wait_time()
+            if wait <= 0:
+                self._take()
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """加性增"""
+        if self.limited:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """乘性减（第一次从上限减半，开始限速）；遵守 Retry-After"""
+        self.limited = True
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.rate_limited_count += 1
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "limited": self.limited,
+            "rate": round(self.rate, 3),
+            "tokens": round(self.tokens, 2),
+            "blocked_for": round(max(0.0, self.blocked_until - now), 1),
+            "rate_limited_count": self.rate_limited_count
+        }
+
+
+class CredentialRateLimiter:
+    """按凭证标识管理令牌桶"""
+
+    def __init__(self):
+        self.buckets: Dict[str, AdaptiveTokenBucket] = {}
+
+    def get_bucket(self, credential_key: str) -> AdaptiveTokenBucket:
+        bucket = self.buckets.get(credential_key)
+        if bucket is None:
+            from config import get_rate_limit_burst, get_rate_limit_min, get_rate_limit_max
+            bucket = AdaptiveTokenBucket(
+                burst=get_rate_limit_burst(),
+                min_rate=get_rate_limit_min(),
+                max_rate=get_rate_limit_max()
+            )
+            self.buckets[credential_key] = bucket
+        return bucket
+
+    def is_available(self, credential_key: str) -> bool:
+        """桶中是否有令牌（不消耗）"""
+        from config import get_rate_limit_enabled
+        if not get_rate_limit_enabled():
+            return True
+        return self.get_bucket(credential_key).wait_time() <= 0
+
+    async def acquire(self, credential_key: str) -> bool:
+        """为一次上游请求获取令牌，最多等待 CODEBUDDY_RATE_LIMIT_MAX_WAIT 秒"""
+        from config import get_rate_limit_enabled, get_rate_limit_max_wait
+        if not get_rate_limit_enabled():
+            return True
+        return await self.get_bucket(credential_key).acquire(get_rate_limit_max_wait())
+
+    def record_success(self, credential_key: str):
+        self.get_bucket(credential_key).on_success()
+
+    def record_rate_limited(self, credential_key: str, retry_after: Optional[float] = None):
+        self.get_bucket(credential_key).on_rate_limited(retry_after)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {key: bucket.to_dict() for key, bucket in self.buckets.items()}
+
+
+# 全局限速器实例
+credential_rate_limiter = CredentialRateLimiter()
@@ -0,0 +1,173 @@
+"""
+Response Cache - 确定性请求的响应缓存
+
+批量评测会反复发送完全相同的 temperature=0 请求，每次都要走一遍上游并消耗凭证额度。
+开启 CODEBUDDY_RESPONSE_CACHE_ENABLED 后：
+
+- key 为变换后（关键词替换、补系统消息之后）请求体的规范化哈希：模型、消息、工具、采样参数等，
+  不含 stream / stream_options 等只影响传输方式的字段，流式与非流式请求共享同一条缓存
+- 只缓存 temperature 为 0 的请求；请求头 X-Response-Cache: bypass 跳过缓存，force 强制缓存
+- 缓存合并后的完整 chat.completion（响应反向替换之前的内容），按字节上限 LRU 淘汰，超过 TTL 失效
+- 命中时非流式直接返回，流式按 chat.completion.chunk 重放，不占用上游连接和凭证
+
+缓存在每个 worker 进程内存中，不在 worker 之间共享。
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 请求头：bypass 跳过缓存（不读也不写），force 不论 temperature 都读写缓存
+CACHE_HEADER = "X-Response-Cache"
+BYPASS = "bypass"
+FORCE = "force"
+
+# 只影响传输方式、不影响生成结果的字段，不参与缓存 key
+_TRANSPORT_FIELDS = ("stream", "stream_options")
+# 单个响应超过缓存上限的该比例时不缓存
+MAX_ENTRY_FRACTION = 0.25
+
+
+def cache_mode(header_value: Optional[str]) -> Optional[str]:
+    """解析 X-Response-Cache 请求头，无法识别的值视为未设置"""
+    if not header_value:
+        return None
+    value = header_value.strip().lower()
+    if value in (BYPASS, "no-cache", "no-store"):
+        return BYPASS
+    if value == FORCE:
+        return FORCE
+    return None
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """变换后请求体的规范化哈希（键排序、紧凑分隔符）"""
+    canonical = {k: v for k, v in payload.items() if k not in _TRANSPORT_FIELDS}
+    encoded = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _sse(payload: Any) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+def replay_chunks(result: Dict[str, Any], include_usage: bool) -> Iterator[bytes]:
+    """把缓存的 chat.completion 按 chat.completion.chunk 重放：每个 choice 一个内容块和一个结束块"""
+    base = {k: v for k, v in result.items() if k not in ("choices", "usage", "object")}
+    base["object"] = "chat.completion.chunk"
+    for choice in result.get("choices") or []:
+        index = choice.get("index", 0)
+        delta = dict(choice.get("message") or {})
+        yield _sse({**base, "choices": [{"index": index, "delta": delta, "finish_reason": None}]})
+        yield _sse({**base, "choices": [{"index": index, "delta": {}, "finish_reason": choice.get("finish_reason")}]})
+    if include_usage and result.get("usage"):
+        yield _sse({**base, "choices": [], "usage": result["usage"]})
+    yield b"data: [DONE]\n\n"
+
+
+class ResponseCache:
+    """进程内 LRU 响应缓存，容量按 JSON 编码后的字节数计"""
+
+    def __init__(self):
+        # key -> (过期时间, JSON 编码的响应, 字节数)
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        from config import get_response_cache_enabled
+        return get_response_cache_enabled() and self.max_bytes > 0
+
+    @property
+    def max_bytes(self) -> int:
+        from config import get_response_cache_mb
+        return int(get_response_cache_mb() * 1024 * 1024)
+
+    @property
+    def ttl(self) -> float:
+        from config import get_response_cache_ttl
+        return get_response_cache_ttl()
+
+    def should_cache(self, request_body: Dict[str, Any], mode: Optional[str]) -> bool:
+        """该请求是否读写缓存"""
+        if not self.enabled:
+            return False
+        if mode == BYPASS:
+            self.bypassed += 1
+            return False
+        if mode == FORCE:
+            return True
+        temperature = request_body.get("temperature")
+        return isinstance(temperature, (int, float)) and not isinstance(temperature, bool) and temperature == 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """命中时返回缓存响应的新副本（调用方可以直接修改）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, data, size = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.bytes -= size
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        result = json.loads(data)
+        result["created"] = int(time.time())
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        max_bytes = self.max_bytes
+        data = json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        size = len(data.encode("utf-8"))
+        if size > max_bytes * MAX_ENTRY_FRACTION:
+            logger.debug(f"响应过大 ({size} 字节)，不写入响应缓存")
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        self._entries[key] = (time.monotonic() + self.ttl, data, size)
+        self.bytes += size
+        self.stores += 1
+        while self.bytes > max_bytes and self._entries:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "bypassed": self.bypassed,
+            "expired": self.expired,
+            "evictions": self.evictions
+        }
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
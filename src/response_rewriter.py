@@ -0,0 +1,122 @@
+"""
+Response Rewriter - 对上游响应内容做反向关键词替换
+
+请求中的关键词被替换后（Claude -> CodeBuddy 等），上游回复里会出现替换后的名字。
+开启 CODEBUDDY_RESPONSE_REWRITE_ENABLED 后：
+
+- 流式响应：SSEContentRewriter 解码 SSE 事件，对每个 choice 的 delta.content 使用各自的
+  StreamRewriter，只暂存可能跨分块的关键词开头部分，其余内容随当前事件立即发出；
+  不含 "content" 的事件不做 JSON 解析，直接按原数据重新编码。
+- 非流式响应：对合并后的 message.content 整段替换。
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from .keyword_rewriter import CompiledRules, StreamRewriter
+from .sse_parser import SSEDecoder, SSEEvent
+
+_CONTENT_MARKER = '"content"'
+
+
+def _encode_event(data: str, event: Optional[SSEEvent] = None) -> bytes:
+    lines = []
+    if event is not None and event.event:
+        lines.append(f"event: {event.event}")
+    if event is not None and event.id:
+        lines.append(f"id: {event.id}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def _dumps(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+class SSEContentRewriter:
+    """对 OpenAI 格式 SSE 字节流中的 delta.content 做流式替换，输入输出均为字节"""
+
+    def __init__(self, compiled: CompiledRules):
+        self.compiled = compiled
+        self._decoder = SSEDecoder()
+        # choice index -> 该 choice 的流式替换状态
+        self._rewriters: Dict[int, StreamRewriter] = {}
+        # 补发暂存内容时使用的块公共字段（id、model 等）
+        self._base: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        if not chunk:
+            return b""
+        return b"".join(self._process(event) for event in self._decoder.feed(chunk))
+
+    def flush(self) -> bytes:
+        """上游流结束时调用：输出解码器中剩余的事件和所有暂存的内容"""
+        parts = [self._process(event) for event in self._decoder.flush()]
+        parts.append(self._drain())
+        return b"".join(parts)
+
+    def _process(self, event: SSEEvent) -> bytes:
+        if event.is_done:
+            # [DONE] 之前补发仍暂存的内容
+            return self._drain() + _encode_event(event.data, event)
+        if _CONTENT_MARKER not in event.data:
+            return _encode_event(event.data, event)
+        payloads = event.json_payloads()
+        if not payloads:
+            return _encode_event(event.data, event)
+        changed = False
+        for payload in payloads:
+            changed = self._rewrite_payload(payload) or changed
+        if not changed:
+            return _encode_event(event.data, event)
+        return b"".join(_encode_event(_dumps(payload), event) for payload in payloads)
+
+    def _rewrite_payload(self, payload: Any) -> bool:
+        if not isinstance(payload, dict) or not isinstance(payload.get("choices"), list):
+            return False
+        if self._base is None:
+            self._base = {k: v for k, v in payload.items() if k not in ("choices", "usage")}
+        changed = False
+        for choice in payload["choices"]:
+            if not isinstance(choice, dict):
+                continue
+            index = choice.get("index", 0)
+            delta = choice.get("delta")
+            content = delta.get("content") if isinstance(delta, dict) else None
+            if isinstance(content, str) and content:
+                rewriter = self._rewriters.get(index)
+                if rewriter is None:
+                    rewriter = self._rewriters[index] = StreamRewriter(self.compiled)
+                rewritten = rewriter.feed(content)
+                if rewritten != content:
+                    delta["content"] = rewritten
+                    changed = True
+            if choice.get("finish_reason") and index in self._rewriters:
+                # 该 choice 结束，暂存的末尾随结束块一起发出
+                tail = self._rewriters.pop(index).flush()
+                if tail:
+                    if not isinstance(delta, dict):
+                        delta = choice["delta"] = {}
+                    delta["content"] = (delta.get("content") or "") + tail
+                    changed = True
+        return changed
+
+    def _drain(self) -> bytes:
+        """把仍暂存的内容作为额外的增量块发出（上游没有发送 finish_reason 时）"""
+        parts: List[bytes] = []
+        for index, rewriter in sorted(self._rewriters.items()):
+            tail = rewriter.flush()
+            if tail:
+                payload = dict(self._base or {})
+                payload["choices"] = [{"index": index, "delta": {"content": tail}, "finish_reason": None}]
+                parts.append(_encode_event(_dumps(payload)))
+        self._rewriters.clear()
+        return b"".join(parts)
+
+
+def rewrite_completion(result: Dict[str, Any], compiled: CompiledRules) -> Dict[str, Any]:
+    """原地替换非流式结果中各 choice 的 message.content"""
+    for choice in result.get("choices") or []:
+        message = choice.get("message") if isinstance(choice, dict) else None
+        if isinstance(message, dict) and isinstance(message.get("content"), str):
+            message["content"] = compiled.rewrite(message["content"])
+    return result
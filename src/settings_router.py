@@ -1,15 +1,23 @@
 """
 Settings Router - For loading and saving .env configurations
 """
+import asyncio
 import os
 import logging
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from typing import Dict, Any
 
 from .auth import authenticate
-from config import get_active_config, update_settings
+from config import get_active_config, update_settings, save_config_to_json
 from .usage_stats_manager import usage_stats_manager
+from .hedging import hedge_policy
+from .rate_limiter import credential_rate_limiter
+from .admission import admission_controller
+from .shared_state import shared_state
+from .stats_store import stats_store
+from .transform_cache import transform_cache
+from .response_cache import response_cache
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -23,7 +31,51 @@ SETTING_LABELS = {
     "CODEBUDDY_CREDS_DIR": "凭证文件目录",
     "CODEBUDDY_LOG_LEVEL": "日志级别",
     "CODEBUDDY_MODELS": "可用模型列表 (逗号分隔)",
-    "CODEBUDDY_ROTATION_COUNT": "凭证轮换频率 (N次请求/凭证，设为0关闭轮换)"
+    "CODEBUDDY_ROTATION_COUNT": "凭证轮换频率 (N次请求/凭证，设为0关闭轮换)",
+    "CODEBUDDY_SELECTION_STRATEGY": "凭证选择策略 (round_robin / least_in_flight / ewma_latency)",
+    "CODEBUDDY_HTTP2": "上游启用HTTP/2 (需安装h2，重启生效)",
+    "CODEBUDDY_POOL_MAX_CONNECTIONS": "上游连接池最大连接数 (重启生效)",
+    "CODEBUDDY_POOL_MAX_KEEPALIVE": "上游连接池最大保活连接数 (重启生效)",
+    "CODEBUDDY_POOL_KEEPALIVE_EXPIRY": "上游空闲连接保活时间 (秒，重启生效)",
+    "CODEBUDDY_WARMUP_CONNECTIONS": "启动时预热的上游连接数 (0为关闭，重启生效)",
+    "CODEBUDDY_WARMUP_INTERVAL": "重新预热间隔 (秒，0为自动取保活时间的80%，重启生效)",
+    "CODEBUDDY_HEDGE_ENABLED": "首字节过慢时在另一凭证上发起对冲请求",
+    "CODEBUDDY_HEDGE_DELAY": "对冲触发阈值 (秒，0为使用学习到的首字节延迟p95)",
+    "CODEBUDDY_HEDGE_MAX_PER_MINUTE": "每分钟最多对冲请求数",
+    "CODEBUDDY_RETRY_ATTEMPTS": "上游请求最大尝试次数 (含首次，失败时换用下一个凭证)",
+    "CODEBUDDY_RETRY_BACKOFF": "重试退避基础时间 (秒，指数增长)",
+    "CODEBUDDY_RETRY_STATUS_CODES": "可重试的上游状态码 (逗号分隔)",
+    "CODEBUDDY_BREAKER_FAILURE_THRESHOLD": "熔断阈值：凭证连续失败次数",
+    "CODEBUDDY_BREAKER_ERROR_RATE": "熔断阈值：滑动窗口内错误率 (0-1)",
+    "CODEBUDDY_BREAKER_WINDOW": "熔断错误率统计窗口 (最近N次请求)",
+    "CODEBUDDY_BREAKER_COOLDOWN": "熔断冷却时间 (秒，之后放行一个试探请求)",
+    "CODEBUDDY_RATE_LIMIT_ENABLED": "启用每凭证自适应限速 (收到429后开始，根据429自动调整)",
+    "CODEBUDDY_RATE_LIMIT_BURST": "每凭证突发请求数 (新凭证生效)",
+    "CODEBUDDY_RATE_LIMIT_MIN": "每凭证最低速率 (请求/秒，新凭证生效)",
+    "CODEBUDDY_RATE_LIMIT_MAX": "每凭证最高速率 (请求/秒，新凭证生效)",
+    "CODEBUDDY_RATE_LIMIT_MAX_WAIT": "令牌耗尽时最多等待秒数 (超过则换用其他凭证)",
+    "CODEBUDDY_MAX_IN_FLIGHT": "最大并发聊天请求数 (0为不限制)",
+    "CODEBUDDY_MAX_QUEUE": "并发已满时的最大排队请求数",
+    "CODEBUDDY_QUEUE_TIMEOUT": "最长排队时间 (秒，超时返回503)",
+    "CODEBUDDY_CREDS_WATCH_INTERVAL": "凭证目录变化扫描间隔 (秒，0为关闭，重启生效)",
+    "CODEBUDDY_CREDS_BACKEND": "凭证存储后端 (directory / sqlite，重启生效)",
+    "CODEBUDDY_CREDS_DB": "SQLite 凭证库路径 (留空为凭证目录下的 credentials.db，重启生效)",
+    "CODEBUDDY_WORKERS": "Worker 进程数 (大于1时通过共享状态库共享轮换与统计，重启生效)",
+    "CODEBUDDY_SHARED_STATE_DB": "多 worker 共享状态库路径 (留空为凭证目录下的 shared_state.db，重启生效)",
+    "CODEBUDDY_STATS_RETENTION_MINUTES": "按分钟统计序列保留时长 (分钟，重启生效)",
+    "CODEBUDDY_STATS_MAX_KEYS": "统计中模型/凭证 key 数量上限 (超出计入 __other__，重启生效)",
+    "CODEBUDDY_STATS_PERSIST_ENABLED": "持久化使用统计 (重启后恢复，重启生效)",
+    "CODEBUDDY_STATS_DB": "统计库路径 (留空为凭证目录下的 stats.db，重启生效)",
+    "CODEBUDDY_STATS_FLUSH_INTERVAL": "统计快照写入间隔 (秒)",
+    "CODEBUDDY_STATS_HOURLY_RETENTION_DAYS": "按小时统计汇总保留天数",
+    "CODEBUDDY_STATS_DAILY_RETENTION_DAYS": "按天统计汇总保留天数",
+    "CODEBUDDY_KEYWORD_REPLACEMENTS": "关键词替换规则 (JSON 对象 {\"原文\": \"替换\"}，留空为不替换)",
+    "CODEBUDDY_RESPONSE_REWRITE_ENABLED": "响应内容反向关键词替换",
+    "CODEBUDDY_RESPONSE_REPLACEMENTS": "响应内容替换规则 (JSON 对象，留空为请求规则的反向规则)",
+    "CODEBUDDY_TRANSFORM_CACHE_MB": "请求变换缓存容量 (MB，0 为关闭)",
+    "CODEBUDDY_RESPONSE_CACHE_ENABLED": "缓存确定性请求的响应 (temperature=0)",
+    "CODEBUDDY_RESPONSE_CACHE_MB": "响应缓存容量 (MB)",
+    "CODEBUDDY_RESPONSE_CACHE_TTL": "响应缓存有效期 (秒)"
 }
 
 class Settings(BaseModel):
@@ -45,17 +97,47 @@ async def get_settings(_token: str = Depends(authenticate)):
 async def save_settings(new_settings: Settings, _token: str = Depends(authenticate)):
     """Saves settings to config.json and hot-reloads them into memory."""
     try:
-        update_settings(new_settings.settings)
+        update_settings(new_settings.settings, persist=False)
+        # 在线程中原子写入 config.json，不阻塞事件循环
+        await asyncio.to_thread(save_config_to_json)
         return {"message": "设置已保存并成功热加载！"}
     except Exception as e:
         logger.error(f"Error saving settings: {e}")
         raise HTTPException(status_code=500, detail="无法保存设置文件。")
 
 @router.get("/stats", summary="Get usage statistics")
-async def get_usage_stats(_token: str = Depends(authenticate)):
+async def get_usage_stats(
+    window: int = Query(60, ge=1, description="统计窗口（分钟），不超过保留时长"),
+    granularity: int = Query(1, ge=1, description="序列粒度（分钟）"),
+    _token: str = Depends(authenticate)
+):
     """Returns usage statistics for models and credentials."""
     try:
-        return usage_stats_manager.get_stats()
+        stats = usage_stats_manager.get_stats()
+        stats["series"] = usage_stats_manager.get_series(window, granularity)
+        stats["hedging"] = hedge_policy.get_stats()
+        stats["rate_limits"] = credential_rate_limiter.get_stats()
+        stats["admission"] = admission_controller.get_stats()
+        stats["workers"] = shared_state.get_stats()
+        stats["persistence"] = stats_store.get_stats()
+        stats["transform_cache"] = transform_cache.get_stats()
+        stats["response_cache"] = response_cache.get_stats()
+        return stats
     except Exception as e:
         logger.error(f"Error retrieving usage stats: {e}")
         raise HTTPException(status_code=500, detail="Could not retrieve usage statistics.")
+
+@router.get("/stats/history", summary="Get hourly or daily usage history")
+async def get_usage_history(
+    granularity: str = Query("hour", pattern="^(hour|day)$", description="汇总粒度：hour 或 day"),
+    days: int = Query(7, ge=1, le=3660, description="查询最近多少天"),
+    _token: str = Depends(authenticate)
+):
+    """Returns persisted per-model and per-credential usage rolled up by hour or day."""
+    if not stats_store.enabled:
+        raise HTTPException(status_code=404, detail="Usage statistics persistence is disabled.")
+    try:
+        return await asyncio.to_thread(stats_store.history, granularity, days)
+    except Exception as e:
+        logger.error(f"Error retrieving usage history: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve usage history.")
@@ -0,0 +1,379 @@
+"""
+Shared State - 多 worker 部署时在进程间共享的轮换、负载与统计状态
+
+CODEBUDDY_WORKERS > 1 时，每个 hypercorn worker 都有自己的 CodeBuddyTokenManager 和 UsageStatsManager。
+为保持轮换公平和统计完整，以下状态保存在本机共享的 SQLite（WAL 模式）数据库中：
+
+- 轮换游标（当前凭证文件名 + 已使用次数）与手动选择：每个 worker 在内存中推进自己的游标，
+  由心跳与共享游标合并（累加使用次数，或采用先推进的 worker 的位置），选择凭证时不访问数据库
+- 每个 worker 每个凭证的在途请求数：本进程的计数只在内存中增减，由心跳批量发布并读回其他 worker 的计数，
+  负载策略按 本进程实时计数 + 其他 worker 最近一次发布的计数 选择
+- 每个 worker 的使用统计累计值和按分钟统计序列，由心跳循环定期发布，查询时合并所有 worker
+- 心跳与 leader：只有 leader worker 写入统计快照（stats_store），避免多个 worker 重复写入
+
+写入都在心跳线程中进行；请求路径上的查询使用单独的只读连接，不会等待心跳事务持有的锁。
+单 worker（默认）时不启用，所有状态仍只保存在进程内存中。
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 心跳间隔（秒）；超过 HEARTBEAT_TTL 未更新心跳的 worker 视为已退出
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TTL = 10.0
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id TEXT PRIMARY KEY,
+        pid INTEGER NOT NULL,
+        heartbeat REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rotation (
+        name TEXT PRIMARY KEY,
+        credential_key TEXT,
+        usage_count INTEGER NOT NULL DEFAULT 0,
+        manual_key TEXT
+    );
+    CREATE TABLE IF NOT EXISTS in_flight (
+        worker_id TEXT NOT NULL,
+        credential_key TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (worker_id, credential_key)
+    );
+    CREATE TABLE IF NOT EXISTS usage_counters (
+        worker_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (worker_id, kind, name)
+    );
+    CREATE TABLE IF NOT EXISTS usage_series (
+        worker_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS leader (
+        name TEXT PRIMARY KEY,
+        worker_id TEXT NOT NULL,
+        heartbeat REAL NOT NULL
+    );
+"""
+
+
+class RotationCursor:
+    """共享库中的轮换游标"""
+
+    __slots__ = ("credential_key", "usage_count", "manual_key")
+
+    def __init__(self, credential_key: Optional[str], usage_count: int, manual_key: Optional[str]):
+        self.credential_key = credential_key
+        self.usage_count = usage_count
+        self.manual_key = manual_key
+
+
+class RotationSnapshot:
+    """心跳时本 worker 的轮换位置：moved 表示上次同步后切换过凭证，uses 为当前凭证上新增的使用次数"""
+
+    __slots__ = ("credential_key", "usage_count", "uses", "moved")
+
+    def __init__(self, credential_key: Optional[str], usage_count: int, uses: int, moved: bool):
+        self.credential_key = credential_key
+        self.usage_count = usage_count
+        self.uses = uses
+        self.moved = moved
+
+
+class SharedState:
+    """进程间共享状态；enabled 为 False 时所有调用方都应走进程内逻辑"""
+
+    def __init__(self):
+        from config import get_workers
+        self.enabled = get_workers() > 1
+        self.worker_id = f"{os.getpid()}-{int(time.time() * 1000)}"
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 请求路径上查询使用的只读连接，WAL 模式下读取不等待写事务
+        self._read_lock = threading.Lock()
+        self._read_conn: Optional[sqlite3.Connection] = None
+        # 尚未写入共享库的手动选择，(文件名或 None,)
+        self._pending_manual: Optional[tuple] = None
+        # 上一次心跳同步后的共享游标凭证，用于判断是否有其他 worker 先推进了游标
+        self._rotation_base: Optional[str] = None
+        # 本进程每个凭证的在途请求数，以及心跳读回的其他 worker 的在途数之和
+        self._local_in_flight: Dict[str, int] = {}
+        self._remote_in_flight: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._is_leader = not self.enabled
+
+    @property
+    def db_path(self) -> str:
+        from config import get_shared_state_db_path, get_codebuddy_creds_dir
+        path = get_shared_state_db_path() or os.path.join(get_codebuddy_creds_dir(), 'shared_state.db')
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(__file__), '..', path)
+        return path
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _read_connect(self) -> sqlite3.Connection:
+        if self._read_conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=1.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA query_only=ON")
+            self._read_conn = conn
+        return self._read_conn
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        """在只读连接上查询，不占用心跳写事务使用的 self._lock"""
+        with self._read_lock:
+            return self._read_connect().execute(sql, params).fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    # --- 生命周期 ---
+
+    def reset(self):
+        """服务（主进程）启动时清空上一次运行的 worker、在途请求与统计，保留轮换游标"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM workers")
+            conn.execute("DELETE FROM in_flight")
+            conn.execute("DELETE FROM usage_counters")
+            conn.execute("DELETE FROM usage_series")
+            conn.execute("DELETE FROM leader")
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        # 启动时（尚未处理请求）同步一次，新 worker 从共享游标的位置开始轮换
+        from .codebuddy_token_manager import codebuddy_token_manager
+        cursor = self._heartbeat(codebuddy_token_manager.rotation_snapshot())
+        codebuddy_token_manager.apply_shared_rotation(cursor)
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Shared state enabled for worker {self.worker_id} ({self.db_path})")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self.publish_usage_stats)
+        await asyncio.to_thread(self._leave)
+        self._is_leader = False
+
+    def _leave(self):
+        with self._transaction() as conn:
+            # 退出时移除心跳与在途数，保留统计累计值
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+            conn.execute("DELETE FROM in_flight WHERE worker_id = ?", (self.worker_id,))
+            conn.execute("DELETE FROM leader WHERE worker_id = ?", (self.worker_id,))
+        for conn in (self._conn, self._read_conn):
+            if conn is not None:
+                conn.close()
+        self._conn = self._read_conn = None
+
+    async def _loop(self):
+        from .codebuddy_token_manager import codebuddy_token_manager
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                # 快照与合并结果的应用在事件循环中进行，数据库事务在线程中执行
+                snapshot = codebuddy_token_manager.rotation_snapshot()
+                cursor = await asyncio.to_thread(self._heartbeat, snapshot)
+                codebuddy_token_manager.apply_shared_rotation(cursor)
+                await asyncio.to_thread(self.publish_usage_stats)
+            except Exception as e:
+                logger.error(f"Shared state heartbeat failed: {e}")
+
+    def _heartbeat(self, snapshot: Optional[RotationSnapshot] = None) -> RotationCursor:
+        """心跳事务：更新存活状态、发布在途数、合并轮换游标并竞选 leader，返回合并后的共享游标"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO workers (worker_id, pid, heartbeat) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.worker_id, os.getpid(), now)
+            )
+            # 清理已退出 worker 的在途数（其统计累计值保留）
+            conn.execute(
+                "DELETE FROM in_flight WHERE worker_id IN (SELECT worker_id FROM workers WHERE heartbeat < ?)",
+                (now - HEARTBEAT_TTL,)
+            )
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - HEARTBEAT_TTL,))
+            self._publish_in_flight(conn)
+            cursor = self._sync_rotation(conn, snapshot)
+            # leader 心跳过期时由当前 worker 接替
+            conn.execute(
+                "INSERT INTO leader (name, worker_id, heartbeat) VALUES ('leader', ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET worker_id = excluded.worker_id, heartbeat = excluded.heartbeat "
+                "WHERE leader.worker_id = excluded.worker_id OR leader.heartbeat < ?",
+                (self.worker_id, now, now - HEARTBEAT_TTL)
+            )
+            row = conn.execute("SELECT worker_id FROM leader WHERE name = 'leader'").fetchone()
+        was_leader = self._is_leader
+        self._is_leader = row is not None and row[0] == self.worker_id
+        if self._is_leader and not was_leader:
+            logger.info(f"Worker {self.worker_id} is now the leader")
+        return cursor
+
+    @property
+    def is_leader(self) -> bool:
+        """单 worker 时恒为 True"""
+        return self._is_leader
+
+    # --- 轮换游标 ---
+
+    def _sync_rotation(self, conn: sqlite3.Connection, snapshot: Optional[RotationSnapshot]) -> RotationCursor:
+        """
+        把本 worker 自上次心跳以来的轮换合并进共享游标：
+        - 共享游标仍停在上次同步的位置而本 worker 已切换凭证时，写入本 worker 的位置
+        - 双方仍在同一个凭证上时，累加本 worker 新增的使用次数
+        - 其他 worker 已先推进时采用共享游标，本 worker 在旧凭证上的使用次数不再计入
+        """
+        row = conn.execute(
+            "SELECT credential_key, usage_count, manual_key FROM rotation WHERE name = 'default'"
+        ).fetchone()
+        cursor = RotationCursor(*row) if row else RotationCursor(None, 0, None)
+        if snapshot is not None and snapshot.credential_key is not None:
+            if cursor.credential_key is None or (snapshot.moved and cursor.credential_key == self._rotation_base):
+                cursor.credential_key = snapshot.credential_key
+                cursor.usage_count = snapshot.usage_count
+            elif cursor.credential_key == snapshot.credential_key:
+                cursor.usage_count += snapshot.uses
+        pending = self._pending_manual
+        if pending is not None:
+            cursor.manual_key = pending[0]
+        conn.execute(
+            "INSERT INTO rotation (name, credential_key, usage_count, manual_key) VALUES ('default', ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET credential_key = excluded.credential_key, "
+            "usage_count = excluded.usage_count, manual_key = excluded.manual_key",
+            (cursor.credential_key, cursor.usage_count, cursor.manual_key)
+        )
+        self._rotation_base = cursor.credential_key
+        if self._pending_manual is pending:
+            self._pending_manual = None
+        return cursor
+
+    @property
+    def has_pending_manual(self) -> bool:
+        """本进程是否有尚未写入共享库的手动选择（此时不应被共享游标中的旧值覆盖）"""
+        return self._pending_manual is not None
+
+    def set_manual_key(self, manual_key: Optional[str]):
+        """记录手动选择（不访问数据库），随下一次心跳写入共享库"""
+        self._pending_manual = (manual_key,)
+
+    # --- 在途请求 ---
+
+    def add_in_flight(self, credential_key: str, delta: int):
+        """只修改内存中的计数，由心跳批量写入共享库"""
+        self._local_in_flight[credential_key] = max(0, self._local_in_flight.get(credential_key, 0) + delta)
+
+    def _publish_in_flight(self, conn: sqlite3.Connection):
+        """在心跳事务中写入本进程的在途数（绝对值），并读回其他存活 worker 的在途数"""
+        # dict() 在持有 GIL 时一次复制完成，不会与事件循环中的增减交错
+        local = dict(self._local_in_flight)
+        conn.execute("DELETE FROM in_flight WHERE worker_id = ?", (self.worker_id,))
+        conn.executemany(
+            "INSERT INTO in_flight (worker_id, credential_key, count) VALUES (?, ?, ?)",
+            [(self.worker_id, key, count) for key, count in local.items() if count > 0]
+        )
+        rows = conn.execute(
+            "SELECT credential_key, SUM(count) FROM in_flight WHERE worker_id != ? GROUP BY credential_key",
+            (self.worker_id,)
+        ).fetchall()
+        self._remote_in_flight = {key: int(total) for key, total in rows}
+
+    def in_flight_totals(self) -> Dict[str, int]:
+        """本进程的实时在途数 + 其他 worker 最近一次心跳发布的在途数（不访问数据库）"""
+        totals = dict(self._remote_in_flight)
+        for key, count in self._local_in_flight.items():
+            if count:
+                totals[key] = totals.get(key, 0) + count
+        return totals
+
+    # --- 使用统计 ---
+
+    def publish_usage_stats(self):
+        """把本 worker 的统计累计值写入共享库（幂等，写入的是绝对值）"""
+        from .usage_stats_manager import usage_stats_manager, stats_to_rows
+        rows = stats_to_rows(usage_stats_manager.get_local_stats())
+        series = json.dumps(usage_stats_manager.export_series(), separators=(",", ":"))
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO usage_counters (worker_id, kind, name, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(worker_id, kind, name) DO UPDATE SET count = excluded.count",
+                [(self.worker_id, kind, name, count) for kind, name, count in rows]
+            )
+            conn.execute(
+                "INSERT INTO usage_series (worker_id, data) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET data = excluded.data",
+                (self.worker_id, series)
+            )
+
+    def other_usage_series(self) -> list:
+        """其他 worker（含已退出的）最近一次发布的按分钟统计序列"""
+        rows = self._query("SELECT data FROM usage_series WHERE worker_id != ?", (self.worker_id,))
+        result = []
+        for (data,) in rows:
+            try:
+                result.append(json.loads(data))
+            except ValueError:
+                continue
+        return result
+
+    def merge_usage_stats(self, local: Dict[str, Any]) -> Dict[str, Any]:
+        """本 worker 的实时统计 + 其他 worker 已发布的统计"""
+        from .usage_stats_manager import add_stats_rows
+        rows = self._query(
+            "SELECT kind, name, SUM(count) FROM usage_counters WHERE worker_id != ? GROUP BY kind, name",
+            (self.worker_id,)
+        )
+        # local 是本进程刚取得的副本，可以直接在其上累加
+        return add_stats_rows(local, rows)
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        workers = self._query("SELECT worker_id, pid, heartbeat FROM workers ORDER BY worker_id")
+        return {
+            "enabled": True,
+            "worker_id": self.worker_id,
+            "is_leader": self._is_leader,
+            "workers": [
+                {"worker_id": worker_id, "pid": pid, "heartbeat_age": round(time.time() - heartbeat, 1)}
+                for worker_id, pid, heartbeat in workers
+            ]
+        }
+
+
+# 全局共享状态实例
+shared_state = SharedState()
@@ -0,0 +1,179 @@
+"""
+SSE Parser - 增量式、分块边界安全的 Server-Sent Events 解码器
+
+上游的 aiter_bytes() 分块与 SSE 事件边界无关，一个 `data:` 行可能被拆到两个分块中。
+SSEDecoder 在内部缓冲不完整的行，只在收到完整事件（空行结束）后才输出，
+供 codebuddy_router 和 CodeBuddyAPIClient 共用。
+"""
+import json
+import logging
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DONE_MARKER = "[DONE]"
+DEFAULT_MAX_BUFFER_SIZE = 8 * 1024 * 1024  # 单个未完成事件最多缓冲 8MB
+
+
+class SSEBufferOverflowError(ValueError):
+    """单个事件超过缓冲上限（通常意味着上游不是 SSE 格式）"""
+
+
+class SSEEvent:
+    """一个完整的 SSE 事件"""
+
+    __slots__ = ("data", "event", "id", "is_done")
+
+    def __init__(self, data: str, event: Optional[str] = None, id: Optional[str] = None):
+        self.data = data
+        self.event = event
+        self.id = id
+        self.is_done = data.strip() == DONE_MARKER
+
+    def json_payloads(self) -> List[Any]:
+        """
+        将 data 解析为 JSON。标准格式下一个事件就是一个 JSON 对象；
+        若上游在一个事件里用多行 `data:` 各放一个对象，则逐行解析。
+        无法解析的内容会被记录并跳过。
+        """
+        try:
+            return [json.loads(self.data)]
+        except json.JSONDecodeError as e:
+            if "\n" not in self.data:
+                logger.warning(f"[SSE] JSON decode error, skipping event: {e}, data: {self.data[:200]}")
+                return []
+
+        payloads = []
+        for line in self.data.split("\n"):
+            if not line.strip() or line.strip() == DONE_MARKER:
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                logger.warning(f"[SSE] JSON decode error, skipping line: {e}, data: {line[:200]}")
+        return payloads
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data[:60]!r})"
+
+
+class SSEDecoder:
+    """
+    增量 SSE 解码器。
+
+    用法:
+        decoder = SSEDecoder()
+        async for chunk in response.aiter_bytes():
+            for event in decoder.feed(chunk):
+                ...
+        for event in decoder.flush():
+            ...
+
+    每个字节只被扫描常数次，总开销与流长度成线性关系。
+    """
+
+    def __init__(self, max_buffer_size: int = DEFAULT_MAX_BUFFER_SIZE):
+        self.max_buffer_size = max_buffer_size
+        self.done = False
+        # 尚未遇到换行符的残余字节：按分块收集，遇到换行符时一次 join，
+        # 避免一个很长的行分成许多小块到达时每次都复制整个前缀（二次方开销）
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._data_lines: List[str] = []
+        self._data_size = 0
+        self._event_type: Optional[str] = None
+        self._event_id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一个字节分块，返回其中已完整的事件"""
+        if not chunk:
+            return []
+
+        last_newline = chunk.rfind(b"\n")
+        if last_newline == -1:
+            # 没有换行符：整个分块都属于未完成的行
+            self._pending.append(chunk)
+            self._pending_size += len(chunk)
+            self._check_size(self._pending_size)
+            return []
+
+        if self._pending:
+            self._pending.append(chunk[:last_newline])
+            complete = b"".join(self._pending)
+        else:
+            complete = chunk[:last_newline]
+        rest = chunk[last_newline + 1:]
+        self._pending = [rest] if rest else []
+        self._pending_size = len(rest)
+        self._check_size(self._pending_size)
+
+        events: List[SSEEvent] = []
+        for raw_line in complete.split(b"\n"):
+            # 快速路径：绝大多数行是 "data: ..." 或事件之间的空行
+            if raw_line.startswith(b"data: ") and not raw_line.endswith(b"\r"):
+                value = raw_line[6:].decode("utf-8", errors="replace")
+                self._data_lines.append(value)
+                self._data_size += len(value)
+            elif not raw_line:
+                self._dispatch(events)
+            else:
+                self._process_line(raw_line, events)
+        if self._data_size:
+            self._check_size(self._pending_size)
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束时调用，输出缓冲中剩余的最后一个事件（若上游未以空行结尾）"""
+        events: List[SSEEvent] = []
+        if self._pending:
+            self._process_line(b"".join(self._pending), events)
+            self._pending = []
+            self._pending_size = 0
+        self._dispatch(events)
+        return events
+
+    def _check_size(self, pending: int):
+        if pending + self._data_size > self.max_buffer_size:
+            raise SSEBufferOverflowError(
+                f"SSE event exceeds buffer limit of {self.max_buffer_size} bytes"
+            )
+
+    def _process_line(self, raw_line: bytes, events: List[SSEEvent]):
+        if raw_line.endswith(b"\r"):
+            raw_line = raw_line[:-1]
+
+        if not raw_line:
+            self._dispatch(events)
+            return
+
+        if raw_line[0:1] == b":":
+            # 注释/心跳行
+            return
+
+        line = raw_line.decode("utf-8", errors="replace")
+        field, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+
+        if field == "data":
+            self._data_lines.append(value)
+            self._data_size += len(value)
+        elif field == "event":
+            self._event_type = value
+        elif field == "id":
+            self._event_id = value
+        # 其他字段（retry 等）对代理无意义，忽略
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if not self._data_lines:
+            self._event_type = None
+            return
+
+        event = SSEEvent("\n".join(self._data_lines), self._event_type, self._event_id)
+        self._data_lines = []
+        self._data_size = 0
+        self._event_type = None
+
+        if event.is_done:
+            self.done = True
+        events.append(event)
@@ -0,0 +1,271 @@
+"""
+Stats Series - 按分钟分桶的时间序列统计
+
+每个模型 / 凭证对应一个 MinuteSeries：长度为保留分钟数的环形缓冲区，每个槽位是一分钟的
+请求数、错误数、流式字节数、token 用量以及首字节延迟（TTFB）与总耗时的直方图。
+直方图使用固定的对数分桶边界，任意分钟、任意 worker 的直方图都可以逐桶相加合并，
+再从合并结果估算 p50/p95/p99。
+
+SeriesGroup 限制不同 key 的数量，超过上限的新 key 计入 OVERFLOW_KEY，内存不随客户端传入的
+model 字符串无限增长。
+"""
+import bisect
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+OVERFLOW_KEY = "__other__"
+
+# 直方图上界（秒）：5ms 起按 1.5 倍增长到约 10 分钟，最后一个桶收集更大的值
+HISTOGRAM_BOUNDS = []
+_bound = 0.005
+while _bound < 600:
+    HISTOGRAM_BOUNDS.append(round(_bound, 4))
+    _bound *= 1.5
+del _bound
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，可合并"""
+
+    __slots__ = ("counts", "count", "total", "maximum")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def merge(self, other: "LatencyHistogram"):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """在目标分桶内线性插值估算分位数"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = HISTOGRAM_BOUNDS[i - 1] if i > 0 else 0.0
+                upper = HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else self.maximum
+                # 插值结果不超过观测到的最大值
+                upper = min(upper, self.maximum)
+                return round(lower + max(0.0, upper - lower) * (rank - cumulative) / n, 4)
+            cumulative += n
+        return round(self.maximum, 4)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.maximum, 4) if self.count else None
+        }
+
+
+class MinuteBucket:
+    """一分钟内的统计"""
+
+    __slots__ = ("minute", "requests", "errors", "streamed_bytes", "prompt_tokens", "completion_tokens",
+                 "ttfb", "duration")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.requests = 0
+        self.errors = 0
+        self.streamed_bytes = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.ttfb = LatencyHistogram()
+        self.duration = LatencyHistogram()
+
+    def merge(self, other: "MinuteBucket"):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.streamed_bytes += other.streamed_bytes
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.ttfb.merge(other.ttfb)
+        self.duration.merge(other.duration)
+
+    def export(self) -> list:
+        """紧凑的可序列化形式，用于多 worker 之间合并"""
+        return [
+            self.minute, self.requests, self.errors, self.streamed_bytes,
+            self.ttfb.counts, self.ttfb.total, self.ttfb.maximum,
+            self.duration.counts, self.duration.total, self.duration.maximum,
+            self.prompt_tokens, self.completion_tokens
+        ]
+
+    @classmethod
+    def from_export(cls, data: list) -> "MinuteBucket":
+        bucket = cls(data[0])
+        bucket.requests, bucket.errors, bucket.streamed_bytes = data[1], data[2], data[3]
+        for histogram, (counts, total, maximum) in ((bucket.ttfb, data[4:7]), (bucket.duration, data[7:10])):
+            if len(counts) == len(histogram.counts):
+                histogram.counts = list(counts)
+                histogram.count = sum(counts)
+                histogram.total = total
+                histogram.maximum = maximum
+        if len(data) >= 12:
+            bucket.prompt_tokens, bucket.completion_tokens = data[10], data[11]
+        return bucket
+
+    def to_dict(self, include_latency: bool = True) -> Dict[str, Any]:
+        result = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "streamed_bytes": self.streamed_bytes,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens
+        }
+        if include_latency:
+            result["ttfb"] = self.ttfb.summary()
+            result["duration"] = self.duration.summary()
+        return result
+
+
+class MinuteSeries:
+    """按分钟的环形缓冲区，槽位在该分钟首次有数据时才分配"""
+
+    __slots__ = ("retention", "slots", "last_minute")
+
+    def __init__(self, retention_minutes: int):
+        self.retention = retention_minutes
+        self.slots: List[Optional[MinuteBucket]] = [None] * retention_minutes
+        self.last_minute = 0
+
+    def _bucket(self, minute: int) -> MinuteBucket:
+        pos = minute % self.retention
+        bucket = self.slots[pos]
+        if bucket is None or bucket.minute != minute:
+            bucket = MinuteBucket(minute)
+            self.slots[pos] = bucket
+        self.last_minute = max(self.last_minute, minute)
+        return bucket
+
+    def record(self, minute: int, error: bool, ttfb: Optional[float], duration: Optional[float], streamed_bytes: int,
+               tokens: Optional[Tuple[int, int]] = None):
+        bucket = self._bucket(minute)
+        bucket.requests += 1
+        if error:
+            bucket.errors += 1
+        if streamed_bytes:
+            bucket.streamed_bytes += streamed_bytes
+        if tokens:
+            bucket.prompt_tokens += tokens[0]
+            bucket.completion_tokens += tokens[1]
+        if ttfb is not None:
+            bucket.ttfb.observe(ttfb)
+        if duration is not None:
+            bucket.duration.observe(duration)
+
+    def merge_bucket(self, other: MinuteBucket):
+        if other.minute + self.retention <= self.last_minute:
+            return
+        self._bucket(other.minute).merge(other)
+
+    def is_idle(self, now_minute: int) -> bool:
+        return now_minute - self.last_minute >= self.retention
+
+    def query(self, now_minute: int, window: int, granularity: int) -> Dict[str, Any]:
+        """
+        合并最近 window 分钟的数据：总计 + 每 granularity 分钟一个点（时间戳为该区间起点）。
+        tokens_per_second 是区间内的平均吞吐（总 token 数 / 区间秒数）。
+        """
+        window = min(window, self.retention)
+        first = now_minute - window + 1
+        total = MinuteBucket(first)
+        points: Dict[int, MinuteBucket] = {}
+        for bucket in self.slots:
+            if bucket is None or not first <= bucket.minute <= now_minute:
+                continue
+            total.merge(bucket)
+            start = first + (bucket.minute - first) // granularity * granularity
+            point = points.get(start)
+            if point is None:
+                point = points[start] = MinuteBucket(start)
+            point.merge(bucket)
+        series = []
+        for start in sorted(points):
+            point = points[start]
+            entry = {"ts": start * 60}
+            entry.update(point.to_dict(include_latency=False))
+            entry["tokens_per_second"] = round(entry["total_tokens"] / (granularity * 60), 3)
+            entry["ttfb_p95"] = point.ttfb.quantile(0.95)
+            entry["duration_p95"] = point.duration.quantile(0.95)
+            series.append(entry)
+        total_dict = total.to_dict()
+        total_dict["tokens_per_second"] = round(total_dict["total_tokens"] / (window * 60), 3)
+        return {"total": total_dict, "series": series}
+
+
+class SeriesGroup:
+    """一组按 key 区分的时间序列（如按模型），key 数量有上限"""
+
+    def __init__(self, retention_minutes: int, max_keys: int):
+        self.retention = retention_minutes
+        self.max_keys = max_keys
+        self.series: Dict[str, MinuteSeries] = {}
+
+    def _get(self, key: str, now_minute: int) -> MinuteSeries:
+        series = self.series.get(key)
+        if series is not None:
+            return series
+        if len(self.series) >= self.max_keys:
+            # 先回收保留期内没有数据的 key，仍然满时计入溢出桶
+            for idle in [k for k, s in self.series.items() if k != OVERFLOW_KEY and s.is_idle(now_minute)]:
+                del self.series[idle]
+            if len(self.series) >= self.max_keys:
+                key = OVERFLOW_KEY
+                series = self.series.get(key)
+                if series is not None:
+                    return series
+        series = self.series[key] = MinuteSeries(self.retention)
+        return series
+
+    def record(self, key: str, error: bool, ttfb: Optional[float] = None,
+               duration: Optional[float] = None, streamed_bytes: int = 0,
+               tokens: Optional[Tuple[int, int]] = None, now: Optional[float] = None):
+        """tokens 为 (prompt_tokens, completion_tokens)"""
+        minute = int((now if now is not None else time.time()) // 60)
+        self._get(key, minute).record(minute, error, ttfb, duration, streamed_bytes, tokens)
+
+    def export(self) -> Dict[str, list]:
+        return {
+            key: [bucket.export() for bucket in series.slots if bucket is not None]
+            for key, series in self.series.items()
+        }
+
+    def merge_export(self, data: Dict[str, list], now: Optional[float] = None):
+        """合并另一个 worker 导出的序列（按 key、按分钟逐桶相加）"""
+        minute = int((now if now is not None else time.time()) // 60)
+        for key, buckets in data.items():
+            series = self._get(key, minute)
+            for item in buckets:
+                series.merge_bucket(MinuteBucket.from_export(item))
+
+    def query(self, window: int, granularity: int, now: Optional[float] = None) -> Dict[str, Any]:
+        minute = int((now if now is not None else time.time()) // 60)
+        result = {}
+        for key, series in self.series.items():
+            data = series.query(minute, window, granularity)
+            if data["total"]["requests"]:
+                result[key] = data
+        return result
@@ -0,0 +1,319 @@
+"""
+Stats Store - 使用统计的持久化
+
+UsageStatsManager 只在内存中计数，请求路径不做任何 I/O。StatsStore 的后台任务每
+CODEBUDDY_STATS_FLUSH_INTERVAL 秒把快照写入本地 SQLite（WAL）：
+
+- counters：累计计数（模型/凭证使用次数、上游尝试、重试、token 用量），写入的是绝对值
+- minutes：按分钟序列中自上次写入以来可能变化的分钟
+- rollups：超过保留分钟数的分钟数据按小时合并，按小时汇总超过保留天数后再合并为按天汇总
+
+启动时读回累计计数作为基线，并恢复保留期内的按分钟序列。多 worker 时只有 leader 写入，
+写入的是所有 worker 合并后的统计。
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .stats_series import MinuteBucket
+
+logger = logging.getLogger(__name__)
+
+HOUR_MINUTES = 60
+DAY_MINUTES = 24 * 60
+# 汇总粒度名 -> 每个点包含的分钟数
+GRANULARITIES = {"hour": HOUR_MINUTES, "day": DAY_MINUTES}
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS counters (
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (kind, name)
+    );
+    CREATE TABLE IF NOT EXISTS minutes (
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        minute INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (dimension, key, minute)
+    );
+    CREATE INDEX IF NOT EXISTS idx_minutes_minute ON minutes (minute);
+    CREATE TABLE IF NOT EXISTS rollups (
+        granularity TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        minute INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (granularity, dimension, key, minute)
+    );
+    CREATE INDEX IF NOT EXISTS idx_rollups_minute ON rollups (granularity, minute);
+"""
+
+
+def _dumps(bucket: MinuteBucket) -> str:
+    return json.dumps(bucket.export(), separators=(",", ":"))
+
+
+class StatsStore:
+    """统计快照库；enabled 为 False 时 start/stop 均不做任何事"""
+
+    def __init__(self):
+        from config import get_stats_persist_enabled
+        self.enabled = get_stats_persist_enabled()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        # 下一次写入需要覆盖的最早分钟（更早的分钟不会再有新数据）
+        self._dirty_from = int(time.time() // 60)
+        self._compacted_hour: Optional[int] = None
+        self.last_flush: Optional[float] = None
+        self.last_flush_duration: Optional[float] = None
+        self.flush_count = 0
+        self.failures = 0
+
+    @property
+    def db_path(self) -> str:
+        from config import get_stats_db_path, get_codebuddy_creds_dir
+        path = get_stats_db_path() or os.path.join(get_codebuddy_creds_dir(), 'stats.db')
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(__file__), '..', path)
+        return path
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # --- 生命周期 ---
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        try:
+            await asyncio.to_thread(self.restore)
+        except Exception as e:
+            logger.error(f"Failed to restore usage stats from {self.db_path}: {e}")
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # 退出前写入最后一次快照
+        await self._flush_if_leader()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def _loop(self):
+        from config import get_stats_flush_interval
+        while True:
+            await asyncio.sleep(get_stats_flush_interval())
+            await self._flush_if_leader()
+
+    async def _flush_if_leader(self):
+        from .shared_state import shared_state
+        if not shared_state.is_leader:
+            return
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Failed to persist usage stats: {e}")
+
+    # --- 恢复 ---
+
+    def restore(self):
+        """读回累计计数作为基线，并恢复保留期内的按分钟序列"""
+        from .usage_stats_manager import usage_stats_manager
+        since = int(time.time() // 60) - usage_stats_manager.retention_minutes + 1
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT kind, name, count FROM counters").fetchall()
+            minute_rows = conn.execute(
+                "SELECT dimension, key, data FROM minutes WHERE minute >= ?", (since,)
+            ).fetchall()
+        series: Dict[str, Dict[str, list]] = {}
+        for dimension, key, data in minute_rows:
+            try:
+                series.setdefault(dimension, {}).setdefault(key, []).append(json.loads(data))
+            except ValueError:
+                continue
+        usage_stats_manager.restore(rows, series)
+        if rows or series:
+            logger.info(f"Restored usage stats from {self.db_path} ({len(rows)} counters, {len(minute_rows)} minute buckets)")
+
+    # --- 写入 ---
+
+    def flush(self):
+        """写入一次快照：累计计数（绝对值）+ 最近变化的分钟，必要时压缩旧数据"""
+        from .usage_stats_manager import usage_stats_manager, stats_to_rows
+        started = time.monotonic()
+        now_minute = int(time.time() // 60)
+        # 只在内存中复制快照，锁外写库
+        rows = stats_to_rows(usage_stats_manager.get_stats())
+        dirty_from = self._dirty_from
+        minute_rows = [
+            (dimension, key, item[0], json.dumps(item, separators=(",", ":")))
+            for dimension, groups in usage_stats_manager.export_merged_series().items()
+            for key, buckets in groups.items()
+            for item in buckets
+            if item[0] >= dirty_from
+        ]
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO counters (kind, name, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT(kind, name) DO UPDATE SET count = excluded.count",
+                    rows
+                )
+                conn.executemany(
+                    "INSERT INTO minutes (dimension, key, minute, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(dimension, key, minute) DO UPDATE SET data = excluded.data",
+                    minute_rows
+                )
+                if self._compacted_hour != now_minute // HOUR_MINUTES:
+                    self._compact(conn, now_minute, usage_stats_manager.retention_minutes)
+                    self._compacted_hour = now_minute // HOUR_MINUTES
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        # 当前分钟之后仍可能有新数据，下次从当前分钟开始覆盖
+        self._dirty_from = now_minute
+        self.last_flush = time.time()
+        self.last_flush_duration = time.monotonic() - started
+        self.flush_count += 1
+
+    def _compact(self, conn: sqlite3.Connection, now_minute: int, retention_minutes: int):
+        """分钟 -> 小时 -> 天逐级合并，每级只合并不会再变化的数据（已超出上一级的保留期）"""
+        from config import get_stats_hourly_retention_days, get_stats_daily_retention_days
+        minute_cutoff = now_minute - retention_minutes + 1
+        hour_cutoff = now_minute - get_stats_hourly_retention_days() * DAY_MINUTES
+        day_cutoff = now_minute - get_stats_daily_retention_days() * DAY_MINUTES
+
+        old_minutes = conn.execute(
+            "SELECT dimension, key, minute, data FROM minutes WHERE minute < ?", (minute_cutoff,)
+        ).fetchall()
+        self._roll_up(conn, old_minutes, "hour", HOUR_MINUTES)
+        conn.execute("DELETE FROM minutes WHERE minute < ?", (minute_cutoff,))
+
+        old_hours = conn.execute(
+            "SELECT dimension, key, minute, data FROM rollups WHERE granularity = 'hour' AND minute < ?",
+            (hour_cutoff,)
+        ).fetchall()
+        self._roll_up(conn, old_hours, "day", DAY_MINUTES)
+        conn.execute("DELETE FROM rollups WHERE granularity = 'hour' AND minute < ?", (hour_cutoff,))
+        conn.execute("DELETE FROM rollups WHERE granularity = 'day' AND minute < ?", (day_cutoff,))
+        if old_minutes or old_hours:
+            logger.info(f"Compacted {len(old_minutes)} minute and {len(old_hours)} hourly stats buckets")
+
+    @staticmethod
+    def _roll_up(conn: sqlite3.Connection, rows: List[Tuple[str, str, int, str]], granularity: str, span: int):
+        """把 rows 按 span 分钟对齐合并，再累加到已有的 granularity 汇总上"""
+        merged: Dict[Tuple[str, str, int], MinuteBucket] = {}
+        for dimension, key, minute, data in rows:
+            try:
+                bucket = MinuteBucket.from_export(json.loads(data))
+            except (ValueError, IndexError, TypeError):
+                continue
+            target = (dimension, key, minute - minute % span)
+            existing = merged.get(target)
+            if existing is None:
+                existing = merged[target] = MinuteBucket(target[2])
+            existing.merge(bucket)
+        for (dimension, key, start), bucket in merged.items():
+            row = conn.execute(
+                "SELECT data FROM rollups WHERE granularity = ? AND dimension = ? AND key = ? AND minute = ?",
+                (granularity, dimension, key, start)
+            ).fetchone()
+            if row is not None:
+                bucket.merge(MinuteBucket.from_export(json.loads(row[0])))
+            conn.execute(
+                "INSERT INTO rollups (granularity, dimension, key, minute, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(granularity, dimension, key, minute) DO UPDATE SET data = excluded.data",
+                (granularity, dimension, key, start, _dumps(bucket))
+            )
+
+    # --- 查询 ---
+
+    def history(self, granularity: str, days: int) -> Dict[str, Any]:
+        """
+        按小时或按天的历史统计：已汇总的数据加上尚未压缩的分钟/小时数据，
+        返回 {dimension: {key: [{ts, requests, errors, ...}]}}
+        """
+        span = GRANULARITIES[granularity]
+        since = int(time.time() // 60) - days * DAY_MINUTES
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT dimension, key, minute, data FROM minutes WHERE minute >= ?", (since,)
+            ).fetchall()
+            levels = ("hour",) if granularity == "hour" else ("hour", "day")
+            for level in levels:
+                rows += conn.execute(
+                    "SELECT dimension, key, minute, data FROM rollups WHERE granularity = ? AND minute >= ?",
+                    (level, since - since % GRANULARITIES[level])
+                ).fetchall()
+        points: Dict[str, Dict[str, Dict[int, MinuteBucket]]] = {}
+        for dimension, key, minute, data in rows:
+            try:
+                bucket = MinuteBucket.from_export(json.loads(data))
+            except (ValueError, IndexError, TypeError):
+                continue
+            start = minute - minute % span
+            by_start = points.setdefault(dimension, {}).setdefault(key, {})
+            point = by_start.get(start)
+            if point is None:
+                point = by_start[start] = MinuteBucket(start)
+            point.merge(bucket)
+        result: Dict[str, Any] = {}
+        for dimension, keys in points.items():
+            result[dimension] = {}
+            for key, by_start in keys.items():
+                series = []
+                for start in sorted(by_start):
+                    point = by_start[start]
+                    entry = {"ts": start * 60}
+                    entry.update(point.to_dict(include_latency=False))
+                    entry["ttfb_p95"] = point.ttfb.quantile(0.95)
+                    entry["duration_p95"] = point.duration.quantile(0.95)
+                    series.append(entry)
+                result[dimension][key] = series
+        return {"granularity": granularity, "days": days, "dimensions": result}
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "path": self.db_path,
+            "last_flush": self.last_flush,
+            "last_flush_duration": round(self.last_flush_duration, 4) if self.last_flush_duration is not None else None,
+            "flush_count": self.flush_count,
+            "failures": self.failures
+        }
+
+
+# 全局统计持久化实例
+stats_store = StatsStore()
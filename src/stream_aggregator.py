@@ -0,0 +1,156 @@
+"""
+Stream Aggregator - 将流式 chat.completion.chunk 增量合并为非流式 chat.completion
+
+每个增量块到达时立即折叠进当前状态（文本用列表收集、最后一次 join，工具调用按 index 分桶），
+内存只与最终结果大小相关；一旦看到终止块即可返回，无需等待上游关闭连接。
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+
+class _ChoiceState:
+    """单个 choice 的合并状态"""
+
+    __slots__ = ("index", "role", "text_parts", "tool_calls", "finish_reason", "extra")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.role: Optional[str] = None
+        self.text_parts: Dict[str, List[str]] = {}   # content / reasoning_content 等字符串字段
+        self.tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.finish_reason: Optional[str] = None
+        self.extra: Dict[str, Any] = {}
+
+    def add_delta(self, delta: Dict[str, Any]):
+        for key, value in delta.items():
+            if key == "role":
+                if value:
+                    self.role = value
+            elif key == "tool_calls":
+                if value:
+                    self._add_tool_calls(value)
+            elif isinstance(value, str):
+                if value:
+                    self.text_parts.setdefault(key, []).append(value)
+            elif value is not None:
+                self.extra[key] = value
+
+    def _add_tool_calls(self, tool_calls: List[Dict[str, Any]]):
+        for position, new_tool_call in enumerate(tool_calls):
+            index = new_tool_call.get("index", position)
+            slot = self.tool_calls.get(index)
+            if slot is None:
+                slot = {"index": index, "name": "", "arguments": [], "fields": {}}
+                self.tool_calls[index] = slot
+
+            function = new_tool_call.get("function") or {}
+            if function.get("name"):
+                slot["name"] = function["name"]
+            if function.get("arguments"):
+                slot["arguments"].append(function["arguments"])
+
+            # id, type 等其他字段保留最后一个非空值
+            for key, value in new_tool_call.items():
+                if key not in ("function", "index") and value is not None:
+                    slot["fields"][key] = value
+
+    def build(self) -> Dict[str, Any]:
+        message: Dict[str, Any] = {"role": self.role or "assistant"}
+        message["content"] = "".join(self.text_parts.get("content", ()))
+        for key, parts in self.text_parts.items():
+            if key != "content":
+                message[key] = "".join(parts)
+        message.update(self.extra)
+
+        if self.tool_calls:
+            merged = []
+            for index in sorted(self.tool_calls):
+                slot = self.tool_calls[index]
+                tool_call = {"index": index}
+                tool_call.update(slot["fields"])
+                tool_call["function"] = {"name": slot["name"], "arguments": "".join(slot["arguments"])}
+                merged.append(tool_call)
+            message["tool_calls"] = merged
+
+        return {
+            "index": self.index,
+            "message": message,
+            "finish_reason": self.finish_reason or "stop"
+        }
+
+
+class ChatCompletionAggregator:
+    """
+    增量合并器。
+
+    Args:
+        expect_usage: 请求中设置了 stream_options.include_usage 时为 True，
+                      此时在所有 choice 结束后还需等待携带 usage 的最后一块才算完成。
+    """
+
+    def __init__(self, expect_usage: bool = False):
+        self.expect_usage = expect_usage
+        self.base: Optional[Dict[str, Any]] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.error: Optional[Any] = None
+        self.done = False
+        self._choices: Dict[int, _ChoiceState] = {}
+
+    @property
+    def has_choices(self) -> bool:
+        return bool(self._choices)
+
+    @property
+    def is_complete(self) -> bool:
+        """是否已收到终止块（[DONE]，或全部 choice 已结束且不再等待 usage）"""
+        if self.done:
+            return True
+        if not self._choices or any(c.finish_reason is None for c in self._choices.values()):
+            return False
+        return not self.expect_usage or self.usage is not None
+
+    def mark_done(self):
+        """收到 [DONE]"""
+        self.done = True
+
+    def add_chunk(self, chunk: Any) -> bool:
+        """折叠一个增量块，返回是否已完成"""
+        if not isinstance(chunk, dict):
+            return self.is_complete
+
+        if "error" in chunk and "choices" not in chunk:
+            self.error = chunk["error"]
+            return self.is_complete
+
+        if self.base is None and "choices" in chunk:
+            self.base = {k: v for k, v in chunk.items() if k not in ("choices", "usage")}
+
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+
+        for choice in chunk.get("choices") or []:
+            index = choice.get("index", 0)
+            state = self._choices.get(index)
+            if state is None:
+                state = _ChoiceState(index)
+                self._choices[index] = state
+            delta = choice.get("delta") or choice.get("message")
+            if delta:
+                state.add_delta(delta)
+            if choice.get("finish_reason"):
+                state.finish_reason = choice["finish_reason"]
+
+        return self.is_complete
+
+    def build(self) -> Optional[Dict[str, Any]]:
+        """生成非流式 chat.completion 响应；没有收到任何 choice 时返回 None"""
+        if not self._choices:
+            return None
+
+        response = dict(self.base or {})
+        response["object"] = "chat.completion"
+        response["created"] = int(time.time())
+        response["choices"] = [self._choices[i].build() for i in sorted(self._choices)]
+        if self.usage is not None:
+            response["usage"] = self.usage
+        return response
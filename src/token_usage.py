@@ -0,0 +1,163 @@
+"""
+Token Usage - 从上游 SSE 流中提取 token 用量
+
+上游在请求设置了 stream_options.include_usage 时，会在最后发送一个携带 usage 的块
+（choices 通常为空）。流式响应是原样转发字节的，StreamUsageTap 只在包含 "usage" 字样的
+完整事件上做 JSON 解析，其余分块只做一次字节查找，不增加解码开销。
+
+客户端自己没有请求 usage 时，由代理替它打开 include_usage，再把只含 usage 的块从转发的
+字节中去掉，客户端看到的流与未开启时一致。
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+TOKEN_TYPES = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+_USAGE_MARKER = b'"usage"'
+_EVENT_SEPARATORS = (b"\r\n\r\n", b"\n\n")
+_EVENT_SPLIT = re.compile(rb"(\r?\n\r?\n)")
+# 最长分隔符长度 - 1：跨分块的分隔符在上一块末尾最多留下这么多字节
+_SEPARATOR_TAIL = max(map(len, _EVENT_SEPARATORS)) - 1
+# 一直没有遇到事件边界时最多暂存的字节数，超过后直接放行（上游不是标准 SSE）
+_MAX_PENDING = 1024 * 1024
+
+
+# 客户端标识的最大长度与最多区分的客户端数，超过后归入 "other"，避免统计和指标的维度无限增长
+_MAX_CLIENT_ID_LENGTH = 64
+_MAX_CLIENTS = 1000
+_CLIENT_ID_INVALID = re.compile(r"[^A-Za-z0-9._@:/-]")
+_known_clients: set = set()
+
+
+def client_id(header_value: Optional[str], user: Any = None) -> str:
+    """
+    按客户端统计 token 用量时的标识：优先取请求头 X-Client-Id，其次取请求体中 OpenAI 的 user 字段，
+    都没有时为 "anonymous"。所有客户端共用同一个服务密码，因此不能用 API 密钥区分客户端。
+    """
+    value = header_value if header_value else user
+    if not isinstance(value, str):
+        return "anonymous"
+    value = _CLIENT_ID_INVALID.sub("_", value.strip())[:_MAX_CLIENT_ID_LENGTH]
+    if not value:
+        return "anonymous"
+    if value not in _known_clients:
+        if len(_known_clients) >= _MAX_CLIENTS:
+            return "other"
+        _known_clients.add(value)
+    return value
+
+
+def normalize_usage(usage: Any) -> Optional[Tuple[int, int, int]]:
+    """把上游 usage 对象转为 (prompt, completion, total)；缺少 total 时由前两者相加"""
+    if not isinstance(usage, dict):
+        return None
+    try:
+        prompt = int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+        total = int(usage.get("total_tokens") or (prompt + completion))
+    except (TypeError, ValueError):
+        return None
+    if not (prompt or completion or total):
+        return None
+    return prompt, completion, total
+
+
+def _split_event_boundary(data: bytes) -> int:
+    """返回最后一个完整事件之后的位置，没有完整事件时返回 0"""
+    end = 0
+    for separator in _EVENT_SEPARATORS:
+        position = data.rfind(separator)
+        if position != -1:
+            end = max(end, position + len(separator))
+    return end
+
+
+class StreamUsageTap:
+    """
+    挂在透传字节流上的 usage 提取器。
+
+    strip_usage_chunks 为 False 时分块原样返回，只旁路观察；为 True 时按事件边界转发，
+    并去掉 choices 为空的 usage 块（不完整的末尾事件会暂存到下一个分块）。
+    """
+
+    def __init__(self, strip_usage_chunks: bool = False):
+        self.strip_usage_chunks = strip_usage_chunks
+        self.usage: Optional[Dict[str, Any]] = None
+        # 不完整的末尾事件按分块暂存，出现事件边界时才一次 join，避免长事件分成许多小块时反复复制
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        # 暂存内容的最后几个字节：分隔符可能跨分块，只需在 尾部 + 新分块 中查找边界
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        """输入一个上游分块，返回应转发给客户端的字节"""
+        if not chunk:
+            return b""
+        if self._pending:
+            window = self._tail + chunk
+            boundary = _split_event_boundary(window)
+            if boundary == 0 and self._pending_size + len(chunk) <= _MAX_PENDING:
+                self._pending.append(chunk)
+                self._pending_size += len(chunk)
+                self._tail = window[-_SEPARATOR_TAIL:]
+                return b"" if self.strip_usage_chunks else chunk
+            data = b"".join(self._pending) + chunk
+            boundary = boundary + len(data) - len(window) if boundary else len(data)
+        else:
+            data = chunk
+            boundary = _split_event_boundary(data)
+            if boundary == 0 and len(data) > _MAX_PENDING:
+                boundary = len(data)
+        complete, rest = data[:boundary], data[boundary:]
+        self._pending = [rest] if rest else []
+        self._pending_size = len(rest)
+        self._tail = rest[-_SEPARATOR_TAIL:]
+        if self.strip_usage_chunks:
+            return self._process(complete)
+        if complete:
+            self._process(complete)
+        return chunk
+
+    def flush(self) -> bytes:
+        """流结束时处理剩余的不完整事件"""
+        remainder = b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self._tail = b""
+        if not remainder:
+            return b""
+        forwarded = self._process(remainder)
+        return forwarded if self.strip_usage_chunks else b""
+
+    def _process(self, data: bytes) -> bytes:
+        if _USAGE_MARKER not in data:
+            return data
+        # 保留分隔符切分，去掉某个事件时连同它后面的空行一起去掉，其余字节保持原样
+        parts = _EVENT_SPLIT.split(data)
+        kept: List[bytes] = []
+        for i in range(0, len(parts), 2):
+            event = parts[i]
+            if _USAGE_MARKER in event and self._inspect(event) and self.strip_usage_chunks:
+                continue
+            kept.append(event)
+            if i + 1 < len(parts):
+                kept.append(parts[i + 1])
+        return b"".join(kept)
+
+    def _inspect(self, event: bytes) -> bool:
+        """记录事件中的 usage；返回该事件是否只是 usage 块（可去掉）"""
+        usage_only = False
+        for line in event.split(b"\n"):
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                payload = json.loads(line[5:])
+            except ValueError:
+                continue
+            if not isinstance(payload, dict) or not payload.get("usage"):
+                continue
+            self.usage = payload["usage"]
+            usage_only = not payload.get("choices")
+        return usage_only
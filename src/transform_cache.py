@@ -0,0 +1,110 @@
+"""
+Transform Cache - 请求变换结果的 LRU 缓存
+
+Agent 客户端每一轮都会重发同一份几十 KB 的系统提示词和历史消息，关键词替换、
+字符串化 JSON 的检测与解析对相同内容反复执行。TransformCache 按内容缓存单条消息 /
+单段文本的变换结果，命中时直接返回，不再做任何变换。
+
+- 以原文本身作为字典 key：Python 对 str 计算一次哈希后缓存在对象上，命中时逐字节比较，
+  不会因哈希碰撞返回错误结果；对 100KB 文本，哈希 + 比较比一次关键词替换快一个数量级
+- 按估算的字节数淘汰（原文 + 结果），上限为 CODEBUDDY_TRANSFORM_CACHE_MB，0 表示关闭
+- 短于 MIN_CACHEABLE_LENGTH 的文本直接变换，缓存的记账开销反而更大
+- 缓存 key 包含当前生效的编译规则（CompiledRules 按对象比较），规则热更新后旧结果不会再命中；
+  keyword_rewriter 重新编译规则时清空缓存，释放旧结果占用的内存
+"""
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# 短于该长度（字符）的文本不缓存
+MIN_CACHEABLE_LENGTH = 512
+# 单个条目超过缓存上限的该比例时不缓存，避免一次写入冲掉整个缓存
+MAX_ENTRY_FRACTION = 0.25
+# 每个条目的固定记账开销（元组、OrderedDict 节点等）
+ENTRY_OVERHEAD = 200
+
+
+def text_size(*texts: Any) -> int:
+    """估算若干个字符串占用的字节数（同一对象只计一次）"""
+    seen = set()
+    size = ENTRY_OVERHEAD
+    for text in texts:
+        if id(text) not in seen:
+            seen.add(id(text))
+            size += sys.getsizeof(text)
+    return size
+
+
+class TransformCache:
+    """按命名空间统计命中率的 LRU 缓存，容量按字节计"""
+
+    def __init__(self):
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[Any, int]]" = OrderedDict()
+        self.bytes = 0
+        # 命名空间 -> [命中, 未命中, 淘汰]
+        self._counters: Dict[str, List[int]] = {}
+
+    @property
+    def max_bytes(self) -> int:
+        from config import get_transform_cache_mb
+        return int(get_transform_cache_mb() * 1024 * 1024)
+
+    def _counter(self, namespace: str) -> List[int]:
+        counter = self._counters.get(namespace)
+        if counter is None:
+            counter = self._counters[namespace] = [0, 0, 0]
+        return counter
+
+    def get_or_compute(self, namespace: str, key: Hashable, compute: Callable[[], Any],
+                       size: Callable[[Any], Optional[int]]) -> Any:
+        """命中时返回缓存值；否则调用 compute()，按 size(结果) 记账后写入（size 返回 None 时不写入）"""
+        max_bytes = self.max_bytes
+        if max_bytes <= 0:
+            return compute()
+        counter = self._counter(namespace)
+        cache_key = (namespace, key)
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            self._entries.move_to_end(cache_key)
+            counter[0] += 1
+            return entry[0]
+        counter[1] += 1
+        value = compute()
+        entry_size = size(value)
+        if entry_size is not None and entry_size <= max_bytes * MAX_ENTRY_FRACTION:
+            self._entries[cache_key] = (value, entry_size)
+            self.bytes += entry_size
+            self._evict(max_bytes)
+        return value
+
+    def _evict(self, max_bytes: int):
+        while self.bytes > max_bytes and self._entries:
+            (namespace, _), (_, entry_size) = self._entries.popitem(last=False)
+            self.bytes -= entry_size
+            self._counter(namespace)[2] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        namespaces = {}
+        for namespace, (hits, misses, evictions) in self._counters.items():
+            lookups = hits + misses
+            namespaces[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "evictions": evictions
+            }
+        return {
+            "enabled": self.max_bytes > 0,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "namespaces": namespaces
+        }
+
+
+# 全局变换缓存实例
+transform_cache = TransformCache()
@@ -1,8 +1,64 @@
 """
 Usage Statistics Manager - Tracks usage stats for models and credentials.
+
+Besides the lifetime counters used by the admin page, requests are recorded into
+per-minute series (see stats_series) per model and per credential. The number of
+distinct model keys is capped; extra keys are counted under OVERFLOW_KEY.
+
+Token usage reported by the upstream is accumulated per model, per credential and per
+client (a hash of the API key, see token_usage.client_id).
+
+Counters restored from the stats store at startup are kept apart as a baseline and only
+added when reading, so workers can publish their own session counters unchanged.
 """
 import threading
 from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .stats_series import SeriesGroup, OVERFLOW_KEY
+
+TOKEN_DIMENSIONS = ("models", "credentials", "clients")
+
+
+def empty_stats() -> Dict[str, Any]:
+    return {
+        "model_usage": {},
+        "credential_usage": {},
+        "upstream_attempts": {},
+        "retry_count": 0,
+        "token_usage": {dimension: {} for dimension in TOKEN_DIMENSIONS}
+    }
+
+
+def stats_to_rows(stats: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+    """Flattens a stats dict into (kind, name, count) rows for storage."""
+    rows = [("model_usage", name, count) for name, count in stats["model_usage"].items()]
+    rows += [("credential_usage", name, count) for name, count in stats["credential_usage"].items()]
+    for credential_id, statuses in stats["upstream_attempts"].items():
+        rows += [("upstream_attempts", f"{credential_id}\t{status}", count) for status, count in statuses.items()]
+    rows.append(("retry_count", "", stats["retry_count"]))
+    for dimension, counters in stats.get("token_usage", {}).items():
+        for key, entry in counters.items():
+            rows += [("token_usage", f"{dimension}\t{key}\t{field}", count) for field, count in entry.items()]
+    return rows
+
+
+def add_stats_rows(stats: Dict[str, Any], rows: Iterable[Tuple[str, str, int]]) -> Dict[str, Any]:
+    """Adds (kind, name, count) rows into a stats dict in place."""
+    for kind, name, count in rows:
+        if kind == "retry_count":
+            stats["retry_count"] += count
+        elif kind == "upstream_attempts":
+            credential_id, status = name.split("\t", 1)
+            statuses = stats["upstream_attempts"].setdefault(credential_id, {})
+            statuses[status] = statuses.get(status, 0) + count
+        elif kind in ("model_usage", "credential_usage"):
+            stats[kind][name] = stats[kind].get(name, 0) + count
+        elif kind == "token_usage":
+            dimension, key, field = name.split("\t", 2)
+            entry = stats["token_usage"].setdefault(dimension, {}).setdefault(key, {})
+            entry[field] = entry.get(field, 0) + count
+    return stats
 
 class UsageStatsManager:
     _instance = None
@@ -16,24 +72,150 @@ class UsageStatsManager:
                     cls._instance = super(UsageStatsManager, cls).__new__(cls)
                     cls._instance.model_usage = defaultdict(int)
                     cls._instance.credential_usage = defaultdict(int)
+                    cls._instance.upstream_attempts = defaultdict(lambda: defaultdict(int))
+                    cls._instance.retry_count = 0
+                    cls._instance.token_usage = {dimension: {} for dimension in TOKEN_DIMENSIONS}
+                    cls._instance.baseline_rows = []
+                    cls._instance.restored_series = None
+                    cls._instance._init_series()
         return cls._instance
 
+    def _init_series(self):
+        from config import get_stats_retention_minutes, get_stats_max_keys
+        self.retention_minutes = get_stats_retention_minutes()
+        self.max_keys = get_stats_max_keys()
+        self.model_series = SeriesGroup(self.retention_minutes, self.max_keys)
+        self.credential_series = SeriesGroup(self.retention_minutes, self.max_keys)
+
+    def model_key(self, model_name: str) -> str:
+        """Caps the number of distinct model names kept in the lifetime counters (also used as metric label)."""
+        if model_name in self.model_usage or len(self.model_usage) < self.max_keys:
+            return model_name
+        return OVERFLOW_KEY
+
     def record_model_usage(self, model_name: str):
         """Records the usage of a specific model."""
         with self._lock:
-            self.model_usage[model_name] += 1
+            self.model_usage[self.model_key(str(model_name))] += 1
 
     def record_credential_usage(self, credential_id: str):
         """Records the usage of a specific credential."""
         with self._lock:
             self.credential_usage[credential_id] += 1
 
+    def record_upstream_attempt(self, credential_id: str, status_code: int, is_retry: bool = False):
+        """Records one upstream attempt and its resulting status code."""
+        with self._lock:
+            self.upstream_attempts[credential_id][str(status_code)] += 1
+            if is_retry:
+                self.retry_count += 1
+            if status_code != 200:
+                # Failed attempts never reach the end of a stream, record them here.
+                self.credential_series.record(credential_id, error=True)
+
+    def record_request(self, model_name: str, credential_id: Optional[str], error: bool,
+                       ttfb: Optional[float] = None, duration: Optional[float] = None,
+                       streamed_bytes: int = 0, tokens: Optional[Tuple[int, int, int]] = None,
+                       client: Optional[str] = None):
+        """
+        Records a finished client request into the per-minute series of its model and credential.
+        tokens is (prompt, completion, total) as reported by the upstream, if any.
+        """
+        with self._lock:
+            series_tokens = tokens[:2] if tokens else None
+            self.model_series.record(str(model_name), error, ttfb, duration, streamed_bytes, series_tokens)
+            if credential_id:
+                self.credential_series.record(credential_id, error, ttfb, duration, streamed_bytes, series_tokens)
+            if tokens:
+                self._add_tokens("models", self.model_key(str(model_name)), tokens)
+                if credential_id:
+                    self._add_tokens("credentials", credential_id, tokens)
+                self._add_tokens("clients", client or "anonymous", tokens)
+
+    def _add_tokens(self, dimension: str, key: str, tokens: Tuple[int, int, int]):
+        counters = self.token_usage[dimension]
+        entry = counters.get(key)
+        if entry is None:
+            if len(counters) >= self.max_keys:
+                key = OVERFLOW_KEY
+                entry = counters.get(key)
+            if entry is None:
+                entry = counters[key] = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        entry["requests"] += 1
+        entry["prompt_tokens"] += tokens[0]
+        entry["completion_tokens"] += tokens[1]
+        entry["total_tokens"] += tokens[2]
+
+    def export_series(self):
+        """Serializable per-minute series of this process, published to other workers."""
+        with self._lock:
+            return {"models": self.model_series.export(), "credentials": self.credential_series.export()}
+
+    def restore(self, rows: List[Tuple[str, str, int]], series: Optional[Dict[str, Dict[str, list]]]):
+        """Installs counters and per-minute series loaded from the stats store."""
+        with self._lock:
+            self.baseline_rows = list(rows)
+            self.restored_series = series or None
+
+    def _merged_series(self):
+        from .shared_state import shared_state
+        if not shared_state.enabled and self.restored_series is None:
+            return self.model_series, self.credential_series
+        # Histograms share fixed bucket bounds, so other workers' and restored minutes merge bucket by bucket.
+        exports = [self.export_series()]
+        if shared_state.enabled:
+            exports += shared_state.other_usage_series()
+        if self.restored_series is not None:
+            exports.append(self.restored_series)
+        models = SeriesGroup(self.retention_minutes, self.max_keys)
+        credentials = SeriesGroup(self.retention_minutes, self.max_keys)
+        for exported in exports:
+            models.merge_export(exported.get("models", {}))
+            credentials.merge_export(exported.get("credentials", {}))
+        return models, credentials
+
+    def export_merged_series(self):
+        """Per-minute series of all workers plus restored data, as persisted by the stats store."""
+        models, credentials = self._merged_series()
+        with self._lock:
+            return {"models": models.export(), "credentials": credentials.export()}
+
+    def get_series(self, window_minutes: int, granularity_minutes: int):
+        """Returns per-model and per-credential series for the last window_minutes (merged across workers)."""
+        window = max(1, min(window_minutes, self.retention_minutes))
+        granularity = max(1, min(granularity_minutes, window))
+        models, credentials = self._merged_series()
+        with self._lock:
+            return {
+                "window_minutes": window,
+                "granularity_minutes": granularity,
+                "retention_minutes": self.retention_minutes,
+                "models": models.query(window, granularity),
+                "credentials": credentials.query(window, granularity)
+            }
+
     def get_stats(self):
-        """Returns all current usage statistics."""
+        """Returns all usage statistics: restored baseline plus every worker's counters."""
+        from .shared_state import shared_state
+        stats = self.get_local_stats()
+        if shared_state.enabled:
+            stats = shared_state.merge_usage_stats(stats)
+        if self.baseline_rows:
+            stats = add_stats_rows(stats, self.baseline_rows)
+        return stats
+
+    def get_local_stats(self):
+        """Returns the usage statistics recorded by this process only."""
         with self._lock:
             return {
                 "model_usage": dict(self.model_usage),
-                "credential_usage": dict(self.credential_usage)
+                "credential_usage": dict(self.credential_usage),
+                "upstream_attempts": {k: dict(v) for k, v in self.upstream_attempts.items()},
+                "retry_count": self.retry_count,
+                "token_usage": {
+                    dimension: {key: dict(entry) for key, entry in counters.items()}
+                    for dimension, counters in self.token_usage.items()
+                }
             }
 
 # Global instance of the stats manager
@@ -0,0 +1,179 @@
+"""
+准入控制测试：并发上限、先进先出转交、队列满/排队超时拒绝，
+以及名额刚转交给排队请求时该请求恰好超时或被取消的竞争（名额不能泄漏）。
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config  # noqa: E402
+from src import admission  # noqa: E402
+from src.admission import AdmissionController, AdmissionRejected  # noqa: E402
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    def set_limits(max_in_flight=1, max_queue=10, queue_timeout=1.0):
+        monkeypatch.setitem(config._config_cache, "CODEBUDDY_MAX_IN_FLIGHT", max_in_flight)
+        monkeypatch.setitem(config._config_cache, "CODEBUDDY_MAX_QUEUE", max_queue)
+        monkeypatch.setitem(config._config_cache, "CODEBUDDY_QUEUE_TIMEOUT", queue_timeout)
+    return set_limits
+
+
+async def _queued(controller: AdmissionController, count: int = 1) -> asyncio.Task:
+    """启动一个 acquire 并让它进入等待队列"""
+    task = asyncio.create_task(controller.acquire())
+    while controller.queue_depth < count:
+        await asyncio.sleep(0)
+    return task
+
+
+def test_unlimited_never_queues(limits):
+    limits(max_in_flight=0)
+
+    async def scenario():
+        controller = AdmissionController()
+        tickets = [await controller.acquire() for _ in range(50)]
+        assert controller.in_flight == 50 and controller.queue_depth == 0
+        for ticket in tickets:
+            ticket.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_hands_slot_to_oldest_waiter(limits):
+    limits(max_in_flight=1)
+
+    async def scenario():
+        controller = AdmissionController()
+        first = await controller.acquire()
+        second = await _queued(controller, 1)
+        third = await _queued(controller, 2)
+
+        first.release()
+        second_ticket = await second
+        assert not third.done()
+        # 名额直接转交，in_flight 不会先降到 0 再被新请求抢走
+        assert controller.in_flight == 1 and controller.queue_depth == 1
+
+        second_ticket.release()
+        third_ticket = await third
+        third_ticket.release()
+        assert controller.in_flight == 0 and controller.queue_depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_is_idempotent(limits):
+    limits(max_in_flight=2)
+
+    async def scenario():
+        controller = AdmissionController()
+        ticket = await controller.acquire()
+        other = await controller.acquire()
+        ticket.release()
+        ticket.release()
+        assert controller.in_flight == 1
+        other.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_is_rejected(limits):
+    limits(max_in_flight=1, max_queue=1)
+
+    async def scenario():
+        controller = AdmissionController()
+        ticket = await controller.acquire()
+        waiter = await _queued(controller, 1)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire()
+        assert excinfo.value.reason == "queue full"
+        assert excinfo.value.retry_after >= 1
+        assert controller.rejected == 1
+
+        ticket.release()
+        (await waiter).release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_leaves_no_waiter(limits):
+    limits(max_in_flight=1, queue_timeout=0.01)
+
+    async def scenario():
+        controller = AdmissionController()
+        ticket = await controller.acquire()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire()
+        assert excinfo.value.reason == "queue timeout"
+        assert controller.timed_out == 1 and controller.queue_depth == 0
+
+        ticket.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def _handoff_then(exception: BaseException):
+    """替换 asyncio.wait_for：名额已经转交给等待者之后，超时或取消仍然先一步发生"""
+    async def wait_for(future, timeout):
+        await future
+        raise exception
+    return wait_for
+
+
+@pytest.mark.parametrize("exception, expected", [
+    (asyncio.TimeoutError(), AdmissionRejected),
+    (asyncio.CancelledError(), asyncio.CancelledError),
+])
+def test_slot_handed_over_at_timeout_is_passed_on(limits, monkeypatch, exception, expected):
+    limits(max_in_flight=1)
+
+    async def scenario():
+        controller = AdmissionController()
+        ticket = await controller.acquire()
+        with monkeypatch.context() as patch:
+            patch.setattr(admission.asyncio, "wait_for", _handoff_then(exception))
+            loser = await _queued(controller, 1)
+        next_in_line = await _queued(controller, 2)
+
+        ticket.release()
+        with pytest.raises(expected):
+            await loser
+        # 放弃的请求把名额继续转交给下一个等待者
+        next_ticket = await next_in_line
+        assert controller.in_flight == 1 and controller.queue_depth == 0
+
+        next_ticket.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("exception, expected", [
+    (asyncio.TimeoutError(), AdmissionRejected),
+    (asyncio.CancelledError(), asyncio.CancelledError),
+])
+def test_slot_handed_over_at_timeout_without_other_waiters(limits, monkeypatch, exception, expected):
+    limits(max_in_flight=1)
+
+    async def scenario():
+        controller = AdmissionController()
+        ticket = await controller.acquire()
+        monkeypatch.setattr(admission.asyncio, "wait_for", _handoff_then(exception))
+        loser = await _queued(controller, 1)
+
+        ticket.release()
+        with pytest.raises(expected):
+            await loser
+        assert controller.in_flight == 0 and controller.queue_depth == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,169 @@
+"""
+熔断器状态转换测试（closed -> open -> half_open -> closed/open），
+以及凭证选择在凭证熔断时的兜底：只退回到限速中的凭证，全部熔断时不返回凭证。
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config  # noqa: E402
+from src import circuit_breaker  # noqa: E402
+from src.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker  # noqa: E402
+from src.codebuddy_token_manager import CodeBuddyTokenManager  # noqa: E402
+from src.rate_limiter import credential_rate_limiter  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def _tripped(clock: FakeClock, cooldown: float = 30.0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=3, window_size=10, cooldown=cooldown)
+    for _ in range(3):
+        breaker.record_failure()
+    return breaker
+
+
+def test_consecutive_failures_open_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=3, window_size=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.is_available()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.is_available() and not breaker.allow_request()
+    assert breaker.trip_count == 1
+    assert breaker.retry_in() == pytest.approx(30.0)
+
+
+def test_success_resets_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, window_size=100)
+    for _ in range(5):
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_error_rate_over_full_window_opens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=100, error_rate_threshold=0.5, window_size=4)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_success()
+    assert breaker.state == CLOSED  # 窗口未满
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_cooldown_moves_to_half_open_with_a_single_trial(clock):
+    breaker = _tripped(clock)
+    clock.now += 29.9
+    assert breaker.state == OPEN
+
+    clock.now += 0.1
+    assert breaker.state == HALF_OPEN and breaker.is_available()
+    assert breaker.allow_request()
+    # 试探请求未返回前不再放行其他请求
+    assert not breaker.is_available() and not breaker.allow_request()
+
+
+def test_successful_trial_closes_the_breaker(clock):
+    breaker = _tripped(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.is_available()
+    # 熔断前的失败计数已清零
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    breaker = _tripped(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.trip_count == 2
+    assert breaker.retry_in() == pytest.approx(30.0)
+
+
+def test_abandoned_trial_is_released_after_cooldown(clock):
+    breaker = _tripped(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    clock.now += 29
+    assert not breaker.is_available()
+    clock.now += 1
+    assert breaker.is_available()
+
+
+def test_late_results_while_open_are_ignored(clock):
+    breaker = _tripped(clock)
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.trip_count == 1
+
+
+# --- 凭证选择 ---
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    now = int(time.time())
+    for name in ("a", "b", "c"):
+        (tmp_path / f"{name}.json").write_text(json.dumps({
+            "bearer_token": f"token-{name}", "user_id": name, "created_at": now, "expires_in": 86400
+        }))
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_RATE_LIMIT_ENABLED", True)
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_SELECTION_STRATEGY", "round_robin")
+    monkeypatch.setattr(credential_rate_limiter, "buckets", {})
+    return CodeBuddyTokenManager(creds_dir=str(tmp_path))
+
+
+def _open(manager: CodeBuddyTokenManager, key: str):
+    breaker = manager._get_breaker(key)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def _rate_limit(key: str):
+    credential_rate_limiter.get_bucket(key).on_rate_limited(retry_after=60)
+
+
+def test_open_credentials_are_skipped(manager):
+    _open(manager, "a.json")
+    users = {manager.get_next_credential(exclude={"b.json"})["user_id"] for _ in range(5)}
+    assert users == {"c"}
+
+
+def test_fallback_uses_rate_limited_but_never_open_credentials(manager):
+    _open(manager, "a.json")
+    _open(manager, "b.json")
+    _rate_limit("c.json")
+    assert manager.get_next_credential()["user_id"] == "c"
+    assert manager.get_next_credential(exclude={"c.json"}) is None
+
+
+def test_all_open_returns_none_with_retry_hint(manager):
+    for key in ("a.json", "b.json", "c.json"):
+        _open(manager, key)
+    assert manager.get_next_credential() is None
+    assert manager.get_next_credential(exclude={"a.json"}) is None
+    assert 0 < manager.breaker_retry_in() <= manager._get_breaker("a.json").cooldown
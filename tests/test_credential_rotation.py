@@ -0,0 +1,146 @@
+"""
+凭证轮换测试：就绪环按索引顺序轮换，过期堆在到期时把凭证移出就绪环，
+token 更新后重新登记过期时间并放回就绪环（旧的堆条目作废）。
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config  # noqa: E402
+from src import codebuddy_token_manager as token_manager_module  # noqa: E402
+from src.codebuddy_token_manager import EXPIRY_BUFFER, CodeBuddyTokenManager  # noqa: E402
+from src.rate_limiter import credential_rate_limiter  # noqa: E402
+
+START = 1_700_000_000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = float(START)
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(token_manager_module, "time", fake)
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_ROTATION_COUNT", 1)
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_SELECTION_STRATEGY", "round_robin")
+    monkeypatch.setattr(credential_rate_limiter, "buckets", {})
+    return fake
+
+
+def _credential(name: str, expires_in=None) -> dict:
+    data = {"bearer_token": f"token-{name}", "user_id": name}
+    if expires_in is not None:
+        data.update(created_at=START, expires_in=expires_in)
+    return data
+
+
+def _manager(tmp_path, credentials: dict) -> CodeBuddyTokenManager:
+    for name, data in credentials.items():
+        (tmp_path / f"{name}.json").write_text(json.dumps(data))
+    manager = CodeBuddyTokenManager(creds_dir=str(tmp_path))
+    # 目录后端按 glob 的顺序加载，按文件名排序后再断言轮换顺序
+    manager.credentials.sort(key=lambda cred: cred['file_path'])
+    manager._rebuild_indexes()
+    return manager
+
+
+def _users(manager: CodeBuddyTokenManager, count: int) -> str:
+    return "".join(manager.get_next_credential()["user_id"] for _ in range(count))
+
+
+def test_round_robin_follows_ready_ring(clock, tmp_path):
+    manager = _manager(tmp_path, {name: _credential(name, 3600) for name in "abc"})
+    assert _users(manager, 7) == "abcabca"
+
+
+def test_rotation_count_uses_each_credential_n_times(clock, tmp_path, monkeypatch):
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_ROTATION_COUNT", 2)
+    manager = _manager(tmp_path, {name: _credential(name, 3600) for name in "ab"})
+    assert _users(manager, 6) == "aabbaa"
+
+
+def test_expired_at_load_is_not_in_ring(clock, tmp_path):
+    manager = _manager(tmp_path, {
+        "a": _credential("a", 3600),
+        "b": _credential("b", EXPIRY_BUFFER - 1),
+        "c": _credential("c"),  # 没有过期信息的凭证一直有效
+    })
+    assert [manager._keys[i] for i in manager._ready] == ["a.json", "c.json"]
+    assert _users(manager, 4) == "acac"
+
+
+def test_expiry_heap_evicts_credentials_as_they_expire(clock, tmp_path):
+    manager = _manager(tmp_path, {
+        "a": _credential("a", 3600),
+        "b": _credential("b", EXPIRY_BUFFER + 60),
+        "c": _credential("c", EXPIRY_BUFFER + 120),
+    })
+    assert _users(manager, 3) == "abc"
+
+    clock.now += 60
+    assert _users(manager, 4) == "acac"
+    assert len(manager._expiry_heap) == 2
+
+    clock.now += 60
+    assert _users(manager, 2) == "aa"
+    assert [manager._keys[i] for i in manager._ready] == ["a.json"]
+
+    clock.now += 3600
+    assert manager.get_next_credential() is None
+
+
+def test_refreshed_token_returns_to_ring(clock, tmp_path):
+    manager = _manager(tmp_path, {
+        "a": _credential("a", 3600),
+        "b": _credential("b", EXPIRY_BUFFER + 60),
+    })
+    clock.now += 60
+    assert _users(manager, 2) == "aa"
+
+    # 凭证文件被更新为新的 token：重新登记过期时间，放回就绪环
+    refreshed = dict(_credential("b", 7200), created_at=int(clock.now), bearer_token="token-b2")
+    file_path = str(tmp_path / "b.json")
+    manager.apply_credential_changes({"b.json": (file_path, refreshed, (1, 1))}, [])
+    assert [manager._keys[i] for i in manager._ready] == ["a.json", "b.json"]
+    assert _users(manager, 4) == "baba"
+
+
+def test_stale_heap_entry_does_not_evict_refreshed_token(clock, tmp_path):
+    manager = _manager(tmp_path, {
+        "a": _credential("a", 3600),
+        "b": _credential("b", EXPIRY_BUFFER + 60),
+    })
+    refreshed = dict(_credential("b", 7200), bearer_token="token-b2")
+    manager.apply_credential_changes({"b.json": (str(tmp_path / "b.json"), refreshed, (1, 1))}, [])
+
+    # 旧的过期时间到了，但对应的堆条目已经作废
+    clock.now += 60
+    assert _users(manager, 4) == "abab"
+
+
+def test_exclude_picks_next_ready_without_advancing(clock, tmp_path):
+    manager = _manager(tmp_path, {name: _credential(name, 3600) for name in "abc"})
+    assert _users(manager, 1) == "a"
+    assert manager.get_next_credential(exclude={"a.json", "b.json"})["user_id"] == "c"
+    assert manager.get_next_credential(exclude={"a.json"})["user_id"] == "b"
+    # 排除选择不推进正常轮换
+    assert _users(manager, 2) == "bc"
+
+
+def test_deleting_credentials_keeps_rotation_position(clock, tmp_path):
+    manager = _manager(tmp_path, {name: _credential(name, 3600) for name in "abcd"})
+    assert _users(manager, 2) == "ab"
+    manager.apply_credential_changes({}, ["a.json"])
+    assert _users(manager, 3) == "cdb"
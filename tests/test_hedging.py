@@ -0,0 +1,63 @@
+"""
+对冲配额测试：每分钟上限，以及归还配额时只移除该次申请自己的记录。
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config  # noqa: E402
+from src import hedging  # noqa: E402
+from src.hedging import HedgePolicy  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(hedging, "time", fake)
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_HEDGE_MAX_PER_MINUTE", 2)
+    return fake
+
+
+def test_budget_per_minute(clock):
+    policy = HedgePolicy()
+    assert policy.try_acquire() is not None
+    assert policy.try_acquire() is not None
+    assert policy.try_acquire() is None
+    clock.now += 60
+    assert policy.try_acquire() is not None
+
+
+def test_cancel_removes_its_own_entry(clock):
+    policy = HedgePolicy()
+    older = policy.try_acquire()
+    clock.now += 30
+    newer = policy.try_acquire()
+    policy.cancel_acquire(older)
+    assert list(policy._hedge_times) == [newer]
+    assert policy.hedges_fired == 1
+
+    # 被归还的较早记录不再占用窗口；较新的记录在它自己的一分钟后才过期
+    clock.now += 31
+    assert policy.try_acquire() is not None
+    assert policy.try_acquire() is None
+
+
+def test_cancel_after_entry_aged_out(clock):
+    policy = HedgePolicy()
+    token = policy.try_acquire()
+    clock.now += 61
+    assert policy.try_acquire() is not None  # 旧记录在这里被移出窗口
+    policy.cancel_acquire(token)
+    assert len(policy._hedge_times) == 1
+    assert policy.hedges_fired == 1
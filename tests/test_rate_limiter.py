@@ -0,0 +1,107 @@
+"""
+自适应令牌桶测试：第一个 429 之前不限速，之后 AIMD（成功加性增、429 减半）并遵守 Retry-After。
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src import rate_limiter  # noqa: E402
+from src.rate_limiter import AdaptiveTokenBucket, parse_retry_after  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return 1_700_000_000.0 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", fake)
+    return fake
+
+
+def test_unlimited_until_first_429(clock):
+    bucket = AdaptiveTokenBucket(burst=2, max_rate=20)
+    assert all(bucket.try_acquire() for _ in range(100))
+    assert bucket.wait_time() == 0.0
+    bucket.on_success()
+    assert bucket.rate == 20 and not bucket.limited
+
+
+def test_429_halves_rate_and_empties_bucket(clock):
+    bucket = AdaptiveTokenBucket(burst=5, min_rate=0.1, max_rate=20)
+    bucket.on_rate_limited()
+    assert bucket.limited and bucket.rate == 10
+    assert bucket.tokens == 0.0
+    assert not bucket.try_acquire()
+    assert bucket.wait_time() == pytest.approx(0.1)
+
+    bucket.on_rate_limited()
+    assert bucket.rate == 5
+    for _ in range(10):
+        bucket.on_rate_limited()
+    assert bucket.rate == 0.1  # 不低于下限
+
+
+def test_success_increases_rate_additively_up_to_max(clock):
+    bucket = AdaptiveTokenBucket(max_rate=1.0, increase=0.25)
+    bucket.on_rate_limited()
+    assert bucket.rate == 0.5
+    bucket.on_success()
+    assert bucket.rate == 0.75
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 1.0
+
+
+def test_tokens_refill_at_current_rate(clock):
+    bucket = AdaptiveTokenBucket(burst=2, max_rate=4)
+    bucket.on_rate_limited()  # rate 2/s
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    clock.now += 10
+    # 令牌不超过 burst
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_retry_after_blocks_refill_until_it_expires(clock):
+    bucket = AdaptiveTokenBucket(burst=5, max_rate=20)
+    bucket.on_rate_limited(retry_after=30)
+    assert bucket.blocked_until == 1030.0
+    clock.now += 29
+    assert not bucket.try_acquire()
+    # 封锁期间不累积令牌：到期后仍需按新速率等待一个令牌
+    assert bucket.wait_time() == pytest.approx(1 + 1 / 10)
+
+    clock.now += 1
+    assert bucket.wait_time() == pytest.approx(0.1)
+    clock.now += 0.11
+    assert bucket.try_acquire()
+
+
+def test_shorter_retry_after_does_not_shorten_block(clock):
+    bucket = AdaptiveTokenBucket()
+    bucket.on_rate_limited(retry_after=30)
+    bucket.on_rate_limited(retry_after=5)
+    assert bucket.blocked_until == 1030.0
+    assert bucket.rate == 5
+
+
+def test_parse_retry_after(clock):
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Tue, 14 Nov 2023 22:13:20 GMT") == pytest.approx(0.0)
@@ -0,0 +1,160 @@
+"""
+响应缓存测试：缓存 key 与判定规则、TTL 过期、按字节上限的 LRU 淘汰，以及流式重放。
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import config  # noqa: E402
+from src import response_cache as response_cache_module  # noqa: E402
+from src.response_cache import BYPASS, FORCE, ResponseCache, cache_key, cache_mode, replay_chunks  # noqa: E402
+
+MAX_BYTES = 4000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return 1_700_000_000.0 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(response_cache_module, "time", fake)
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_RESPONSE_CACHE_MB", MAX_BYTES / (1024 * 1024))
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_RESPONSE_CACHE_TTL", 60.0)
+    return fake
+
+
+def _completion(content: str, usage=None) -> dict:
+    result = {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 1, "model": "m",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+    if usage:
+        result["usage"] = usage
+    return result
+
+
+def _size(result: dict) -> int:
+    return len(json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def test_cache_key_ignores_transport_fields_and_key_order():
+    payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+    streamed = {"stream": True, "stream_options": {"include_usage": True}, **dict(reversed(payload.items()))}
+    assert cache_key(payload) == cache_key(streamed)
+    assert cache_key(payload) != cache_key({**payload, "temperature": 0.5})
+
+
+def test_cache_mode_header():
+    assert cache_mode(" Bypass ") == BYPASS
+    assert cache_mode("no-store") == BYPASS
+    assert cache_mode("force") == FORCE
+    assert cache_mode("maybe") is None
+    assert cache_mode(None) is None
+
+
+def test_only_deterministic_requests_are_cached(clock, monkeypatch):
+    cache = ResponseCache()
+    assert cache.should_cache({"temperature": 0}, None)
+    assert cache.should_cache({"temperature": 0.0}, None)
+    assert not cache.should_cache({"temperature": 0.7}, None)
+    assert not cache.should_cache({}, None)
+    assert not cache.should_cache({"temperature": False}, None)
+    assert cache.should_cache({"temperature": 0.7}, FORCE)
+    assert not cache.should_cache({"temperature": 0}, BYPASS)
+    assert cache.bypassed == 1
+
+    monkeypatch.setitem(config._config_cache, "CODEBUDDY_RESPONSE_CACHE_ENABLED", False)
+    assert not cache.should_cache({"temperature": 0}, FORCE)
+
+
+def test_hit_returns_a_fresh_copy(clock):
+    cache = ResponseCache()
+    cache.put("k", _completion("hello"))
+    first = cache.get("k")
+    first["choices"][0]["message"]["content"] = "changed"
+    clock.now += 5
+    second = cache.get("k")
+    assert second["choices"][0]["message"]["content"] == "hello"
+    assert second["created"] == int(clock.time())
+    assert cache.hits == 2 and cache.misses == 0
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache()
+    cache.put("k", _completion("hello"))
+    clock.now += 59.9
+    assert cache.get("k") is not None
+
+    clock.now += 0.1
+    assert cache.get("k") is None
+    assert cache.expired == 1 and cache.bytes == 0
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_rewriting_an_entry_resets_its_ttl_and_size(clock):
+    cache = ResponseCache()
+    cache.put("k", _completion("a" * 100))
+    clock.now += 50
+    cache.put("k", _completion("b"))
+    assert cache.bytes == _size(_completion("b"))
+    clock.now += 50
+    assert cache.get("k")["choices"][0]["message"]["content"] == "b"
+
+
+def test_byte_budget_evicts_least_recently_used(clock):
+    cache = ResponseCache()
+    entries = {key: _completion(key * 700) for key in "abcdef"}
+    entry_size = _size(entries["a"])
+    assert entry_size <= MAX_BYTES * response_cache_module.MAX_ENTRY_FRACTION
+    per_budget = MAX_BYTES // entry_size
+
+    for key in "abcd":
+        cache.put(key, entries[key])
+    assert cache.get("a") is not None  # a 变为最近使用
+
+    for key in "ef":
+        cache.put(key, entries[key])
+    assert cache.bytes <= MAX_BYTES
+    assert len(cache._entries) == per_budget
+    assert cache.evictions == 6 - per_budget
+    # 最久未使用的 b、c 先被淘汰，刚读过的 a 保留
+    assert cache.get("b") is None and cache.get("c") is None
+    assert cache.get("a") is not None and cache.get("f") is not None
+
+
+def test_oversized_response_is_not_cached(clock):
+    cache = ResponseCache()
+    cache.put("small", _completion("x"))
+    cache.put("big", _completion("x" * MAX_BYTES))
+    assert cache.get("big") is None
+    assert cache.get("small") is not None
+    assert cache.evictions == 0
+
+
+def test_replay_chunks_rebuilds_the_stream():
+    usage = {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}
+    body = b"".join(replay_chunks(_completion("hello", usage), include_usage=True))
+    blocks = body.decode("utf-8").split("\n\n")
+    assert blocks[-2:] == ["data: [DONE]", ""]
+    events = [json.loads(block[len("data: "):]) for block in blocks[:-2]]
+    assert all(event["object"] == "chat.completion.chunk" for event in events)
+    assert events[0]["choices"][0]["delta"] == {"role": "assistant", "content": "hello"}
+    assert events[1]["choices"][0]["finish_reason"] == "stop"
+    assert events[2]["choices"] == [] and events[2]["usage"] == usage
+
+    without_usage = b"".join(replay_chunks(_completion("hello", usage), include_usage=False))
+    assert b'"usage"' not in without_usage
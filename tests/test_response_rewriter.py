@@ -0,0 +1,126 @@
+"""
+响应反向替换的分块测试：把上游流在每一个字节（字符）位置切开，输出必须与不切分时一致
+
+覆盖切点落在多字节 UTF-8 字符中间、关键词中间和 SSE "data:" 行中间的情况。
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.keyword_rewriter import CompiledRules, StreamRewriter  # noqa: E402
+from src.response_rewriter import SSEContentRewriter  # noqa: E402
+
+RULES = {
+    "CodeBuddy Code": "Claude Code",
+    "CodeBuddy": "Claude",
+    "腾讯云": "Anthropic Cloud",
+    "腾讯": "Anthropic",
+}
+
+TEXT = "我是 CodeBuddy Code，由腾讯云和腾讯提供。CodeBuddy 说：你好 🌍 CodeBud"
+
+
+def _sse(chunks) -> bytes:
+    body = b"".join(
+        b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n" for chunk in chunks
+    )
+    return body + b"data: [DONE]\n\n"
+
+
+def _content_chunk(content: str, finish_reason=None) -> dict:
+    return {
+        "id": "x", "object": "chat.completion.chunk", "model": "m",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}]
+    }
+
+
+# 关键词与多字节字符被上游拆在不同的增量块中
+STREAM = _sse([
+    _content_chunk("我是 CodeBu"),
+    _content_chunk("ddy Code，由腾"),
+    _content_chunk("讯云和腾讯提供。Code"),
+    _content_chunk("Buddy 说：你好 🌍 CodeBud"),
+    {"id": "x", "object": "chat.completion.chunk", "model": "m",
+     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+])
+
+
+@pytest.fixture(scope="module")
+def compiled() -> CompiledRules:
+    return CompiledRules(RULES)
+
+
+def _stream_rewrite(compiled: CompiledRules, pieces) -> str:
+    rewriter = StreamRewriter(compiled)
+    return "".join(rewriter.feed(piece) for piece in pieces) + rewriter.flush()
+
+
+def _sse_rewrite(compiled: CompiledRules, pieces) -> bytes:
+    rewriter = SSEContentRewriter(compiled)
+    return b"".join(rewriter.feed(piece) for piece in pieces) + rewriter.flush()
+
+
+def _streamed_content(body: bytes) -> str:
+    """按 SSE 事件拼接所有 delta.content"""
+    parts = []
+    for block in body.decode("utf-8").split("\n\n"):
+        if not block.startswith("data: ") or block == "data: [DONE]":
+            continue
+        for choice in json.loads(block[len("data: "):]).get("choices") or []:
+            parts.append((choice.get("delta") or {}).get("content") or "")
+    return "".join(parts)
+
+
+def test_stream_rewriter_every_split(compiled):
+    expected = compiled.rewrite(TEXT)
+    for offset in range(len(TEXT) + 1):
+        assert _stream_rewrite(compiled, [TEXT[:offset], TEXT[offset:]]) == expected, offset
+
+
+def test_stream_rewriter_every_pair_of_splits(compiled):
+    expected = compiled.rewrite(TEXT)
+    for first in range(len(TEXT) + 1):
+        for second in range(first, len(TEXT) + 1):
+            pieces = [TEXT[:first], TEXT[first:second], TEXT[second:]]
+            assert _stream_rewrite(compiled, pieces) == expected, (first, second)
+
+
+def test_stream_rewriter_one_character_at_a_time(compiled):
+    assert _stream_rewrite(compiled, list(TEXT)) == compiled.rewrite(TEXT)
+
+
+def test_sse_rewriter_unsplit_content(compiled):
+    expected = compiled.rewrite("".join(
+        json.loads(block[len("data: "):])["choices"][0]["delta"].get("content", "")
+        for block in STREAM.decode("utf-8").split("\n\n")
+        if block.startswith("data: {")
+    ))
+    output = _sse_rewrite(compiled, [STREAM])
+    assert _streamed_content(output) == expected
+    assert output.endswith(b"data: [DONE]\n\n")
+
+
+def test_sse_rewriter_every_byte_split(compiled):
+    # 切点覆盖多字节 UTF-8 字符内部、关键词内部以及 "data:" 行内部
+    expected = _sse_rewrite(compiled, [STREAM])
+    for offset in range(len(STREAM) + 1):
+        assert _sse_rewrite(compiled, [STREAM[:offset], STREAM[offset:]]) == expected, offset
+
+
+def test_sse_rewriter_one_byte_at_a_time(compiled):
+    expected = _sse_rewrite(compiled, [STREAM])
+    pieces = [STREAM[i:i + 1] for i in range(len(STREAM))]
+    assert _sse_rewrite(compiled, pieces) == expected
+
+
+def test_sse_rewriter_drains_without_finish_reason(compiled):
+    # 上游没有发送 finish_reason 时，暂存的关键词开头在 [DONE] 之前补发
+    stream = _sse([_content_chunk("你好 CodeBud")])
+    expected = _sse_rewrite(compiled, [stream])
+    assert _streamed_content(expected) == "你好 CodeBud"
+    for offset in range(len(stream) + 1):
+        assert _sse_rewrite(compiled, [stream[:offset], stream[offset:]]) == expected, offset
@@ -0,0 +1,89 @@
+"""
+流式合并测试：增量文本与工具调用的合并，以及 is_complete 在等待 / 不等待 usage 块时的判定。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.stream_aggregator import ChatCompletionAggregator  # noqa: E402
+
+
+def _chunk(delta=None, finish_reason=None, index=0, **extra) -> dict:
+    choice = {"index": index, "delta": delta or {}, "finish_reason": finish_reason}
+    return {"id": "x", "object": "chat.completion.chunk", "created": 1, "model": "m", "choices": [choice], **extra}
+
+
+USAGE = {"prompt_tokens": 3, "completion_tokens": 4, "total_tokens": 7}
+
+
+def test_complete_on_finish_reason_without_usage():
+    aggregator = ChatCompletionAggregator(expect_usage=False)
+    assert not aggregator.add_chunk(_chunk({"role": "assistant", "content": "Hel"}))
+    assert not aggregator.is_complete
+    assert aggregator.add_chunk(_chunk({"content": "lo"}, finish_reason="stop"))
+    assert aggregator.is_complete and not aggregator.done
+
+
+def test_waits_for_usage_chunk_when_expected():
+    aggregator = ChatCompletionAggregator(expect_usage=True)
+    aggregator.add_chunk(_chunk({"content": "Hello"}))
+    assert not aggregator.add_chunk(_chunk({}, finish_reason="stop"))
+    # include_usage 时所有 choice 结束后还有一个 choices 为空、携带 usage 的块
+    assert aggregator.add_chunk({"id": "x", "object": "chat.completion.chunk", "choices": [], "usage": USAGE})
+    assert aggregator.build()["usage"] == USAGE
+
+
+def test_done_marker_completes_without_usage():
+    aggregator = ChatCompletionAggregator(expect_usage=True)
+    aggregator.add_chunk(_chunk({"content": "Hello"}, finish_reason="stop"))
+    assert not aggregator.is_complete
+    aggregator.mark_done()
+    assert aggregator.is_complete
+    assert "usage" not in aggregator.build()
+
+
+def test_not_complete_until_every_choice_finishes():
+    aggregator = ChatCompletionAggregator()
+    aggregator.add_chunk(_chunk({"content": "a"}, index=0))
+    aggregator.add_chunk(_chunk({"content": "b"}, index=1))
+    assert not aggregator.add_chunk(_chunk({}, finish_reason="stop", index=0))
+    assert aggregator.add_chunk(_chunk({}, finish_reason="length", index=1))
+    choices = aggregator.build()["choices"]
+    assert [c["message"]["content"] for c in choices] == ["a", "b"]
+    assert [c["finish_reason"] for c in choices] == ["stop", "length"]
+
+
+def test_no_choices_is_never_complete():
+    aggregator = ChatCompletionAggregator()
+    assert not aggregator.add_chunk({"id": "x", "choices": [], "usage": USAGE})
+    assert not aggregator.is_complete
+    assert aggregator.build() is None
+
+
+def test_merges_text_and_tool_calls():
+    aggregator = ChatCompletionAggregator()
+    aggregator.add_chunk(_chunk({"role": "assistant", "content": "", "reasoning_content": "think"}))
+    aggregator.add_chunk(_chunk({"tool_calls": [
+        {"index": 0, "id": "call_1", "type": "function", "function": {"name": "lookup", "arguments": '{"q":'}}
+    ]}))
+    aggregator.add_chunk(_chunk({"tool_calls": [{"index": 0, "function": {"arguments": '"x"}'}}]}))
+    aggregator.add_chunk(_chunk({}, finish_reason="tool_calls"))
+
+    result = aggregator.build()
+    assert result["object"] == "chat.completion"
+    message = result["choices"][0]["message"]
+    assert message["role"] == "assistant"
+    assert message["reasoning_content"] == "think"
+    assert message["tool_calls"] == [{
+        "index": 0, "id": "call_1", "type": "function",
+        "function": {"name": "lookup", "arguments": '{"q":"x"}'}
+    }]
+    assert result["choices"][0]["finish_reason"] == "tool_calls"
+
+
+def test_error_payload_is_recorded():
+    aggregator = ChatCompletionAggregator()
+    aggregator.add_chunk({"error": {"message": "quota exceeded"}})
+    assert aggregator.error == {"message": "quota exceeded"}
+    assert not aggregator.is_complete
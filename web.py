@@ -13,9 +13,19 @@ from src.codebuddy_router import router as codebuddy_router
 from src.codebuddy_auth_router import router as codebuddy_auth_router
 from src.settings_router import router as settings_router
 from src.frontend_router import router as frontend_router
-from src.health_router import router as health_router
-
-from config import get_server_host, get_server_port, get_log_level
+from src.health_router import router as health_router, mark_ready
+from src.metrics_router import router as metrics_router
+from src.metrics import metrics, MetricsMiddleware
+from src.http_pool import upstream_http_pool
+from src.credential_watcher import credential_watcher
+from src.persistence import persistence_writer
+from src.shared_state import shared_state
+from src.stats_store import stats_store
+
+from config import (
+    get_server_host, get_server_port, get_log_level,
+    get_warmup_connections, get_warmup_interval, get_workers
+)
 
 # 配置日志
 logging.basicConfig(
@@ -29,8 +39,35 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     logger.info("Starting CodeBuddy2API Service")
-    yield
-    logger.info("CodeBuddy2API Service stopped")
+    await upstream_http_pool.start()
+
+    # 预热上游连接，预热完成后才报告就绪，避免滚动发布时首批请求承担握手延迟
+    warmup_connections = get_warmup_connections()
+    if warmup_connections > 0:
+        await upstream_http_pool.warm_up(warmup_connections)
+        upstream_http_pool.start_rewarm_loop(warmup_connections, get_warmup_interval())
+    # 多 worker 时加入共享状态（心跳、leader 选举、统计发布）
+    shared_state.start()
+    # 恢复上次保存的使用统计，并在后台定期写入快照
+    await stats_store.start()
+    # 采样事件循环延迟
+    metrics.start()
+    # 后台监视凭证目录的增量变化
+    credential_watcher.start()
+    mark_ready()
+
+    try:
+        yield
+    finally:
+        mark_ready(False)
+        await credential_watcher.stop()
+        # 在退出共享状态（交出 leader）之前写入最后一次统计快照
+        await stats_store.stop()
+        await shared_state.stop()
+        await metrics.stop()
+        await persistence_writer.flush()
+        await upstream_http_pool.close()
+        logger.info("CodeBuddy2API Service stopped")
 
 
 # 创建FastAPI应用
@@ -50,6 +87,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 按路由统计请求数（纯 ASGI 中间件，不包装流式响应体）
+app.add_middleware(MetricsMiddleware)
+
 # 挂载前端路由
 app.include_router(
     frontend_router,
@@ -84,6 +124,12 @@ app.include_router(
     tags=["Health Check"]
 )
 
+# 挂载 Prometheus 指标路由
+app.include_router(
+    metrics_router,
+    tags=["Metrics"]
+)
+
 
 @app.get("/")
 async def root():
@@ -96,6 +142,8 @@ async def root():
             "models": "/codebuddy/v1/models",
             "chat": "/codebuddy/v1/chat/completions",
             "credentials": "/codebuddy/v1/credentials",
+            "ready": "/api/ready",
+            "metrics": "/metrics",
             "auth_start": "/codebuddy/auth/start",
             "auth_poll": "/codebuddy/auth/poll",
             "auth_callback": "/codebuddy/auth/callback",
@@ -111,11 +159,14 @@ if __name__ == "__main__":
     
     port = get_server_port()
     host = get_server_host()
+    workers = get_workers()
     
     logger.info("=" * 60)
     logger.info("Starting CodeBuddy2API")
     logger.info("=" * 60)
     logger.info(f"Main Service: http://{host}:{port}")
+    if workers > 1:
+        logger.info(f"Workers: {workers} (shared state: {shared_state.db_path})")
     logger.info("=" * 60)
     logger.info("Web Interface:")
     logger.info(f"   Admin Panel: http://{host}:{port}/")
@@ -137,4 +188,13 @@ if __name__ == "__main__":
     config.loglevel = "INFO"
     config.use_colors = True
 
-    asyncio.run(serve(app, config))
\ No newline at end of file
+    if workers > 1:
+        from hypercorn.run import run
+
+        # 每个 worker 进程独立导入 web:app，通过共享状态库协调轮换与统计；先清掉上次运行残留的 worker 状态
+        shared_state.reset()
+        config.application_path = "web:app"
+        config.workers = workers
+        run(config)
+    else:
+        asyncio.run(serve(app, config))
\ No newline at end of file